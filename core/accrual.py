@@ -0,0 +1,174 @@
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from .models import InsuranceContribution, InsuranceDaysAccrual
+
+
+# Insurance days accrual
+# -----------------------------------------------------------------------------
+# InsuranceDaysAccrual keeps each party's lifetime insurance days, in total,
+# per year (of the start date) and per branch (coverage package), so the
+# insured's home page reads one row whatever the length of the history.
+#
+# Single contribution writes apply their difference to the party's row
+# (core/signals.py): the old values of an update are read in pre_save, and
+# the row is locked while it is changed. Bulk writes skip the signals, so the
+# loaders and the APD ingestion recompute the parties they touched.
+# check_insurance_days() re-derives every counter from the contributions with
+# one streamed GROUP BY and reports (or fixes) the ones that drifted.
+
+ACCRUAL_BATCH_SIZE = getattr(settings, 'ACCRUAL_BATCH_SIZE', 2000)
+
+
+def _year(value):
+    return timezone.localtime(value).year if timezone.is_aware(value) else value.year
+
+
+def contribution_days(contribution):
+    """(party pk, year, branch, days) a contribution adds to the accrual."""
+    return (
+        contribution.party_id_id, _year(contribution.start_date),
+        contribution.coverage_package_id, contribution.insurance_days,
+    )
+
+
+def _add(counter, key, days):
+    key = str(key)
+    counter[key] = counter.get(key, 0) + days
+    if not counter[key]:
+        del counter[key]
+
+
+def _accrual(party_pk, years, branches, now):
+    return InsuranceDaysAccrual(
+        party_id_id=party_pk,
+        total_days=sum(years.values()),
+        days_by_year=years,
+        days_by_branch=branches,
+        last_change_date=now,
+    )
+
+
+def _derive(party_pks=None):
+    """Yield (party pk, {year: days}, {branch: days}) from the contributions, party by party."""
+    contributions = InsuranceContribution.objects.all()
+    if party_pks is not None:
+        contributions = contributions.filter(party_id__in=party_pks)
+    rows = (
+        contributions
+        .annotate(year=ExtractYear('start_date'))
+        .values_list('party_id', 'year', 'coverage_package_id')
+        .annotate(days=Sum('insurance_days'))
+        .order_by('party_id')
+    )
+    party_pk, years, branches = None, {}, {}
+    for row_party_pk, year, branch, days in rows.iterator(chunk_size=ACCRUAL_BATCH_SIZE):
+        if row_party_pk != party_pk:
+            if party_pk is not None:
+                yield party_pk, years, branches
+            party_pk, years, branches = row_party_pk, {}, {}
+        _add(years, year, days or 0)
+        _add(branches, branch, days or 0)
+    if party_pk is not None:
+        yield party_pk, years, branches
+
+
+def refresh_insurance_days(party_pks, batch_size=ACCRUAL_BATCH_SIZE):
+    """Recompute the accrual of the given parties from their contributions. Returns the number of rows."""
+    party_pks = list(party_pks)
+    now = timezone.now()
+    count = 0
+    for start in range(0, len(party_pks), batch_size):
+        chunk = party_pks[start:start + batch_size]
+        with transaction.atomic():
+            InsuranceDaysAccrual.objects.filter(party_id__in=chunk).delete()
+            accruals = [_accrual(*derived, now) for derived in _derive(chunk)]
+            InsuranceDaysAccrual.objects.bulk_create(accruals)
+        count += len(accruals)
+    return count
+
+
+def apply_contribution_days(changes):
+    """
+    Apply the changes of one contribution write, (party pk, year, branch,
+    days) tuples as returned by contribution_days(), days negated for the
+    values removed.
+    """
+    by_party = defaultdict(list)
+    for party_pk, year, branch, days in changes:
+        if days:
+            by_party[party_pk].append((year, branch, days))
+    for party_pk, party_changes in by_party.items():
+        with transaction.atomic():
+            accrual = InsuranceDaysAccrual.objects.select_for_update().filter(party_id=party_pk).first()
+            if accrual is None:
+                # Never computed: derive it, the changes are already in the table
+                refresh_insurance_days([party_pk])
+                continue
+            for year, branch, days in party_changes:
+                _add(accrual.days_by_year, year, days)
+                _add(accrual.days_by_branch, branch, days)
+                accrual.total_days += days
+            accrual.last_change_date = timezone.now()
+            accrual.save()
+
+
+def get_insurance_days(party_pk):
+    """Return the InsuranceDaysAccrual of a party, computing it if missing (None without contributions)."""
+    accrual = InsuranceDaysAccrual.objects.filter(party_id=party_pk).first()
+    if accrual is None and refresh_insurance_days([party_pk]):
+        accrual = InsuranceDaysAccrual.objects.filter(party_id=party_pk).first()
+    return accrual
+
+
+def check_insurance_days(fix=False, batch_size=ACCRUAL_BATCH_SIZE):
+    """
+    Compare every stored accrual with one derived from the contributions.
+    Returns {'checked', 'missing', 'stale', 'orphaned'} counts; with `fix`
+    the wrong rows are rewritten and the orphaned ones deleted.
+    """
+    counts = defaultdict(int)
+    derived = _derive()
+    now = timezone.now()
+    seen = set()
+    while True:
+        batch = list(islice(derived, batch_size))
+        if not batch:
+            break
+        stored = InsuranceDaysAccrual.objects.in_bulk([party_pk for party_pk, _, _ in batch])
+        wrong = []
+        for party_pk, years, branches in batch:
+            seen.add(party_pk)
+            accrual = stored.get(party_pk)
+            if accrual is None:
+                counts['missing'] += 1
+            elif (accrual.total_days, accrual.days_by_year, accrual.days_by_branch) != (sum(years.values()), years, branches):
+                counts['stale'] += 1
+            else:
+                continue
+            wrong.append(_accrual(party_pk, years, branches, now))
+        counts['checked'] += len(batch)
+        if fix and wrong:
+            InsuranceDaysAccrual.objects.bulk_create(
+                wrong,
+                update_conflicts=True,
+                unique_fields=['party_id'],
+                update_fields=['total_days', 'days_by_year', 'days_by_branch', 'last_change_date'],
+            )
+
+    # Accruals of parties that no longer have contributions
+    orphaned = [
+        party_pk for party_pk in InsuranceDaysAccrual.objects.values_list('party_id', flat=True).iterator()
+        if party_pk not in seen
+    ]
+    counts['orphaned'] = len(orphaned)
+    if fix:
+        for start in range(0, len(orphaned), batch_size):
+            InsuranceDaysAccrual.objects.filter(party_id__in=orphaned[start:start + batch_size]).delete()
+    return {key: counts[key] for key in ('checked', 'missing', 'stale', 'orphaned')}
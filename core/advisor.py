@@ -0,0 +1,135 @@
+import json
+import re
+
+from django.core.cache import cache
+from django.db import connection
+
+from .benchmarks import request_context, request_view, role_clients, view_requests
+
+
+# Query plan advisor
+# -----------------------------------------------------------------------------
+# Requests every view (same views and logins as the benchmarks, see
+# core/benchmarks.py) with cold caches, captures the SELECT statements it
+# issues and runs EXPLAIN on each of them. Full scans of tables above a size
+# threshold are reported (a filter that no index serves), and optionally the
+# sorts no index provides (SQLite). Run it against a large generated dataset:
+# on small tables the planner rightly prefers sequential scans.
+
+# SQLite: "SCAN core_party AS U0", "SCAN core_party USING INDEX ..." (index
+# scans are fine), PostgreSQL: "Seq Scan" plan nodes
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(?P<table>\w+)(?: AS \w+)?(?P<rest>.*)$')
+
+
+class QueryCapture:
+    """Database execute wrapper collecting the SELECT statements (deduplicated)."""
+
+    def __init__(self):
+        self.queries = []
+        self._seen = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            key = (sql, repr(params))
+            if key not in self._seen:
+                self._seen.add(key)
+                self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def capture_view_queries(only=None):
+    """Return [(view name, [(sql, params), ...])] for the selected views."""
+    clients = role_clients()
+    captured = []
+    with request_context():
+        for name, role, url, params in view_requests(only):
+            cache.clear()
+            capture = QueryCapture()
+            with connection.execute_wrapper(capture):
+                request_view(clients[role], url, params)
+            captured.append((name, capture.queries))
+    return captured
+
+
+def _plan_sqlite(cursor, sql, params):
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    issues = []
+    for row in cursor.fetchall():
+        detail = row[-1]
+        match = _SQLITE_SCAN.match(detail)
+        if match and 'USING' not in match.group('rest'):
+            issues.append(('scan', match.group('table'), detail))
+        elif detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+            issues.append(('sort', None, detail))
+    return issues
+
+
+def _walk_pg_plan(node, issues):
+    if node.get('Node Type') == 'Seq Scan':
+        detail = f"Seq Scan on {node['Relation Name']}"
+        if node.get('Filter'):
+            detail += f" (filter: {node['Filter']})"
+        issues.append(('scan', node['Relation Name'], detail))
+    for child in node.get('Plans', []):
+        _walk_pg_plan(child, issues)
+
+
+def _plan_postgresql(cursor, sql, params):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    issues = []
+    _walk_pg_plan(plan[0]['Plan'], issues)
+    return issues
+
+
+def explain(sql, params):
+    """Return the plan issues [(kind, table, detail)] of one statement."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            return _plan_postgresql(cursor, sql, params)
+        if connection.vendor == 'sqlite':
+            return _plan_sqlite(cursor, sql, params)
+    raise NotImplementedError(f"EXPLAIN is not supported on {connection.vendor}.")
+
+
+def table_sizes():
+    """Row count of every table (estimated on PostgreSQL)."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r'")
+            return dict(cursor.fetchall())
+        sizes = {}
+        for table in connection.introspection.table_names(cursor):
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            sizes[table] = cursor.fetchone()[0]
+        return sizes
+
+
+def advise(only=None, min_rows=1000, include_sorts=False):
+    """
+    Explain the queries of every selected view. Returns a list of findings:
+    dicts with view, kind ('scan' or 'sort'), table, rows, detail, sql and
+    params.
+    """
+    sizes = table_sizes()
+    findings = []
+    for name, queries in capture_view_queries(only):
+        for sql, params in queries:
+            for kind, table, detail in explain(sql, params):
+                rows = sizes.get(table)
+                if kind == 'scan' and (rows or 0) < min_rows:
+                    continue
+                if kind == 'sort' and not include_sorts:
+                    continue
+                findings.append({
+                    'view': name,
+                    'kind': kind,
+                    'table': table,
+                    'rows': rows,
+                    'detail': detail,
+                    'sql': sql,
+                    'params': [str(param) for param in params or ()],
+                })
+    return findings
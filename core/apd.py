@@ -0,0 +1,487 @@
+import csv
+import os
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from .calculator import SHARES, calculate_contribution, get_rate_table, kpk_code, period_of, to_cents
+from .catalog import get_code_catalog
+from .ledger import ACCOUNT_TYPE_CURRENT, schedule_debt_summary_refresh
+from .loaders import (
+    TWO_PLACES, contribution_writers, refresh_account_balances, reserve_ids, write_contributions, write_obligations
+)
+from .models import (
+    Account, AccountTransaction, ApdSubmission, ApdSubmissionError, IdSequence, InsuranceContribution, Party,
+    PartyRole, PartyRoleType
+)
+from .accrual import refresh_insurance_days
+from .pensions import refresh_pension_projections
+from .prefill import ama_identifiers, employee_party_pks, rebuild_latest_contributions
+from .rollups import refresh_contribution_rollups
+from .validity import OUT_OF_PERIOD, STATUS_MESSAGES, UNKNOWN, VALID, get_validity_index
+
+
+# APD file ingestion
+# -----------------------------------------------------------------------------
+# An APD file is a CSV with one line per employee and earnings type (see
+# APD_COLUMNS). Ingestion reads the stored upload as a stream in chunks of
+# APD_CHUNK_SIZE lines, so memory is bounded by the chunk whatever the file
+# size, in two passes:
+#
+# 1. validate: every line is parsed and checked (period, codes valid in the
+#    period, employee, total against the KPK rates) without writing anything;
+#    a file with errors is rejected as a whole, with the first APD_MAX_ERRORS
+#    messages.
+# 2. post: each chunk is written with the bulk TableWriters (COPY on
+#    PostgreSQL) in its own transaction, together with the submission's
+#    lines_posted counter. A failed ingestion is resumed after the last
+#    committed chunk, and since every row has a business ID derived from its
+#    line number, posting a chunk twice updates instead of duplicating.
+#
+# Completing the submission posts the employer's APD obligation (the total of
+# the file), recomputes the touched account balances, the prefill pointers,
+# the contribution rollups, the insurance days and the pension projections,
+# which the bulk writes do not maintain.
+
+APD_UPLOAD_DIR = getattr(settings, 'APD_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'uploads', 'apd'))
+APD_CHUNK_SIZE = getattr(settings, 'APD_CHUNK_SIZE', 5000)
+APD_MAX_ERRORS = getattr(settings, 'APD_MAX_ERRORS', 1000)
+# Uploads are only stored and queued: `manage.py ingest_apd --resume` (run
+# from cron or a worker) ingests them while the page polls their progress.
+# True ingests within the upload request (development, small files).
+APD_PROCESS_ON_UPLOAD = getattr(settings, 'APD_PROCESS_ON_UPLOAD', False)
+
+# Business IDs of APD rows start here, away from the loader (line number) and
+# generator (FIRST_LINE_ID) ranges
+APD_FIRST_LINE_ID = getattr(settings, 'APD_FIRST_LINE_ID', 1_500_000_000)
+APD_ID_SEQUENCE = 'apd_line'
+
+APD_COLUMNS = [
+    'ama', 'kad', 'eid', 'kpk', 'earnings_type', 'days',
+    'start_date', 'end_date', 'gross_earnings', 'total_contribution',
+]
+
+CREATED_BY = 'apd'
+
+_UPLOAD_BLOCK_SIZE = 64 * 1024
+
+
+class ApdFileError(ValueError):
+    """The uploaded file cannot be ingested at all (format, employer)."""
+
+
+@lru_cache(maxsize=1024)
+def _parse_date(value):
+    # Lines of a file share a handful of dates
+    return timezone.make_aware(datetime.strptime(value.strip(), '%d/%m/%Y'))
+
+
+def _parse_amount(value):
+    amount = Decimal(value.strip())
+    if amount != amount.quantize(TWO_PLACES):
+        raise InvalidOperation
+    return amount
+
+
+def iter_file_lines(path, start=0):
+    """Yield (line number, row dict) of the data lines after `start` (header excluded)."""
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in APD_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ApdFileError(f"Missing columns: {', '.join(missing)}")
+        for number, row in enumerate(reader, start=1):
+            if number > start:
+                yield number, row
+
+
+def count_file_lines(path):
+    return sum(1 for _ in iter_file_lines(path))
+
+
+def _role_type_ids(code):
+    return PartyRoleType.objects.filter(role_type_code=code).values('role_type_id')
+
+
+def _employer_account_pk(employer):
+    return (
+        Account.objects
+        .filter(party_role_id__party_id=employer, party_role_id__role_type_id__in=_role_type_ids('EMP'),
+                account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+        .first()
+    )
+
+
+def reserve_line_ids(count):
+    """Reserve `count` consecutive business IDs for APD rows (see loaders.reserve_ids). Returns a range."""
+    first = APD_FIRST_LINE_ID
+    if not IdSequence.objects.filter(name=APD_ID_SEQUENCE).exists():
+        # Start after the submissions registered before the sequence
+        end = ApdSubmission.objects.aggregate(end=Max(F('first_line_id') + F('lines_total')))['end']
+        if end is not None:
+            first = max(first, end + 1)
+    return reserve_ids(APD_ID_SEQUENCE, count, first)
+
+
+def create_submission(employer, period, upload, created_by=CREATED_BY):
+    """
+    Store an upload (Django UploadedFile or any object with chunks()/name)
+    block by block and register its submission. Raises ApdFileError.
+    """
+    if not 1 <= period % 100 <= 12:
+        raise ApdFileError("The period must be a YYYYMM month.")
+    if _employer_account_pk(employer) is None:
+        raise ApdFileError("The employer has no contributions account.")
+
+    os.makedirs(APD_UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(APD_UPLOAD_DIR, f"{uuid.uuid4().hex}.csv")
+    with open(path, 'wb') as f:
+        for block in upload.chunks(_UPLOAD_BLOCK_SIZE):
+            f.write(block)
+
+    try:
+        lines_total = count_file_lines(path)
+    except (ApdFileError, UnicodeDecodeError, csv.Error) as e:
+        os.remove(path)
+        raise ApdFileError(str(e) if isinstance(e, ApdFileError) else f"Unreadable file: {e}")
+    if not lines_total:
+        os.remove(path)
+        raise ApdFileError("The file has no lines.")
+
+    # lines_total + 1 business IDs: the last one is the employer obligation
+    first_line_id = reserve_line_ids(lines_total + 1)[0]
+    return ApdSubmission.objects.create(
+        party_id=employer,
+        period=period,
+        receipt_number=f"APD-{first_line_id:010d}",
+        file_name=os.path.basename(getattr(upload, 'name', '') or path)[:255],
+        file_path=path,
+        first_line_id=first_line_id,
+        lines_total=lines_total,
+        created_by=created_by,
+        last_updated_by=created_by,
+    )
+
+
+class ApdIngestion:
+    """
+    Validate and post one ApdSubmission. `progress` is called with the
+    submission after every chunk. run() can be called again on a failed
+    submission to resume it.
+    """
+
+    def __init__(self, submission, chunk_size=APD_CHUNK_SIZE, progress=None):
+        self.submission = submission
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.employer = submission.party_id
+        self.catalog = get_code_catalog()
+        self.employees = None
+        self.writers = None
+        try:
+            self.rate_table = get_rate_table()
+            self.validity_index = get_validity_index()
+        except ImportError:
+            self.rate_table = self.validity_index = None
+
+    def run(self):
+        """Process the submission to COMPLETED or REJECTED. Returns the submission."""
+        submission = self.submission
+        if submission.state in (ApdSubmission.STATE_COMPLETED, ApdSubmission.STATE_REJECTED):
+            return submission
+        try:
+            if submission.lines_validated < submission.lines_total:
+                if not self.validate():
+                    return submission
+            self.post()
+            self.complete()
+        except Exception as e:
+            self._save(state=ApdSubmission.STATE_FAILED, error_message=str(e)[:1000])
+            raise
+        return submission
+
+    def _save(self, **fields):
+        for name, value in fields.items():
+            setattr(self.submission, name, value)
+        self.submission.last_updated_by = CREATED_BY
+        self.submission.save(update_fields=list(fields) + ['last_updated_by', 'last_update_date'])
+
+    def _chunks(self, start=0):
+        lines = iter_file_lines(self.submission.file_path, start)
+        while True:
+            chunk = list(islice(lines, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    # Validation --------------------------------------------------------------
+
+    def validate(self):
+        """First pass: check every line. Returns False (and rejects the submission) on errors."""
+        ApdSubmissionError.objects.filter(submission=self.submission).delete()
+        self._save(state=ApdSubmission.STATE_VALIDATING, lines_validated=0, lines_rejected=0, error_message='')
+
+        rejected = 0
+        for chunk in self._chunks():
+            _, errors = self.check_chunk(chunk)
+            stored = max(0, APD_MAX_ERRORS - rejected)
+            ApdSubmissionError.objects.bulk_create([
+                ApdSubmissionError(submission=self.submission, line_number=number + 1, message=message[:255])
+                for number, message in errors[:stored]
+            ])
+            rejected += len(errors)
+            self._save(lines_validated=chunk[-1][0], lines_rejected=rejected)
+            if self.progress:
+                self.progress(self.submission)
+
+        if rejected:
+            self._save(state=ApdSubmission.STATE_REJECTED, error_message=f"{rejected} line(s) failed validation.")
+            return False
+        return True
+
+    def _employee_parties(self):
+        if self.employees is None:
+            employer_role_pk = (
+                PartyRole.objects.filter(party_id=self.employer, role_type_id__in=_role_type_ids('EMP'))
+                .order_by('pk').values_list('pk', flat=True).first()
+            )
+            self.employees = set(
+                row['relation_to__party_id'] for row in employee_party_pks(employer_role_pk)
+            )
+        return self.employees
+
+    def _resolve(self, amas):
+        """{AMA: (party pk, party_id, CONTRIB account pk)} of the chunk's AMAs."""
+        parties = {}
+        for party_pk, ama in (
+            ama_identifiers().filter(identifier_value__in=amas).order_by('-pk')
+            .values_list('party_id', 'identifier_value')
+        ):
+            parties[ama] = party_pk
+        accounts = {}
+        for party_pk, account_pk in (
+            Account.objects
+            .filter(party_role_id__party_id__in=parties.values(), party_role_id__role_type_id__in=_role_type_ids('INS'),
+                    account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT)
+            .order_by('-pk')
+            .values_list('party_role_id__party_id', 'pk')
+        ):
+            accounts[party_pk] = account_pk
+        party_ids = dict(Party.objects.filter(pk__in=parties.values()).values_list('pk', 'party_id'))
+        return {
+            ama: (party_pk, party_ids[party_pk], accounts.get(party_pk))
+            for ama, party_pk in parties.items()
+        }
+
+    def _parse(self, row):
+        if None in row or None in row.values():
+            raise ValueError(f"Expected {len(APD_COLUMNS)} columns")
+        line = {
+            'ama': (row['ama'] or '').strip(),
+            'kad': (row['kad'] or '').strip(),
+            'eid': (row['eid'] or '').strip(),
+            'kpk': kpk_code(row['kpk'] or ''),
+        }
+        try:
+            line['earnings_type'] = int(row['earnings_type'])
+            line['days'] = int(row['days'] or 0)
+        except ValueError:
+            raise ValueError("earnings_type and days must be integers")
+        try:
+            line['start_date'] = _parse_date(row['start_date'])
+            line['end_date'] = _parse_date(row['end_date'])
+        except ValueError:
+            raise ValueError("Dates must be DD/MM/YYYY")
+        try:
+            line['gross'] = _parse_amount(row['gross_earnings'])
+            line['total'] = _parse_amount(row['total_contribution'])
+        except (InvalidOperation, AttributeError):
+            raise ValueError("Amounts must be numbers with up to 2 decimals")
+
+        if not 0 <= line['days'] <= 31:
+            raise ValueError(f"Invalid insurance days: {line['days']}")
+        if period_of(line['start_date']) != self.submission.period or period_of(line['end_date']) != self.submission.period:
+            raise ValueError(f"Dates outside the period {self.submission.period}")
+        if line['end_date'] < line['start_date']:
+            raise ValueError("end_date is before start_date")
+        if line['gross'] < 0 or line['total'] < 0:
+            raise ValueError("Amounts must not be negative")
+        return line
+
+    def _validity(self, lines):
+        """Validity status (see core.validity) of parsed lines in the period, one vectorized pass if NumPy is there."""
+        period = self.submission.period
+        if self.validity_index is None:
+            return [
+                VALID if self.catalog.valid_at(line['kad'], line['eid'], line['kpk'], period)
+                else OUT_OF_PERIOD if self.catalog.exists(line['kad'], line['eid'], line['kpk'])
+                else UNKNOWN
+                for line in lines
+            ]
+        return self.validity_index.check(
+            [line['kad'] for line in lines],
+            [line['eid'] for line in lines],
+            [line['kpk'] for line in lines],
+            period,
+        ).tolist()
+
+    def _expected_totals(self, lines):
+        """Calculated totals (Decimal or None) of parsed lines, one vectorized pass if NumPy is there."""
+        if self.rate_table is None:
+            results = [
+                calculate_contribution(line['gross'], line['kpk'], self.submission.period, self.catalog)
+                for line in lines
+            ]
+            return [result['total'] if result else None for result in results]
+        result = self.rate_table.calculate(
+            to_cents(line['gross'] for line in lines),
+            [line['kpk'] for line in lines],
+            [self.submission.period] * len(lines),
+        )
+        return [
+            Decimal(int(cents)).scaleb(-2) if found else None
+            for cents, found in zip(result[SHARES[2]], result['found'])
+        ]
+
+    def check_chunk(self, chunk):
+        """Validate a chunk of (number, row). Returns ([(number, line)], [(number, message)])."""
+        parsed, errors = [], []
+        for number, row in chunk:
+            try:
+                parsed.append((number, self._parse(row)))
+            except ValueError as e:
+                errors.append((number, str(e)))
+
+        resolved = self._resolve({line['ama'] for _, line in parsed})
+        employees = self._employee_parties()
+        lines = [line for _, line in parsed]
+        statuses = self._validity(lines) if parsed else []
+        expected = self._expected_totals(lines) if parsed else []
+        valid = []
+        for (number, line), status, total in zip(parsed, statuses, expected):
+            party = resolved.get(line['ama'])
+            if status != VALID:
+                errors.append((number, f"{STATUS_MESSAGES[status]} {line['kad']}/{line['eid']}/{line['kpk']}"))
+            elif party is None:
+                errors.append((number, f"Unknown AMA {line['ama']}"))
+            elif party[0] not in employees:
+                errors.append((number, f"AMA {line['ama']} is not an active employee"))
+            elif party[2] is None:
+                errors.append((number, f"AMA {line['ama']} has no contributions account"))
+            elif total is None:
+                errors.append((number, f"KPK {line['kpk']} has no rate for {self.submission.period}"))
+            elif total != line['total']:
+                errors.append((number, f"Total contribution {line['total']} does not match the KPK rate ({total})"))
+            else:
+                line['party'], line['insurance_id'], line['account'] = party
+                valid.append((number, line))
+        errors.sort()
+        return valid, errors
+
+    # Posting -----------------------------------------------------------------
+
+    def post(self):
+        """Second pass: write the lines after lines_posted, one transaction per chunk."""
+        submission = self.submission
+        self._save(state=ApdSubmission.STATE_POSTING, error_message='')
+        self.writers = contribution_writers(CREATED_BY)
+        for chunk in self._chunks(start=submission.lines_posted):
+            valid, errors = self.check_chunk(chunk)
+            if errors:
+                number, message = errors[0]
+                raise ApdFileError(f"Line {number + 1} no longer valid: {message}")
+            with transaction.atomic():
+                write_contributions(self.writers, [self._row(number, line) for number, line in valid])
+                self._save(lines_posted=chunk[-1][0])
+            if self.progress:
+                self.progress(submission)
+
+    def _row(self, number, line):
+        row_id = self.submission.first_line_id + number - 1
+        month, year = line['start_date'].month, line['start_date'].year
+        return {
+            'id': row_id,
+            'account': line['account'],
+            'description': f'APD Submission {month:02d}/{year}',
+            'type': 'APD',
+            'obligation_description': f'Contribution {month:02d}/{year}',
+            'obligation_type': 'CONTRIB',
+            'month': month,
+            'reference_month': month,
+            'year': year,
+            'rf_code': f'RF91{year}{month:02d}{row_id:010d}',
+            'amount': line['total'],
+            'balance': line['total'],
+            'party': line['party'],
+            'insurance_id': line['insurance_id'],
+            'employer_id': self.employer.party_id,
+            'branch_code': int(line['kpk']),
+            'days': line['days'],
+            'start_date': line['start_date'],
+            'end_date': line['end_date'],
+            'earnings_type': line['earnings_type'],
+            'gross': line['gross'],
+        }
+
+    def complete(self):
+        """Post the employer obligation and refresh the derived data of the touched parties."""
+        submission = self.submission
+        first, last = submission.first_line_id, submission.first_line_id + submission.lines_total - 1
+        contributions = InsuranceContribution.objects.filter(insurance_contribution_id__range=(first, last))
+        total = (contributions.aggregate(total=Sum('total_contribution'))['total'] or Decimal('0.00')).quantize(TWO_PLACES)
+        party_pks = list(contributions.order_by().values_list('party_id', flat=True).distinct())
+        account_pks = set(
+            AccountTransaction.objects
+            .filter(account_transaction_id__range=(first, last))
+            .order_by().values_list('account_id', flat=True).distinct()
+        )
+        employer_account_pk = _employer_account_pk(self.employer)
+        account_pks.add(employer_account_pk)
+        year, month = divmod(submission.period, 100)
+
+        with transaction.atomic():
+            write_obligations(self.writers or contribution_writers(CREATED_BY), [{
+                'id': last + 1,
+                'account': employer_account_pk,
+                'description': f'APD {month:02d}/{year}',
+                'type': 'APD',
+                'obligation_description': f'APD {month:02d}/{year}',
+                'obligation_type': 'CONTRIB',
+                'month': month,
+                'reference_month': month,
+                'year': year,
+                'rf_code': f'RF91{year}{month:02d}{last + 1:010d}',
+                'amount': total,
+                'balance': total,
+            }])
+            refresh_account_balances(account_pks, CREATED_BY)
+            rebuild_latest_contributions(party_pks)
+            refresh_contribution_rollups(party_pks)
+            refresh_insurance_days(party_pks)
+            refresh_pension_projections(party_pks)
+            schedule_debt_summary_refresh(self.employer.pk)
+            self._save(
+                state=ApdSubmission.STATE_COMPLETED,
+                employee_count=len(party_pks),
+                total_contributions=total,
+                completed_date=timezone.now(),
+            )
+        return submission
+
+
+def ingest(submission, chunk_size=APD_CHUNK_SIZE, progress=None):
+    """Validate and post (or resume) a submission. Returns it."""
+    return ApdIngestion(submission, chunk_size, progress).run()
+
+
+def recent_submissions(party, limit=10):
+    return ApdSubmission.objects.filter(party_id=party).order_by('-creation_date', '-pk')[:limit]
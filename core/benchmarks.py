@@ -0,0 +1,322 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import URLPattern, reverse
+from django.utils import translation
+
+from . import urls as core_urls
+from .synthetic import FIRST_PARTY_ID, make_ama
+
+
+# View benchmarks
+# -----------------------------------------------------------------------------
+# Runs every view of core/urls.py as the roles allowed to see it (see
+# role_required) against a generated dataset (manage.py generate_dataset) and
+# records latency percentiles, SQL query counts and SQL time per view. Each
+# dataset has stored budgets (BUDGETS_FILE): a view fails when it issues more
+# queries than its budget or its p95 latency goes over the budget. Query
+# budgets are portable, latency budgets depend on the machine and database
+# and should be recorded (--update-budgets) where the benchmark runs.
+#
+# Requests go through the WSGI handler (test Client) or the ASGI one
+# (AsyncClient, --handler asgi); --compare runs both and reports the latency
+# of each view under each, e.g. to measure the async views of
+# core/dashboards.py. --query-latency adds a delay to every query, standing
+# in for the network round trip to a database server when benchmarking on a
+# local SQLite file.
+
+HANDLERS = {
+    'wsgi': Client,
+    'asgi': AsyncClient,
+}
+
+BUDGETS_FILE = getattr(
+    settings, 'BENCHMARK_BUDGETS_FILE',
+    os.path.join(settings.BASE_DIR, 'core', 'benchmark_budgets.json'),
+)
+
+# generate_dataset options of each dataset size. Run each one against its own
+# (empty) database: the ID layout depends on --insured.
+DATASETS = {
+    'small': {'employers': 2, 'insured': 10, 'years': 2},
+    'medium': {'employers': 10, 'insured': 100, 'years': 4},
+    'large': {'employers': 40, 'insured': 250, 'years': 8},
+}
+
+# Logins of the first generated employer block
+EMPLOYER_USERNAME = f"syn{FIRST_PARTY_ID}"
+INSURED_USERNAME = f"syn{FIRST_PARTY_ID + 1}"
+
+ROLE_USERS = {
+    'EMP': EMPLOYER_USERNAME,
+    'INS': INSURED_USERNAME,
+}
+
+# Views with side effects (and views needing URL arguments or staff users)
+# are not benchmarked; the login page runs anonymously
+SKIPPED_VIEWS = {'logout', 'reconcile_statement', 'db_connections'}
+ANONYMOUS_VIEWS = {'login'}
+
+VIEW_PARAMS = {
+    'get_last_contribution': {'ama': make_ama(FIRST_PARTY_ID + 1)},
+    'code_info': {'type': 'eid', 'kad': '0011'},
+    'code_lookup': {'type': 'eid', 'kad': '0011'},
+    'export_insurance_history': {'format': 'csv'},
+}
+
+
+def discover_views():
+    """Return [(benchmark name, role code or None, url name, params)] for core/urls.py."""
+    views = []
+    for pattern in core_urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in SKIPPED_VIEWS or pattern.pattern.converters:
+            continue
+        params = VIEW_PARAMS.get(pattern.name, {})
+        if pattern.name in ANONYMOUS_VIEWS:
+            views.append((f"anon:{pattern.name}", None, pattern.name, params))
+            continue
+        roles = getattr(pattern.callback, 'allowed_roles', None) or tuple(ROLE_USERS)
+        for role in roles:
+            views.append((f"{role.lower()}:{pattern.name}", role, pattern.name, params))
+    return views
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting queries and summing their time (also
+    of the queries async views run on worker threads, see core/dashboards.py).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.seconds += elapsed
+                self.count += 1
+
+
+class QueryDelay:
+    """Database execute wrapper sleeping `seconds` before each query."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+
+async def _arequest_view(client, url, params):
+    response = await client.get(url, params)
+    if not getattr(response, 'streaming', False):
+        size = len(response.content)
+    elif response.is_async:
+        size = 0
+        async for chunk in response.streaming_content:
+            size += len(chunk)
+    else:
+        # Sync iterators may query the database: consumed in a thread, as the ASGI handler does
+        size = await sync_to_async(_content_size)(response)
+    response.close()
+    return response.status_code, size
+
+
+def _content_size(response):
+    return sum(len(chunk) for chunk in response.streaming_content)
+
+
+def request_view(client, url, params):
+    """GET a view, consuming streamed responses. Returns (status, size)."""
+    if isinstance(client, AsyncClient):
+        return async_to_sync(_arequest_view)(client, url, params)
+    response = client.get(url, params)
+    if getattr(response, 'streaming', False):
+        size = _content_size(response)
+    else:
+        size = len(response.content)
+    response.close()
+    return response.status_code, size
+
+
+def benchmark_view(client, url, params, iterations=20, warmup=2, query_latency=0):
+    """
+    Time `iterations` GET requests of a view (after `warmup` untimed ones),
+    each query delayed by `query_latency` seconds.
+    """
+    for _ in range(warmup):
+        request_view(client, url, params)
+
+    latencies, query_counts, sql_times = [], [], []
+    status, size = None, 0
+    for _ in range(iterations):
+        timer = QueryTimer()
+        with ExitStack() as stack:
+            stack.enter_context(connection.execute_wrapper(timer))
+            if query_latency:
+                stack.enter_context(connection.execute_wrapper(QueryDelay(query_latency)))
+            started = time.perf_counter()
+            status, size = request_view(client, url, params)
+            latencies.append((time.perf_counter() - started) * 1000)
+        query_counts.append(timer.count)
+        sql_times.append(timer.seconds * 1000)
+
+    return {
+        'url': url,
+        'status': status,
+        'bytes': size,
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p90_ms': round(percentile(latencies, 90), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries': max(query_counts),
+        'sql_ms': round(sum(sql_times) / len(sql_times), 2),
+    }
+
+
+def role_clients(handler='wsgi'):
+    """Test clients logged in as the generated users, keyed by role (None: anonymous)."""
+    client_class = HANDLERS[handler]
+    clients = {None: client_class()}
+    for role, username in ROLE_USERS.items():
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            raise LookupError(f"User {username} not found, generate the dataset first.")
+        clients[role] = client_class()
+        clients[role].force_login(user)
+    return clients
+
+
+def view_requests(only=None):
+    """Yield (name, role, url, params) of the selected views (all by default)."""
+    for name, role, url_name, params in discover_views():
+        if only and name not in only and url_name not in only:
+            continue
+        yield name, role, reverse(url_name), params
+
+
+@contextmanager
+def request_context():
+    """Language and host settings the test clients' requests need."""
+    with translation.override(settings.LANGUAGES[0][0]), override_settings(ALLOWED_HOSTS=['testserver']):
+        yield
+
+
+def run_benchmarks(dataset, iterations=20, warmup=2, only=None, stdout=None, handler='wsgi', query_latency=0):
+    """Benchmark every discovered view through a handler (wsgi or asgi). Returns the results dict."""
+    clients = role_clients(handler)
+    results = []
+    with request_context():
+        for name, role, url, params in view_requests(only):
+            result = {'name': name}
+            result.update(benchmark_view(clients[role], url, params, iterations, warmup, query_latency))
+            results.append(result)
+            if stdout is not None:
+                stdout.write(
+                    f"  {name:<40} {result['status']}  p50 {result['p50_ms']:>8.1f}ms  "
+                    f"p95 {result['p95_ms']:>8.1f}ms  {result['queries']:>3} queries  "
+                    f"sql {result['sql_ms']:>7.1f}ms"
+                )
+
+    return {
+        'dataset': dataset,
+        'database': connection.vendor,
+        'handler': handler,
+        'query_latency_ms': query_latency * 1000,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'iterations': iterations,
+        'views': results,
+    }
+
+
+def compare_handlers(results_by_handler):
+    """
+    [(view name, {handler: (p50, p95)}, p50 ratio of the last handler to the
+    first)] of the views of several run_benchmarks() results.
+    """
+    handlers = list(results_by_handler)
+    latencies = {
+        handler: {result['name']: (result['p50_ms'], result['p95_ms']) for result in results['views']}
+        for handler, results in results_by_handler.items()
+    }
+    rows = []
+    for name in latencies[handlers[0]]:
+        row = {handler: latencies[handler][name] for handler in handlers if name in latencies[handler]}
+        first, last = row[handlers[0]][0], row[handlers[-1]][0]
+        rows.append((name, row, round(last / first, 2) if first else None))
+    return rows
+
+
+def load_budgets(path=BUDGETS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_budgets(budgets, path=BUDGETS_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(budgets, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def check_budgets(results, budgets):
+    """
+    Return a list of budget violations (strings) of a results dict. Views
+    without a budget are listed in results['unbudgeted']. Runs with a
+    simulated query latency are only held to the query budgets.
+    """
+    dataset_budgets = budgets.get(results['dataset'], {})
+    failures = []
+    results['unbudgeted'] = []
+    for result in results['views']:
+        budget = dataset_budgets.get(result['name'])
+        if budget is None:
+            results['unbudgeted'].append(result['name'])
+            continue
+        if result['status'] != budget.get('status', result['status']):
+            failures.append(f"{result['name']}: status {result['status']} (expected {budget['status']})")
+        if result['queries'] > budget['queries']:
+            failures.append(f"{result['name']}: {result['queries']} queries (budget {budget['queries']})")
+        if not results.get('query_latency_ms') and result['p95_ms'] > budget['p95_ms']:
+            failures.append(f"{result['name']}: p95 {result['p95_ms']}ms (budget {budget['p95_ms']}ms)")
+    return failures
+
+
+def budgets_from_results(results, headroom=2.0, minimum_ms=25):
+    """Budgets for a dataset: measured query counts, p95 with some headroom."""
+    return {
+        result['name']: {
+            'status': result['status'],
+            'queries': result['queries'],
+            'p95_ms': max(minimum_ms, math.ceil(result['p95_ms'] * headroom)),
+        }
+        for result in results['views']
+    }
@@ -0,0 +1,146 @@
+import threading
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from .catalog import get_code_catalog
+
+
+# Contribution calculation
+# -----------------------------------------------------------------------------
+# Prices contribution lines from the KPK rates of dn_kpk.txt (employee,
+# employer and total rate per effective period, see CodeCatalog.kpk_rates).
+# Each amount is gross earnings x rate / 100 rounded half-up to the cent, on
+# its own: the total comes from the total rate, not from the two shares (they
+# do not always add up in dn_kpk.txt).
+#
+# RateTable does the same for whole batches with NumPy (optional dependency).
+# Money is kept as integer cents and rates as integer 1/10000 percent, so the
+# arithmetic is exact and the rounding matches the Decimal version to the
+# cent. Rate lookups are one searchsorted over (kpk, period) keys.
+
+CENTS = Decimal('0.01')
+RATE_SCALE = 10000          # dn_kpk.txt rates have 4 decimals
+_DIVISOR = 100 * RATE_SCALE  # cents x rate units -> cents
+_PERIOD_SPAN = 1000000       # YYYYMM < _PERIOD_SPAN
+
+SHARES = ('employee', 'employer', 'total')
+
+
+def kpk_code(value):
+    """dn_kpk.txt code of a KPK (coverage_package_id is stored as an int: 15 -> '015')."""
+    return str(value).strip().zfill(3)
+
+
+def period_of(value):
+    """YYYYMM int of a date/datetime (ints pass through)."""
+    if isinstance(value, (date, datetime)):
+        return value.year * 100 + value.month
+    return int(value)
+
+
+def calculate_contribution(gross, kpk, period, catalog=None):
+    """
+    Return {'employee', 'employer', 'total'} Decimal amounts of one line, or
+    None if the KPK has no rate in force at `period` (YYYYMM or date).
+    """
+    catalog = catalog or get_code_catalog()
+    rate = catalog.kpk_rate(kpk_code(kpk), period_of(period))
+    if rate is None:
+        return None
+    gross = Decimal(gross)
+    return {
+        share: (gross * percent / 100).quantize(CENTS, rounding=ROUND_HALF_UP)
+        for share, percent in zip(SHARES, rate[1:])
+    }
+
+
+def _round_div(numerator, divisor):
+    """Integer division rounded half away from zero (ROUND_HALF_UP)."""
+    import numpy as np
+
+    return np.sign(numerator) * ((np.abs(numerator) * 2 + divisor) // (2 * divisor))
+
+
+def to_cents(amounts):
+    """int64 array of cents from Decimals, strings or numbers (exact for Decimals and strings)."""
+    import numpy as np
+
+    return np.fromiter(
+        (int((Decimal(str(amount)) * 100).to_integral_value(ROUND_HALF_UP)) for amount in amounts),
+        dtype=np.int64,
+    )
+
+
+def from_cents(cents):
+    """List of Decimal amounts from an array of cents."""
+    return [Decimal(int(value)).scaleb(-2) for value in cents]
+
+
+class RateTable:
+    """KPK rates as NumPy arrays, for pricing batches of lines."""
+
+    def __init__(self, kpk_rates):
+        import numpy as np
+
+        self.codes = {code: index for index, code in enumerate(sorted(kpk_rates))}
+        keys, rates = [], []
+        for code, index in self.codes.items():
+            for period, *percents in sorted(kpk_rates[code]):
+                keys.append(index * _PERIOD_SPAN + period)
+                rates.append([int(percent * RATE_SCALE) for percent in percents])
+        self.keys = np.array(keys, dtype=np.int64)
+        self.rates = np.array(rates, dtype=np.int64).reshape(-1, len(SHARES))
+
+    def lookup(self, kpks, periods):
+        """
+        Return (rates, found): the (n, 3) employee/employer/total rates (1/10000
+        percent) in force for each (kpk, period) pair and a boolean mask of
+        the pairs that have one.
+        """
+        import numpy as np
+
+        periods = np.asarray(periods, dtype=np.int64)
+        # Map the distinct codes in Python, then every line by indexing
+        unique, inverse = np.unique(np.asarray(kpks), return_inverse=True)
+        code_index = np.array([self.codes.get(kpk_code(code), -1) for code in unique], dtype=np.int64)[inverse]
+
+        if not len(self.keys):
+            return np.zeros((len(periods), len(SHARES)), dtype=np.int64), np.zeros(len(periods), dtype=bool)
+
+        # Last key <= (kpk, period): the rate in force, if it belongs to that kpk
+        position = np.searchsorted(self.keys, code_index * _PERIOD_SPAN + periods, side='right') - 1
+        clipped = np.maximum(position, 0)
+        found = (code_index >= 0) & (position >= 0) & (self.keys[clipped] // _PERIOD_SPAN == code_index)
+        rates = np.where(found[:, None], self.rates[clipped], 0)
+        return rates, found
+
+    def calculate(self, gross_cents, kpks, periods):
+        """
+        Price a batch: gross earnings in cents (int array, see to_cents), KPK
+        codes and YYYYMM periods. Returns a dict of int64 cent arrays per
+        share plus 'found' (lines without a rate are priced 0).
+        """
+        import numpy as np
+
+        gross_cents = np.asarray(gross_cents, dtype=np.int64)
+        rates, found = self.lookup(kpks, periods)
+        amounts = _round_div(gross_cents[:, None] * rates, _DIVISOR)
+        result = {share: amounts[:, column] for column, share in enumerate(SHARES)}
+        result['found'] = found
+        return result
+
+
+_rate_table = None
+_rate_table_version = None
+_rate_table_lock = threading.Lock()
+
+
+def get_rate_table():
+    """Return the process-wide RateTable, rebuilt with the code catalog. Raises ImportError without NumPy."""
+    global _rate_table, _rate_table_version
+    catalog = get_code_catalog()
+    with _rate_table_lock:
+        if _rate_table is None or _rate_table_version != catalog.version:
+            _rate_table = RateTable(catalog.kpk_rates)
+            _rate_table_version = catalog.version
+        return _rate_table
@@ -0,0 +1,274 @@
+import bisect
+import hashlib
+import os
+import threading
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+
+# KAD / EID / KPK code catalog
+# -----------------------------------------------------------------------------
+# The code lists (dn_kad.txt, dn_eid.txt, dn_kpk.txt) and the allowed
+# KAD-EID-KPK combinations (dn_kadeidkpk.txt) are parsed once per process and
+# indexed in memory, so filtered lookups are dictionary hits instead of a scan
+# of the 46k line mapping file. The catalog is rebuilt automatically when any
+# of the files' mtime (or size) changes. `version` is a hash of the file
+# contents, so it is identical on every server and can be used for ETags.
+#
+# Combinations are valid from/to a month (columns 4 and 5 of
+# dn_kadeidkpk.txt, YYYYMM, 999912 is open ended). The intervals of every
+# index entry are merged, so "valid at a period" is a check of a few
+# (usually one) disjoint intervals; exists() and lookup() take an optional
+# period. Batches are checked with core/validity.py.
+
+TEXTS_DIR = os.path.join(settings.BASE_DIR, 'core', 'static', 'core', 'texts')
+
+CODE_FILES = {
+    'kad': 'dn_kad.txt',
+    'eid': 'dn_eid.txt',
+    'kpk': 'dn_kpk.txt',
+}
+MAPPING_FILE = 'dn_kadeidkpk.txt'
+
+CODE_TYPES = ('kad', 'eid', 'kpk')
+
+# Validity of mapping lines without (parsable) from/to columns
+ALWAYS_VALID = (0, 999912)
+
+
+def next_period(period):
+    """The YYYYMM month after `period`."""
+    year, month = divmod(period, 100)
+    return period + 1 if month < 12 else (year + 1) * 100 + 1
+
+
+def merge_intervals(intervals):
+    """Sorted disjoint (from, to) intervals covering the same months."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= next_period(merged[-1][1]):
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return tuple(merged)
+
+
+def covers(intervals, period):
+    """True if one of the intervals contains `period` (None: any period)."""
+    if period is None:
+        return bool(intervals)
+    return any(start <= period <= end for start, end in intervals)
+
+
+def _read_lines(path):
+    # Iterate the file object (not splitlines) so descriptions containing
+    # unicode line separators (NEL in dn_kpk.txt) stay on one line.
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield [part.strip() for part in line.split('|')]
+
+
+class CodeCatalog:
+    """Parsed and indexed snapshot of the code files."""
+
+    def __init__(self, texts_dir, signature):
+        self.texts_dir = texts_dir
+        self.signature = signature
+        self.version = _files_digest(texts_dir)
+
+        # info_type -> [(code, description), ...] in file order
+        self.codes = {}
+        # info_type -> {code: description} (first description wins) and the
+        # sorted list of distinct codes, used for prefix searches
+        self.descriptions = {}
+        self.sorted_codes = {}
+        # info_type -> set of codes that appear in at least one combination
+        self.mapped = {code_type: set() for code_type in CODE_TYPES}
+        # kpk -> [(period YYYYMM, employee %, employer %, total %), ...],
+        # newest period first (dn_kpk.txt columns 3-6)
+        self.kpk_rates = {}
+        # (kad, eid, kpk) combinations
+        self.triples = set()
+        # (kad, eid, kpk) -> merged ((from, to), ...) validity intervals
+        self.validity = {}
+        # (key fields, target field) -> {key: {target code: intervals}}, e.g.
+        # (('kad',), 'eid') is kad -> {eid: intervals} and (('eid', 'kpk'),
+        # 'kad') is (eid, kpk) -> {kad: intervals}.
+        self.indexes = {}
+
+        self._load()
+
+    def _load(self):
+        for code_type, filename in CODE_FILES.items():
+            codes = []
+            for parts in _read_lines(os.path.join(self.texts_dir, filename)):
+                if len(parts) >= 2:
+                    codes.append((parts[0], parts[1]))
+                if code_type == 'kpk' and len(parts) >= 6:
+                    self._add_kpk_rate(parts)
+            self.codes[code_type] = codes
+
+            descriptions = {}
+            for code, description in codes:
+                descriptions.setdefault(code, description)
+            self.descriptions[code_type] = descriptions
+            self.sorted_codes[code_type] = sorted(descriptions)
+
+        for rates in self.kpk_rates.values():
+            rates.sort(reverse=True)
+
+        key_sets = [
+            (('kad',), 'eid'), (('kad',), 'kpk'),
+            (('eid',), 'kad'), (('eid',), 'kpk'),
+            (('kpk',), 'kad'), (('kpk',), 'eid'),
+            (('kad', 'eid'), 'kpk'),
+            (('kad', 'kpk'), 'eid'),
+            (('eid', 'kpk'), 'kad'),
+        ]
+        validity = defaultdict(list)
+        for parts in _read_lines(os.path.join(self.texts_dir, MAPPING_FILE)):
+            if len(parts) < 3:
+                continue
+            try:
+                interval = (int(parts[3]), int(parts[4]))
+            except (IndexError, ValueError):
+                interval = ALWAYS_VALID
+            validity[tuple(parts[:3])].append(interval)
+
+        # Identical interval tuples are shared, most entries are 201312-999912
+        interned = {}
+
+        def intern(intervals):
+            merged = merge_intervals(intervals) if len(intervals) > 1 else tuple(intervals)
+            return interned.setdefault(merged, merged)
+
+        self.validity = {triple: intern(intervals) for triple, intervals in validity.items()}
+        self.triples = set(self.validity)
+
+        indexes = {key_set: defaultdict(dict) for key_set in key_sets}
+        for triple, intervals in self.validity.items():
+            row = dict(zip(CODE_TYPES, triple))
+            for code_type in CODE_TYPES:
+                self.mapped[code_type].add(row[code_type])
+            for (fields, target), index in indexes.items():
+                targets = index[tuple(row[field] for field in fields)]
+                code = row[target]
+                targets[code] = targets[code] + intervals if code in targets else intervals
+
+        self.indexes = {
+            key_set: {
+                key: {code: intern(intervals) for code, intervals in targets.items()}
+                for key, targets in index.items()
+            }
+            for key_set, index in indexes.items()
+        }
+
+    def _add_kpk_rate(self, parts):
+        try:
+            rate = (int(parts[5]), Decimal(parts[2]), Decimal(parts[3]), Decimal(parts[4]))
+        except (ValueError, InvalidOperation):
+            return
+        self.kpk_rates.setdefault(parts[0], []).append(rate)
+
+    def kpk_rate(self, kpk, period):
+        """
+        Return the (period, employee %, employer %, total %) rates of a KPK in
+        force at `period` (YYYYMM int), or None.
+        """
+        for rate in self.kpk_rates.get(kpk, ()):
+            if rate[0] <= period:
+                return rate
+        return None
+
+    def exists(self, kad='', eid='', kpk='', period=None):
+        """
+        Return True if at least one combination matches the given filters
+        (and is valid at `period`, YYYYMM, if given).
+        """
+        filters = {field: value for field, value in (('kad', kad), ('eid', eid), ('kpk', kpk)) if value}
+        if not filters:
+            return any(covers(intervals, period) for intervals in self.validity.values())
+        if len(filters) == 3:
+            return covers(self.validity.get((kad, eid, kpk), ()), period)
+
+        fields = tuple(filters)
+        target = next(code_type for code_type in CODE_TYPES if code_type not in filters)
+        targets = self.indexes[(fields, target)].get(tuple(filters.values()), {})
+        return any(covers(intervals, period) for intervals in targets.values())
+
+    def lookup(self, info_type, kad='', eid='', kpk='', period=None):
+        """
+        Return the set of `info_type` codes that appear in a combination
+        matching the given kad/eid/kpk filters (empty filters are ignored),
+        valid at `period` (YYYYMM) if given.
+        """
+        filters = {field: value for field, value in (('kad', kad), ('eid', eid), ('kpk', kpk)) if value}
+        if info_type not in CODE_TYPES:
+            return set()
+        if info_type in filters:
+            return {filters[info_type]} if self.exists(kad, eid, kpk, period) else set()
+        if not filters:
+            if period is None:
+                return set(self.mapped[info_type])
+            position = CODE_TYPES.index(info_type)
+            return {triple[position] for triple, intervals in self.validity.items() if covers(intervals, period)}
+
+        fields = tuple(filters)
+        targets = self.indexes[(fields, info_type)].get(tuple(filters.values()), {})
+        return {code for code, intervals in targets.items() if covers(intervals, period)}
+
+    def valid_at(self, kad, eid, kpk, period):
+        """True if the (kad, eid, kpk) combination is valid at `period` (YYYYMM)."""
+        return covers(self.validity.get((kad, eid, kpk), ()), period)
+
+    def prefix_search(self, info_type, prefix=''):
+        """Return the sorted distinct `info_type` codes starting with `prefix`."""
+        codes = self.sorted_codes.get(info_type, [])
+        if not prefix:
+            return list(codes)
+        start = bisect.bisect_left(codes, prefix)
+        end = start
+        while end < len(codes) and codes[end].startswith(prefix):
+            end += 1
+        return codes[start:end]
+
+
+CATALOG_FILES = list(CODE_FILES.values()) + [MAPPING_FILE]
+
+
+def _files_signature(texts_dir):
+    """mtime/size signature of the catalog files, used to detect changes."""
+    return tuple(
+        (stat.st_mtime_ns, stat.st_size)
+        for stat in (os.stat(os.path.join(texts_dir, filename)) for filename in CATALOG_FILES)
+    )
+
+
+def _files_digest(texts_dir):
+    """Content hash of the catalog files."""
+    digest = hashlib.sha1()
+    for filename in CATALOG_FILES:
+        with open(os.path.join(texts_dir, filename), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_code_catalog():
+    """Return the process-wide catalog, reloading it if the files changed."""
+    global _catalog
+    signature = _files_signature(TEXTS_DIR)
+    catalog = _catalog
+    if catalog is not None and catalog.signature == signature:
+        return catalog
+
+    with _catalog_lock:
+        if _catalog is None or _catalog.signature != signature:
+            _catalog = CodeCatalog(TEXTS_DIR, signature)
+        return _catalog
@@ -0,0 +1,211 @@
+import asyncio
+from contextlib import ExitStack
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.utils.functional import SimpleLazyObject
+
+from .accrual import get_insurance_days
+from .apd import recent_submissions
+from .ledger import get_debt_summary
+from .models import Address, ApdSubmission, Organization, Party, PartyIdentifier, PartyIdentifierType, PartyRelationship
+from .pensions import get_pension_projections, next_milestone
+
+
+# Dashboard lookups
+# -----------------------------------------------------------------------------
+# The home screens and the APD screen are built from independent lookups of
+# the logged in party (identifiers, address, organization, debts, insurance
+# days...). The async views run each group of lookups with gather(), one
+# worker thread and database connection per group, so a page waits for its
+# slowest group rather than for the sum of them.
+#
+# Django's async ORM API (aget(), afirst()...) runs every query on the one
+# thread shared by the request, so awaiting several of them with
+# asyncio.gather() still runs them one after the other: the groups are plain
+# sync functions run with sync_to_async(thread_sensitive=False) instead.
+# Overlapping queries pays off when they wait on the database server
+# (PostgreSQL round trips release the GIL); SQLite runs them in-process, so
+# there the groups run one after the other on the request's thread, as with
+# DASHBOARD_CONCURRENT_QUERIES = False. Worker threads keep their
+# connection as the request thread would (CONN_MAX_AGE, or the connection
+# pool): without either every group opens a connection of its own.
+#
+# The identity blocks (names, identifiers, address, employer) are template
+# fragments cached per party (core/fragments.py): gather_identity() looks
+# them up only when a fragment is missing.
+
+DASHBOARD_CONCURRENT_QUERIES = getattr(
+    settings, 'DASHBOARD_CONCURRENT_QUERIES', connections[DEFAULT_DB_ALIAS].vendor != 'sqlite',
+)
+
+NOT_AVAILABLE = "N/A"
+
+
+def _execute_wrappers():
+    return list(connection.execute_wrappers)
+
+
+def _run_all(calls):
+    return [func(*args) for func, *args in calls]
+
+
+def _run_in_worker(wrappers, func, args):
+    # Fresh, or still usable, connection of this worker thread; the request
+    # thread's execute wrappers (query instrumentation) apply here too
+    close_old_connections()
+    try:
+        with ExitStack() as stack:
+            for wrapper in wrappers:
+                stack.enter_context(connection.execute_wrapper(wrapper))
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def gather(*calls):
+    """
+    Run (func, *args) calls of sync lookup functions concurrently, each on
+    its own worker thread. Returns their results in order.
+    """
+    if not DASHBOARD_CONCURRENT_QUERIES:
+        return await sync_to_async(_run_all)(calls)
+    wrappers = await sync_to_async(_execute_wrappers)()
+    return await asyncio.gather(*(
+        sync_to_async(_run_in_worker, thread_sensitive=False)(wrappers, func, args)
+        for func, *args in calls
+    ))
+
+
+def _build(build, calls):
+    return build(*_run_all(calls))
+
+
+async def gather_identity(cached, build, identity_calls, *calls):
+    """
+    (identity, results of `calls`): gather() the identity_calls too and
+    build() the identity block from their results, unless its fragments are
+    `cached`: then the identity is only looked up if a template reads it.
+    """
+    if cached:
+        return SimpleLazyObject(partial(_build, build, identity_calls)), await gather(*calls)
+    results = await gather(*identity_calls, *calls)
+    return build(*results[:len(identity_calls)]), results[len(identity_calls):]
+
+
+# Identity blocks: the fragments of each page, the lookups and the template values
+INSURED_FRAGMENTS = ('insured-name', 'insured-identifiers', 'insured-employer')
+EMPLOYER_FRAGMENTS = ('employer-identity', 'employer-address')
+APD_FRAGMENTS = ('apd-employer',)
+
+
+def insured_identity_calls(party_pk, party_role_pk):
+    return [
+        (party_display_name, party_pk),
+        (party_identifiers, party_pk, ('AMA', 'AMKA', 'ADT')),
+        # Active employment relationship (relation_to is the insured)
+        (current_employer, party_role_pk),
+    ]
+
+
+def insured_identity(full_name, identifiers, employer):
+    return {
+        'full_name': full_name or "User Not Found",
+        'insurance_id': identifiers['AMA'],
+        'amka': identifiers['AMKA'],
+        'adt': identifiers['ADT'],
+        'current_employer': employer,
+    }
+
+
+def employer_identity_calls(party_pk):
+    return [
+        (organization_name, party_pk),
+        (party_identifiers, party_pk, ('AFM', 'AME'), ('AFM',)),
+        (party_address, party_pk),
+    ]
+
+
+def employer_identity(name, identifiers, address):
+    if name is None:
+        return {'company_name': "Employer Not Found", 'tax_id': NOT_AVAILABLE, 'ame': NOT_AVAILABLE,
+                'address': NOT_AVAILABLE}
+    return {'company_name': name, 'tax_id': identifiers['AFM'], 'ame': identifiers['AME'], 'address': address}
+
+
+def apd_identity(name, identifiers, address):
+    if name is None:
+        return {'company_name': "Employer Not Found", 'ame': NOT_AVAILABLE, 'company_address': NOT_AVAILABLE}
+    return {'company_name': name, 'ame': identifiers['AME'], 'company_address': address}
+
+
+def party_identifiers(party_pk, codes, last=()):
+    """
+    {code: value} of a party's identifiers of the given type codes, the
+    first one of each type (the last one for the codes in `last`).
+    """
+    types = {}
+    for type_id, code in (
+        PartyIdentifierType.objects.filter(identifier_type_code__in=codes)
+        .order_by('pk').values_list('identifier_type_id', 'identifier_type_code')
+    ):
+        types.setdefault(code, type_id)
+    values = {}
+    for type_id, value in (
+        PartyIdentifier.objects.filter(party_id=party_pk, identifier_type_id__in=types.values())
+        .order_by('pk').values_list('identifier_type_id', 'identifier_value')
+    ):
+        values.setdefault(type_id, []).append(value)
+    result = {}
+    for code in codes:
+        found = values.get(types.get(code), [])
+        result[code] = (found[-1] if code in last else found[0]) if found else NOT_AVAILABLE
+    return result
+
+
+def party_address(party_pk, postal_code=True):
+    """One-line address of a party, N/A if it has none."""
+    address = Address.objects.filter(party_id=party_pk).order_by('pk').first()
+    if address is None:
+        return NOT_AVAILABLE
+    line = f"{address.address_street} {address.address_number}, {address.city}"
+    return f"{line}, {address.postal_code}" if postal_code else line
+
+
+def organization_name(party_pk):
+    return Organization.objects.filter(party_id=party_pk).order_by('pk').values_list('name', flat=True).first()
+
+
+def party_display_name(party_pk):
+    return Party.objects.filter(pk=party_pk).values_list('display_name', flat=True).first()
+
+
+def current_employer(party_role_pk):
+    """Name of the employer of an insured party role's active employment relationship."""
+    employer_party_pk = (
+        PartyRelationship.objects
+        .filter(relation_to=party_role_pk, relationship_type_id=1, status=1)  # EMPLOYMENT type
+        .order_by('pk').values_list('relation_from__party_id', flat=True).first()
+    )
+    if employer_party_pk is None:
+        return "No Active Employer"
+    return organization_name(employer_party_pk) or "Unknown Employer"
+
+
+def insurance_days_summary(party_pk):
+    """(total days, last change date, next milestone name, milestone date) of an insured party."""
+    insurance_days = get_insurance_days(party_pk)
+    if not insurance_days:
+        return 0, None, NOT_AVAILABLE, None
+    milestone = next_milestone(get_pension_projections(insurance_days)) or (NOT_AVAILABLE, None)
+    return (insurance_days.total_days, insurance_days.last_change_date, *milestone)
+
+
+def apd_history(party_pk):
+    """(recent submissions, failed submission or None, its first errors) of an employer party."""
+    submissions = list(recent_submissions(party_pk))
+    if submissions and submissions[0].state in (ApdSubmission.STATE_REJECTED, ApdSubmission.STATE_FAILED):
+        return submissions, submissions[0], list(submissions[0].errors.all()[:20])
+    return submissions, None, []
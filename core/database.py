@@ -0,0 +1,109 @@
+from django.db import connections
+from django.db.models import Q
+
+
+# Database connections
+# -----------------------------------------------------------------------------
+# registry_app/settings.py reuses connections: a psycopg pool per worker
+# process when psycopg_pool is installed, persistent connections
+# (CONN_MAX_AGE) otherwise. connection_stats() reports either for monitoring
+# (the db_connections view): the pool's size, connections in use, requests
+# that had to wait for one and requests that timed out waiting. The pool's
+# counters are cumulative since the worker started and per process, so a
+# scraper sums them over the workers.
+#
+# Streaming paths (exports, prefill) read their rows with iter_rows(): a
+# server-side cursor (QuerySet.iterator) where the connection allows one,
+# otherwise, e.g. behind a transaction-mode pooler where
+# DISABLE_SERVER_SIDE_CURSORS is set and iterator() would fetch the whole
+# result at once, pages of `chunk_size` rows, each one query continuing after
+# the last row of the previous page (keyset pagination). Either way memory
+# stays bounded by the chunk.
+
+# psycopg_pool get_stats() keys, as reported
+POOL_STATS = {
+    'pool_min': 'min_size',
+    'pool_max': 'max_size',
+    'pool_size': 'size',
+    'pool_available': 'idle',
+    'requests_waiting': 'waiting',
+    'requests_num': 'requests',
+    'requests_queued': 'waits',
+    'requests_wait_ms': 'wait_ms',
+    'requests_errors': 'timeouts',
+    'connections_num': 'connections_opened',
+    'connections_errors': 'connection_errors',
+    'connections_lost': 'connections_lost',
+    'returns_bad': 'returns_bad',
+}
+
+
+def connection_stats(alias=None):
+    """{alias: stats dict} of the database connections of this process (all aliases by default)."""
+    aliases = [alias] if alias else list(connections)
+    stats = {}
+    for name in aliases:
+        connection = connections[name]
+        pool = getattr(connection, 'pool', None) if connection.vendor == 'postgresql' else None
+        if pool is not None:
+            raw = pool.get_stats()
+            # Pools open on the first connection request
+            entry = {'mode': 'pool', 'open': not pool.closed}
+            entry.update({key: raw.get(stat, 0) for stat, key in POOL_STATS.items()})
+            entry['in_use'] = entry['size'] - entry['idle'] if entry['open'] else 0
+        else:
+            max_age = connection.settings_dict.get('CONN_MAX_AGE', 0)
+            entry = {
+                'mode': 'persistent' if max_age != 0 else 'per_request',
+                'conn_max_age': max_age,
+                # Connection of the thread serving this request
+                'in_use': int(connection.connection is not None),
+            }
+        entry['health_checks'] = bool(connection.settings_dict.get('CONN_HEALTH_CHECKS'))
+        entry['server_side_cursors'] = server_side_cursors(connection)
+        stats[name] = entry
+    return stats
+
+
+def server_side_cursors(connection):
+    """Whether QuerySet.iterator() streams rows on this connection."""
+    return (
+        connection.features.can_use_chunked_reads
+        and not connection.settings_dict.get('DISABLE_SERVER_SIDE_CURSORS')
+    )
+
+
+def _after(keys, values):
+    """Q of the rows after `values` (of the `keys` fields) in the order of the keys."""
+    condition = Q()
+    for index, key in enumerate(keys):
+        name = key.lstrip('-')
+        step = Q(**{f"{name}__{'lt' if key.startswith('-') else 'gt'}": values[index]})
+        for previous, value in zip(keys[:index], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+def iter_rows(queryset, fields, keys, chunk_size):
+    """
+    Yield the values_list rows of `fields` of an ordered queryset. `keys`
+    are its ordering fields ('-' for descending), or the first of them if
+    those are already unique per row, and may not be null. Uses a
+    server-side cursor if the connection allows it, pages otherwise.
+    """
+    if server_side_cursors(connections[queryset.db]):
+        yield from queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+        return
+
+    names = [key.lstrip('-') for key in keys]
+    columns = list(fields) + [name for name in names if name not in fields]
+    positions = [columns.index(name) for name in names]
+    page = queryset
+    while True:
+        rows = list(page.values_list(*columns)[:chunk_size])
+        for row in rows:
+            yield row[:len(fields)]
+        if len(rows) < chunk_size:
+            return
+        page = queryset.filter(_after(keys, [rows[-1][position] for position in positions]))
@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Party, PartyIdentifier, PartyIdentifierType
+
+
+# Employer directory
+# -----------------------------------------------------------------------------
+# Contribution history tables show the employer name and AME of every row.
+# InsuranceContribution.employer_id holds the employer's Party.party_id, so the
+# directory resolves a whole set of those ids with two queries instead of four
+# queries per row. Results are kept in a small process-level LRU cache,
+# tagged with a generation kept in the shared cache (like the role cache in
+# core/roles.py): a change to a Party, Organization or identifier bumps the
+# generation, and every process drops its entries on its next lookup.
+
+EMPLOYER_DIRECTORY_CACHE_SIZE = getattr(settings, 'EMPLOYER_DIRECTORY_CACHE_SIZE', 1024)
+EMPLOYER_GENERATION_KEY = 'employer-directory:generation'
+
+EMPLOYER_NOT_FOUND = ("N/A", "N/A")
+
+
+class EmployerLRUCache:
+    """
+    Thread-safe LRU mapping of employer party_id -> (name, ame), valid for
+    one generation: entries of an older generation are dropped.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _sync(self, generation):
+        # Called with the lock held
+        if generation != self._generation:
+            self._data.clear()
+            self._generation = generation
+
+    def get_many(self, keys, generation):
+        found = {}
+        if self.maxsize <= 0:
+            return found
+        with self._lock:
+            self._sync(generation)
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+        return found
+
+    def set_many(self, values, generation):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if self._generation is not None and generation < self._generation:
+                # Read before an invalidation this process has already seen
+                return
+            self._sync(generation)
+            for key, value in values.items():
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+employer_cache = EmployerLRUCache(EMPLOYER_DIRECTORY_CACHE_SIZE)
+
+
+def _generation():
+    generation = cache.get(EMPLOYER_GENERATION_KEY)
+    if generation is None:
+        cache.add(EMPLOYER_GENERATION_KEY, 1, None)
+        generation = cache.get(EMPLOYER_GENERATION_KEY, 1)
+    return generation
+
+
+def invalidate_employer_directory():
+    """Drop the cached employers of every process by moving to a new generation."""
+    try:
+        cache.incr(EMPLOYER_GENERATION_KEY)
+    except ValueError:
+        cache.set(EMPLOYER_GENERATION_KEY, 2, None)
+    employer_cache.clear()
+
+
+def _fetch_employers(employer_ids):
+    """Resolve employer party_ids to (name, ame) with set-based queries."""
+    directory = {}
+
+    # 1. Parties joined to their organization name (first organization wins)
+    parties = (
+        Party.objects
+        .filter(party_id__in=employer_ids)
+        .order_by('party_id', '-organization__pk')
+        .values_list('party_id', 'organization__name')
+    )
+    for party_id, name in parties:
+        directory[party_id] = [name or "Unknown Employer", "N/A"]
+
+    # 2. AME identifiers (first identifier wins)
+    ame_type_ids = PartyIdentifierType.objects.filter(identifier_type_code='AME').values('identifier_type_id')[:1]
+    identifiers = (
+        PartyIdentifier.objects
+        .filter(party_id__party_id__in=employer_ids, identifier_type_id__in=ame_type_ids)
+        .order_by('-pk')
+        .values_list('party_id__party_id', 'identifier_value')
+    )
+    for party_id, value in identifiers:
+        directory[party_id][1] = value
+
+    return {party_id: tuple(entry) for party_id, entry in directory.items()}
+
+
+def get_employer_directory(employer_ids, use_cache=True):
+    """
+    Return a dict of employer party_id -> (name, ame) for the given ids.
+
+    Unknown ids map to ("N/A", "N/A"), matching the history tables' fallback.
+    """
+    employer_ids = set(employer_ids)
+    generation = _generation() if use_cache else None
+    directory = employer_cache.get_many(employer_ids, generation) if use_cache else {}
+
+    missing = employer_ids - directory.keys()
+    if missing:
+        fetched = _fetch_employers(missing)
+        for party_id in missing:
+            fetched.setdefault(party_id, EMPLOYER_NOT_FOUND)
+        if use_cache:
+            employer_cache.set_many(fetched, generation)
+        directory.update(fetched)
+
+    return directory
@@ -0,0 +1,101 @@
+import csv
+import tempfile
+from itertools import islice
+
+from django.conf import settings
+
+from .database import iter_rows
+from .employers import get_employer_directory
+from .models import InsuranceContribution
+
+
+# Insurance history export
+# -----------------------------------------------------------------------------
+# Exports iterate the contributions with a server-side cursor (or in pages
+# where there is none, see core/database.py), resolve the employers of each
+# chunk in bulk and hand the rows to the writer one by one, so memory stays
+# flat however long the history is. CSV is written straight into a
+# StreamingHttpResponse; XLSX uses openpyxl's write-only mode (optional
+# dependency) backed by a temporary file.
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+EXPORT_HEADER = [
+    'party_id', 'from', 'to', 'year', 'month', 'days', 'earnings_type',
+    'coverage_package', 'gross_earnings', 'total_contributions',
+    'employer_name', 'employer_ame',
+]
+
+_EXPORT_FIELDS = (
+    'party_id__party_id', 'start_date', 'end_date', 'insurance_days',
+    'earning_type_id', 'coverage_package_id', 'gross_earnings',
+    'total_contribution', 'employer_id',
+)
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer: write() returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_history_rows(party_pks, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield one export row (list, see EXPORT_HEADER) per contribution of the
+    given parties, ordered by party and most recent period first.
+    """
+    ordering = ('party_id__party_id', '-start_date', 'pk')
+    contributions = iter_rows(
+        InsuranceContribution.objects.filter(party_id__in=party_pks).order_by(*ordering),
+        _EXPORT_FIELDS, ordering, chunk_size,
+    )
+
+    while True:
+        chunk = list(islice(contributions, chunk_size))
+        if not chunk:
+            break
+        employers = get_employer_directory(row[-1] for row in chunk)
+        for party_id, start, end, days, earning_type, package, gross, total, employer_id in chunk:
+            emp_name, emp_ame = employers[employer_id]
+            yield [
+                party_id,
+                start.strftime('%d/%m/%Y'),
+                end.strftime('%d/%m/%Y'),
+                start.year,
+                start.month,
+                days,
+                f"{earning_type:02d}",
+                str(package),
+                gross,
+                total,
+                emp_name,
+                emp_ame,
+            ]
+
+
+def iter_history_csv(party_pks, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the CSV export line by line (header first)."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_HEADER)
+    for row in iter_history_rows(party_pks, chunk_size):
+        yield writer.writerow(row)
+
+
+def write_history_xlsx(party_pks, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Write the XLSX export with openpyxl's write-only workbook and return the
+    (rewound) temporary file holding it. Raises ImportError without openpyxl.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Insurance History')
+    sheet.append(EXPORT_HEADER)
+    for row in iter_history_rows(party_pks, chunk_size):
+        sheet.append(row)
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
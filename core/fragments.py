@@ -0,0 +1,93 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.utils import make_template_fragment_key
+from django.utils import translation
+
+from .models import PartyRelationship, PartyRole
+from .prefill import EMPLOYMENT_RELATIONSHIP_TYPE
+
+
+# Party fragments
+# -----------------------------------------------------------------------------
+# The identity blocks of the dashboards (names, AMA/AMKA/ADT, AFM/AME,
+# address, current employer) change maybe once a year, so the templates cache
+# them ({% cache %}) under the party, its fragment version and the language.
+# Signals on Party, PartyIdentifier, Address, Organization and
+# PartyRelationship move every party whose blocks show the changed row to a
+# new version (core/signals.py): the next request renders them afresh and the
+# old fragments expire unread.
+#
+# Views ask fragment_state() first and look the identity up only when a
+# fragment is missing. On a hit they pass the lookup lazily instead, in case a
+# fragment expires between the check and the render.
+#
+# Versions are timestamps rather than counters from 1, so a version key lost
+# to eviction never comes back as a number older fragments were cached under.
+#
+# Fragments are cached only in a cache shared by every process. In a
+# process-local one (LocMemCache) a signal in one worker cannot bump the
+# versions the other workers read, and they would keep showing the old
+# blocks for PARTY_FRAGMENT_TIMEOUT, so there the blocks are rendered on every
+# request (fragment_timeout 0).
+
+PARTY_FRAGMENT_TIMEOUT = getattr(settings, 'PARTY_FRAGMENT_TIMEOUT', 24 * 60 * 60)
+PARTY_FRAGMENT_PREFIX = 'party-fragments'
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def _version_key(party_pk):
+    return f"{PARTY_FRAGMENT_PREFIX}:{party_pk}"
+
+
+def caching_fragments():
+    """Whether party fragments are cached (only in a cache shared by every process)."""
+    return not isinstance(caches['default'], PROCESS_LOCAL_CACHES)
+
+
+async def fragment_state(party_pk, names):
+    """
+    (context, cached) of a party's fragments `names`: the template variables
+    keying them and whether every one of them is in the cache.
+    """
+    if not caching_fragments():
+        return {'fragment_party': party_pk, 'fragment_version': 0, 'fragment_timeout': 0}, False
+    key = _version_key(party_pk)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    language = translation.get_language()
+    keys = [make_template_fragment_key(name, [party_pk, version, language]) for name in names]
+    cached = len(await cache.aget_many(keys)) == len(keys)
+    context = {
+        'fragment_party': party_pk,
+        'fragment_version': version,
+        'fragment_timeout': PARTY_FRAGMENT_TIMEOUT,
+    }
+    return context, cached
+
+
+def bump_party_versions(party_pks):
+    """Move parties to a new fragment version (their cached fragments are no longer used)."""
+    version = time.time_ns()
+    cache.set_many({_version_key(party_pk): version for party_pk in set(party_pks) if party_pk}, None)
+
+
+def employee_party_pks(employer_party_pk):
+    """Parties employed by an employer party (their dashboards show its name)."""
+    return (
+        PartyRelationship.objects
+        .filter(relation_from__party_id=employer_party_pk, relationship_type_id=EMPLOYMENT_RELATIONSHIP_TYPE)
+        .values_list('relation_to__party_id', flat=True)
+    )
+
+
+def relationship_party_pks(relationship):
+    """Parties on both ends of a PartyRelationship."""
+    return PartyRole.objects.filter(
+        pk__in=[relationship.relation_from_id, relationship.relation_to_id],
+    ).values_list('party_id', flat=True)
@@ -0,0 +1,351 @@
+from collections import defaultdict
+from decimal import Decimal
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import DecimalField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from .models import Account, BalanceCheckpoint, BalanceJournalEntry, ObligationBalance
+
+
+# Balance journal
+# -----------------------------------------------------------------------------
+# BalanceJournalEntry is an append-only log of balance changes, each keyed by
+# an account and, for the changes of one obligation, that obligation. An
+# obligation's balance is the sum of its entries; an account's balance the
+# sum of all of its entries (its obligations' and its own, e.g. the
+# unallocated part of a payment).
+#
+# checkpoint_balances() (`manage.py checkpoint_balances`, run periodically)
+# sums the entries since the previous checkpoint with two GROUP BYs and
+# stores a BalanceCheckpoint for every account and obligation that changed.
+# A balance at any date is then its latest checkpoint before that date plus
+# the short tail of entries since (balances()): reads cost the same whatever
+# the length of the history, and writers only ever INSERT, with no row to
+# contend for. balance_expression() is the same sum as a query expression, for
+# querysets that filter, order or total on the balance (core/ledger.py).
+#
+# The debt screens and the employer debt summaries read their balances from
+# the journal. The journal is not the write path: the stored balance columns
+# (Account.account_balance, AccountBalance, TransactionBalance,
+# ObligationBalance, InsuranceContributionBalance) are still written as
+# before, payments guard their deductions on them and the older screens read
+# them. Only account and obligation balances are journaled;
+# InsuranceContributionBalance is not. Deriving the stored columns from the
+# journal, or dropping them, is left out.
+#
+# Entries are dated when written but visible only once their transaction
+# commits, and reads only add the entries dated after the last checkpoint, so
+# a checkpoint must not pass an entry that is still in flight. Checkpoints
+# stop at a committed watermark: before the start of the oldest transaction
+# open on the database (pg_stat_activity on PostgreSQL), whose entries are
+# all dated after it, and JOURNAL_CHECKPOINT_LAG earlier still to absorb the
+# clock skew between the application and the database. However long a
+# transaction runs, its entries stay in the tail until it commits. Other
+# databases (SQLite in development) have no such view: there the lag alone
+# bounds the transactions.
+#
+# Payments append their changes directly (core/payments.py). The paths that
+# set stored account balances (loaders, APD, the synthetic generator, the
+# seed scripts) append the difference between the stored and the journal
+# balances of those accounts with sync_balance_journal(); a single
+# ObligationBalance edit journals that obligation (sync_obligation_journal).
+# A plain Account.save() is not journaled: `manage.py checkpoint_balances
+# --verify` reports such edits and --sync journals them. Migration 0021
+# journals the balances of an existing database the same way.
+
+JOURNAL_CHECKPOINT_LAG = getattr(settings, 'JOURNAL_CHECKPOINT_LAG', timedelta(minutes=5))
+JOURNAL_BATCH_SIZE = getattr(settings, 'JOURNAL_BATCH_SIZE', 2000)
+
+ACCOUNT = 'account'
+OBLIGATION = 'obligation'
+
+TWO_PLACES = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def _cents(value):
+    # SQLite sums decimals as floats
+    return Decimal(str(value or 0)).quantize(TWO_PLACES)
+
+
+def append_entries(entries, source, reference='', entry_date=None):
+    """
+    Append (account pk, obligation pk or None, amount[, reference]) changes
+    to the journal, zero amounts skipped. Returns the number of entries.
+    """
+    entry_date = entry_date or timezone.now()
+    rows = [
+        BalanceJournalEntry(
+            account_id=account_pk, obligation_id=obligation_pk, amount=amount,
+            entry_date=entry_date, source=source, reference=str(rest[0] if rest else reference)[:50],
+        )
+        for account_pk, obligation_pk, amount, *rest in entries
+        if amount
+    ]
+    BalanceJournalEntry.objects.bulk_create(rows, batch_size=JOURNAL_BATCH_SIZE)
+    return len(rows)
+
+
+def _last_checkpoint_date(as_of=None):
+    checkpoints = BalanceCheckpoint.objects.all()
+    if as_of is not None:
+        checkpoints = checkpoints.filter(as_of__lte=as_of)
+    return checkpoints.aggregate(as_of=Max('as_of'))['as_of']
+
+
+def _scope(queryset, scope, keys):
+    if scope == ACCOUNT:
+        return queryset.filter(account_id__in=keys)
+    return queryset.filter(obligation_id__in=keys)
+
+
+def _checkpoints(scope, keys, as_of):
+    """{key: balance} of the latest checkpoint at or before `as_of` of each key."""
+    latest = BalanceCheckpoint.objects.filter(as_of__lte=as_of).order_by('-as_of')
+    if scope == ACCOUNT:
+        latest = latest.filter(account_id=OuterRef('account_id'), obligation__isnull=True)
+        checkpoints = BalanceCheckpoint.objects.filter(obligation__isnull=True)
+    else:
+        latest = latest.filter(obligation_id=OuterRef('obligation_id'))
+        checkpoints = BalanceCheckpoint.objects.all()
+    return dict(
+        _scope(checkpoints, scope, keys)
+        .filter(pk=Subquery(latest.values('pk')[:1]))
+        .values_list(f'{scope}_id', 'balance')
+    )
+
+
+def _tail(scope, keys, after, until):
+    """{key: sum} of the entries of the keys in (after, until]."""
+    entries = _scope(BalanceJournalEntry.objects.all(), scope, keys)
+    if after is not None:
+        entries = entries.filter(entry_date__gt=after)
+    if until is not None:
+        entries = entries.filter(entry_date__lte=until)
+    return dict(
+        entries.values(f'{scope}_id').annotate(total=Sum('amount')).order_by().values_list(f'{scope}_id', 'total')
+    )
+
+
+def balances(scope, keys, as_of=None):
+    """
+    {key: balance} of accounts (scope ACCOUNT) or obligations (OBLIGATION)
+    pks, at `as_of` (now by default): latest checkpoint plus the entries
+    since. Keys without entries are 0.
+    """
+    keys = list(keys)
+    result = {key: ZERO for key in keys}
+    for start in range(0, len(keys), JOURNAL_BATCH_SIZE):
+        chunk = keys[start:start + JOURNAL_BATCH_SIZE]
+        # Every key that changed before a checkpoint run has a checkpoint at
+        # that run, so the tail starts at the last run for all keys
+        checkpoint_date = _last_checkpoint_date(as_of)
+        if checkpoint_date is not None:
+            for key, balance in _checkpoints(scope, chunk, checkpoint_date).items():
+                result[key] = balance
+        for key, total in _tail(scope, chunk, checkpoint_date, as_of).items():
+            result[key] = _cents(result[key] + _cents(total))
+    return result
+
+
+def balance_expression(scope, outer_ref, as_of=None):
+    """
+    Query expression of the balance at `as_of` (now by default) of the
+    account (scope ACCOUNT) or obligation (OBLIGATION) pk `outer_ref` (an
+    OuterRef), as balances() computes it.
+    """
+    key = {f'{scope}_id': outer_ref}
+    checkpoint_date = _last_checkpoint_date(as_of)
+    entries = BalanceJournalEntry.objects.filter(**key)
+    if checkpoint_date is not None:
+        entries = entries.filter(entry_date__gt=checkpoint_date)
+    if as_of is not None:
+        entries = entries.filter(entry_date__lte=as_of)
+    tail = entries.values(f'{scope}_id').annotate(total=Sum('amount')).order_by().values('total')
+    balance = Coalesce(Subquery(tail), Value(ZERO))
+    if checkpoint_date is not None:
+        checkpoints = BalanceCheckpoint.objects.filter(as_of__lte=checkpoint_date, **key).order_by('-as_of')
+        if scope == ACCOUNT:
+            checkpoints = checkpoints.filter(obligation__isnull=True)
+        balance = Coalesce(Subquery(checkpoints.values('balance')[:1]), Value(ZERO)) + balance
+    # SQLite sums decimals as floats
+    return Round(balance, 2, output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def account_balance(account, as_of=None):
+    """Journal balance of an Account (or pk) at `as_of`."""
+    account_pk = getattr(account, 'pk', account)
+    return balances(ACCOUNT, [account_pk], as_of)[account_pk]
+
+
+def obligation_balance(obligation, as_of=None):
+    """Journal balance of a TransactionObligation (or pk) at `as_of`."""
+    obligation_pk = getattr(obligation, 'pk', obligation)
+    return balances(OBLIGATION, [obligation_pk], as_of)[obligation_pk]
+
+
+def oldest_open_transaction(using='default'):
+    """Start of the oldest transaction open on the database (other than ours), or None (none, or not known)."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT min(xact_start) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND pid <> pg_backend_pid() AND xact_start IS NOT NULL"
+        )
+        return cursor.fetchone()[0]
+
+
+def checkpoint_cutoff(lag=JOURNAL_CHECKPOINT_LAG):
+    """Date up to which every entry is committed: now, or the oldest open transaction's start, minus lag."""
+    cutoff = timezone.now()
+    oldest = oldest_open_transaction()
+    if oldest is not None:
+        cutoff = min(cutoff, oldest)
+    return cutoff - lag
+
+
+def checkpoint_balances(lag=JOURNAL_CHECKPOINT_LAG, batch_size=JOURNAL_BATCH_SIZE):
+    """
+    Checkpoint every account and obligation with entries since the previous
+    checkpoint, up to checkpoint_cutoff(). Returns the number of checkpoints
+    written.
+    """
+    cutoff = checkpoint_cutoff(lag)
+    previous = _last_checkpoint_date()
+    if previous is not None and previous >= cutoff:
+        return 0
+    count = 0
+    for scope in (ACCOUNT, OBLIGATION):
+        entries = BalanceJournalEntry.objects.filter(entry_date__lte=cutoff)
+        if previous is not None:
+            entries = entries.filter(entry_date__gt=previous)
+        if scope == OBLIGATION:
+            entries = entries.filter(obligation__isnull=False)
+        changes = (
+            entries.values(f'{scope}_id', 'account_id').annotate(total=Sum('amount'))
+            .order_by(f'{scope}_id').values_list(f'{scope}_id', 'account_id', 'total')
+        )
+        batch = []
+        for row in changes.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                count += _write_checkpoints(scope, batch, previous, cutoff)
+                batch = []
+        if batch:
+            count += _write_checkpoints(scope, batch, previous, cutoff)
+    return count
+
+
+def _write_checkpoints(scope, rows, previous, cutoff):
+    # An obligation belongs to a single account: (obligation, account) rows
+    # are one per obligation
+    totals = defaultdict(Decimal)
+    accounts = {}
+    for key, account_pk, total in rows:
+        totals[key] += _cents(total)
+        accounts[key] = account_pk
+    base = _checkpoints(scope, list(totals), previous) if previous is not None else {}
+    BalanceCheckpoint.objects.bulk_create([
+        BalanceCheckpoint(
+            account_id=accounts[key],
+            obligation_id=key if scope == OBLIGATION else None,
+            as_of=cutoff,
+            balance=_cents(base.get(key, ZERO) + total),
+        )
+        for key, total in totals.items()
+    ])
+    return len(totals)
+
+
+def _stored_balances(account_pks):
+    """({account pk: stored balance}, {obligation pk: (account pk, stored balance)}) of accounts."""
+    accounts = dict(Account.objects.filter(pk__in=account_pks).values_list('pk', 'account_balance'))
+    obligations = {
+        obligation_pk: (account_pk, balance)
+        for obligation_pk, account_pk, balance in (
+            ObligationBalance.objects
+            .filter(obligation_id__transaction_id__account_id__in=account_pks)
+            .values_list('obligation_id', 'obligation_id__transaction_id__account_id', 'balance')
+        )
+    }
+    return accounts, obligations
+
+
+def sync_balance_journal(account_pks=None, source='SYNC', batch_size=JOURNAL_BATCH_SIZE):
+    """
+    Append the entries that bring the journal balances of accounts (all
+    by default) to their stored ones: ObligationBalance.balance for each
+    obligation, Account.account_balance for the account. Returns the
+    number of entries appended.
+    """
+    if account_pks is None:
+        account_pks = Account.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size)
+    account_pks = iter(account_pks)
+    count = 0
+    while True:
+        chunk = [account_pk for _, account_pk in zip(range(batch_size), account_pks)]
+        if not chunk:
+            return count
+        stored_accounts, stored_obligations = _stored_balances(chunk)
+        journal_obligations = balances(OBLIGATION, list(stored_obligations))
+        entries = []
+        obligation_deltas = defaultdict(Decimal)
+        for obligation_pk, (account_pk, balance) in stored_obligations.items():
+            delta = _cents(balance) - journal_obligations[obligation_pk]
+            obligation_deltas[account_pk] += delta
+            entries.append((account_pk, obligation_pk, delta))
+        journal_accounts = balances(ACCOUNT, list(stored_accounts))
+        for account_pk, balance in stored_accounts.items():
+            # What the obligation entries above do not already explain
+            delta = _cents(balance) - journal_accounts[account_pk] - obligation_deltas[account_pk]
+            entries.append((account_pk, None, delta))
+        with transaction.atomic():
+            count += append_entries(entries, source)
+
+
+def sync_obligation_journal(obligation_pk, source='EDIT'):
+    """
+    Append the entry bringing one obligation's journal balance to its stored
+    one, offset on its account: an edit of an ObligationBalance alone leaves
+    the account balance as it was.
+    """
+    row = (
+        ObligationBalance.objects.filter(obligation_id=obligation_pk)
+        .values_list('obligation_id__transaction_id__account_id', 'balance').first()
+    )
+    if row is None:
+        return 0
+    account_pk, balance = row
+    delta = _cents(balance) - obligation_balance(obligation_pk)
+    return append_entries([(account_pk, obligation_pk, delta), (account_pk, None, -delta)], source)
+
+
+def check_balance_journal(batch_size=JOURNAL_BATCH_SIZE):
+    """
+    Compare the journal balances with the stored ones. Returns {'accounts',
+    'obligations', 'account_drift', 'obligation_drift'} counts.
+    """
+    counts = defaultdict(int)
+    account_pks = Account.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size)
+    while True:
+        chunk = [account_pk for _, account_pk in zip(range(batch_size), account_pks)]
+        if not chunk:
+            break
+        stored_accounts, stored_obligations = _stored_balances(chunk)
+        journal_accounts = balances(ACCOUNT, list(stored_accounts))
+        journal_obligations = balances(OBLIGATION, list(stored_obligations))
+        counts['accounts'] += len(stored_accounts)
+        counts['obligations'] += len(stored_obligations)
+        counts['account_drift'] += sum(
+            1 for pk, balance in stored_accounts.items() if _cents(balance) != journal_accounts[pk]
+        )
+        counts['obligation_drift'] += sum(
+            1 for pk, (_, balance) in stored_obligations.items() if _cents(balance) != journal_obligations[pk]
+        )
+    return {key: counts[key] for key in ('accounts', 'obligations', 'account_drift', 'obligation_drift')}
@@ -0,0 +1,203 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Sum
+from django.utils import timezone
+
+from . import journal
+from .models import Account, EmployerDebtSummary, ObligationBalance, PartyRoleType
+
+
+# Obligations ledger
+# -----------------------------------------------------------------------------
+# The debt screens list the obligations of an employer's accounts together with
+# their outstanding balance. Everything needed lives on the
+# ObligationBalance -> TransactionObligation -> AccountTransaction -> Account
+# chain, so one joined query returns the rows and a second aggregate query the
+# totals, however many years of obligations an account has built up. The
+# outstanding balance of each obligation is its balance journal balance
+# (core/journal.py), annotated as `journal_balance`.
+
+# AccountType.account_type_id values (seeded in populate_db.py)
+ACCOUNT_TYPE_CURRENT = 1      # CONTRIB: current contributions
+ACCOUNT_TYPE_SETTLED = 2      # SET_DEBT_OVERDUE: settled overdue debts (KEAO)
+ACCOUNT_TYPE_UNSETTLED = 3    # UNSET_DEBT_OVERDUE: unsettled overdue debts (KEAO)
+
+def obligations_ledger(party_role, account_type_id=None, account=None, positive_only=False):
+    """
+    Return the ObligationBalance queryset of a party role's accounts, with
+    their journal balance as `journal_balance`.
+
+    account_type_id -- only accounts of this AccountType.account_type_id
+    account         -- only this Account
+    positive_only   -- only obligations with an outstanding balance (> 0)
+    """
+    balances = ObligationBalance.objects.filter(
+        obligation_id__transaction_id__account_id__party_role_id=party_role,
+    ).annotate(journal_balance=journal.balance_expression(journal.OBLIGATION, OuterRef('obligation_id')))
+    if account_type_id is not None:
+        balances = balances.filter(
+            obligation_id__transaction_id__account_id__account_type_id__account_type_id=account_type_id,
+        )
+    if account is not None:
+        balances = balances.filter(obligation_id__transaction_id__account_id=account)
+    if positive_only:
+        balances = balances.filter(journal_balance__gt=0)
+
+    return (
+        balances
+        .select_related('obligation_id')
+        .order_by('-obligation_id__transaction_id__transaction_date', 'obligation_id__pk', 'pk')
+    )
+
+
+def obligation_due_date(obligation):
+    """Due date of an obligation: end of the month following its period."""
+    # months 13-15 are bonuses, their calendar month is the reference month
+    month = obligation.month if obligation.month <= 12 else obligation.reference_month
+    return datetime(obligation.year, month, 28) + timedelta(days=32)
+
+
+def ledger_rows(balances):
+    """Materialize a ledger queryset into the rows the debt screens render."""
+    rows = []
+    for obl_bal in balances:
+        obl = obl_bal.obligation_id
+        rows.append({
+            'obligation': obl,
+            'period': f"{obl.month:02d}/{obl.year}",
+            'description': obl.obligation_description,
+            'type': obl.obligation_type,
+            'amount': obl_bal.journal_balance,
+            'rf_code': obl.rf_code,
+            'reference': obl.rf_code or 'N/A',
+            'due_date': obligation_due_date(obl),
+        })
+    return rows
+
+
+def ledger_totals(balances):
+    """Total outstanding balance and number of obligations, computed in the DB."""
+    totals = balances.order_by().aggregate(total=Sum('journal_balance'), count=Count('pk'))
+    return {
+        'total': totals['total'] or Decimal('0.00'),
+        'count': totals['count'],
+    }
+
+
+# Employer debt summary
+# -----------------------------------------------------------------------------
+# EmployerDebtSummary keeps the per-employer totals of the dashboards so they
+# need a single primary-key read. A party's row is recomputed from the journal
+# balances of its accounts (core/journal.py) after every committed change to
+# one of its Account or ObligationBalance rows or payments, and on a read that
+# finds none (e.g. on a database that predates the table);
+# rebuild_debt_summaries() recomputes all of them to fix drift, e.g. after
+# bulk loads that bypass model signals.
+
+SUMMARY_FIELDS = {
+    ACCOUNT_TYPE_CURRENT: 'current_balance',
+    ACCOUNT_TYPE_SETTLED: 'settled_keao_balance',
+    ACCOUNT_TYPE_UNSETTLED: 'unsettled_keao_balance',
+}
+
+
+def _debt_balances(party_pks=None):
+    """Return {party pk: {summary field: balance}} from the journal balances of employer accounts."""
+    employer_role_types = PartyRoleType.objects.filter(role_type_code='EMP').values('role_type_id')
+    accounts = Account.objects.filter(
+        account_type_id__account_type_id__in=SUMMARY_FIELDS,
+        party_role_id__role_type_id__in=employer_role_types,
+    )
+    if party_pks is not None:
+        accounts = accounts.filter(party_role_id__party_id__in=party_pks)
+    rows = list(accounts.values_list('pk', 'party_role_id__party_id', 'account_type_id__account_type_id'))
+    account_balances = journal.balances(journal.ACCOUNT, [account_pk for account_pk, _, _ in rows])
+
+    balances = {}
+    for account_pk, party_pk, account_type in rows:
+        party_balances = balances.setdefault(
+            party_pk, {field: Decimal('0.00') for field in SUMMARY_FIELDS.values()},
+        )
+        party_balances[SUMMARY_FIELDS[account_type]] += account_balances[account_pk]
+    return balances
+
+
+def _summary_defaults(balances, now):
+    defaults = dict(balances)
+    defaults['total_balance'] = sum(balances.values(), Decimal('0.00'))
+    defaults['last_change_date'] = now
+    return defaults
+
+
+def refresh_debt_summary(party_pk):
+    """Recompute the debt summary of a single employer party."""
+    balances = _debt_balances([party_pk]).get(party_pk)
+    if balances is None:
+        EmployerDebtSummary.objects.filter(party_id=party_pk).delete()
+        return None
+    summary, _ = EmployerDebtSummary.objects.update_or_create(
+        party_id_id=party_pk,
+        defaults=_summary_defaults(balances, timezone.now()),
+    )
+    return summary
+
+
+def schedule_debt_summary_refresh(party_pk):
+    """Refresh a party's debt summary once the current transaction commits."""
+    if party_pk is not None:
+        transaction.on_commit(lambda: refresh_debt_summary(party_pk))
+
+
+def _write_summaries(balances, batch_size):
+    now = timezone.now()
+    EmployerDebtSummary.objects.bulk_create(
+        [
+            EmployerDebtSummary(party_id_id=party_pk, **_summary_defaults(party_balances, now))
+            for party_pk, party_balances in balances.items()
+        ],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['party_id'],
+        update_fields=list(SUMMARY_FIELDS.values()) + ['total_balance', 'last_change_date'],
+    )
+    return len(balances)
+
+
+def refresh_debt_summaries(party_pks, batch_size=1000):
+    """Recompute the debt summaries of many parties, one grouped aggregate per batch. Returns the number of rows."""
+    party_pks = list(party_pks)
+    count = 0
+    for start in range(0, len(party_pks), batch_size):
+        chunk = party_pks[start:start + batch_size]
+        balances = _debt_balances(chunk)
+        with transaction.atomic():
+            EmployerDebtSummary.objects.filter(party_id__in=chunk).exclude(party_id__in=balances.keys()).delete()
+            count += _write_summaries(balances, batch_size)
+    return count
+
+
+def schedule_debt_summaries_refresh(party_pks):
+    """Refresh the debt summaries of many parties once the current transaction commits."""
+    party_pks = {party_pk for party_pk in party_pks if party_pk is not None}
+    if party_pks:
+        transaction.on_commit(lambda: refresh_debt_summaries(party_pks))
+
+
+def rebuild_debt_summaries(batch_size=1000):
+    """Recompute every employer debt summary. Returns the number of rows."""
+    balances = _debt_balances()
+    with transaction.atomic():
+        EmployerDebtSummary.objects.exclude(party_id__in=balances.keys()).delete()
+        return _write_summaries(balances, batch_size)
+
+
+def get_debt_summary(party):
+    """Return the debts dict of an employer party, computing it if missing (zeros if it has no accounts)."""
+    summary = EmployerDebtSummary.objects.filter(party_id=party).first()
+    if summary is None:
+        summary = refresh_debt_summary(getattr(party, 'pk', party))
+    if summary is None:
+        return {'current': 0.00, 'overdue_keao_settled': 0.00, 'overdue_keao_unsettled': 0.00, 'total': 0.00}
+    return summary.as_debts()
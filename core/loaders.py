@@ -0,0 +1,428 @@
+import csv
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import (
+    Account, AccountBalance, AccountTransaction, IdSequence, InsuranceContribution, InsuranceContributionBalance,
+    ObligationBalance, PartyIdentifier, PartyIdentifierType, TransactionBalance,
+    TransactionObligation
+)
+from .prefill import refresh_latest_contribution
+from .accrual import refresh_insurance_days
+from .journal import sync_balance_journal
+from .pensions import refresh_pension_projections
+from .rollups import refresh_contribution_rollups
+
+
+# Bulk contribution loader
+# -----------------------------------------------------------------------------
+# Loads contribution lines in the data/insurance_contributions.csv format. Each
+# line becomes an AccountTransaction, TransactionBalance, TransactionObligation,
+# ObligationBalance, InsuranceContribution and InsuranceContributionBalance.
+# Business IDs (and the RF codes built from them) are reserved per chunk from
+# an IdSequence, so every load gets IDs of its own, foreign keys are resolved
+# in memory and every table is written with a few set-based statements per
+# chunk (COPY on PostgreSQL). Model signals are bypassed, call finalize() once
+# loading is done.
+
+LOAD_BATCH_SIZE = 5000
+PAID_BEFORE = date(2025, 11, 1)
+TWO_PLACES = Decimal('0.01')
+
+# Business IDs of loaded rows start here, below the generator range
+# (synthetic.FIRST_LINE_ID) and above the IDs of the line-number loads
+LOAD_ID_SEQUENCE = 'contribution_load'
+LOAD_FIRST_LINE_ID = getattr(settings, 'LOAD_FIRST_LINE_ID', 10_000_000)
+
+
+def _parse_date(value):
+    day, month, year = value.split('/')
+    return timezone.make_aware(datetime(int(year), int(month), int(day)))
+
+
+def parse_contribution_csv(f):
+    """Yield parsed contribution lines from a CSV file object."""
+    for row in csv.DictReader(f):
+        yield {
+            'start_date': _parse_date(row['start_date']),
+            'end_date': _parse_date(row['end_date']),
+            'days': int(row['days']) if row['days'] else 0,
+            'months': int(row['months']) if row['months'] else 0,
+            'earnings_type': int(row['earnings_type']),
+            'branch_code': int(row['branch_code']),
+            'gross_earnings': Decimal(row['gross_earnings']),
+            'total_contribution': Decimal(row['total_contribution']),
+            'employer_ame': row.get('employer_ame', '').strip(),
+        }
+
+
+def get_employers_by_ame():
+    """Return {AME: employer Party.party_id} for every AME identifier."""
+    ame_type_ids = PartyIdentifierType.objects.filter(identifier_type_code='AME').values('identifier_type_id')
+    identifiers = (
+        PartyIdentifier.objects
+        .filter(identifier_type_id__in=ame_type_ids)
+        .order_by('-pk')
+        .values_list('identifier_value', 'party_id__party_id')
+    )
+    return dict(identifiers)
+
+
+def reserve_ids(name, count, first=1):
+    """Reserve `count` consecutive ids of the named sequence (starting at `first`). Returns a range."""
+    with transaction.atomic():
+        if not IdSequence.objects.filter(name=name).update(next_id=F('next_id') + count):
+            try:
+                with transaction.atomic():
+                    IdSequence.objects.create(name=name, next_id=first + count)
+            except IntegrityError:
+                # Created concurrently
+                IdSequence.objects.filter(name=name).update(next_id=F('next_id') + count)
+        next_id = IdSequence.objects.filter(name=name).values_list('next_id', flat=True).get()
+    return range(next_id - count, next_id)
+
+
+class TableWriter:
+    """
+    Batched "update existing, insert missing" writer for one table, keyed by
+    a business id column (unique or not).
+
+    Rows are plain tuples in `fields` order; audit columns (status, dates,
+    created_by/last_updated_by, uuid) are added here. On PostgreSQL a batch is
+    COPYed into a temporary table and merged with two set-based statements
+    (rows whose values did not change are left untouched); other backends use
+    executemany. `created_fields` are extra timestamp columns set on insert
+    only (auto_now_add). `write()` returns {business id: pk}.
+    """
+
+    AUDIT_FIELDS = ['status', 'creation_date', 'created_by', 'last_update_date', 'last_updated_by', 'uuid']
+
+    def __init__(self, model, key_field, fields, created_by='sys', created_fields=()):
+        self.model = model
+        self.table = model._meta.db_table
+        self.key_field = key_field
+        self.fields = [key_field] + fields
+        self.created_by = created_by
+        self.created_fields = list(created_fields)
+
+        meta_fields = [
+            model._meta.get_field(name)
+            for name in self.fields + self.AUDIT_FIELDS + self.created_fields
+        ]
+        self.columns = [field.column for field in meta_fields]
+        self.adapters = [self._adapter(field) for field in meta_fields]
+        self.key_column = self.columns[0]
+        # Columns refreshed on update (never creation_date, created_by or uuid)
+        self.update_columns = [field.column for field in meta_fields[1:len(self.fields)]]
+
+    @staticmethod
+    def _adapter(field):
+        if isinstance(field, models.DateTimeField):
+            return connection.ops.adapt_datetimefield_value
+        if isinstance(field, models.UUIDField) and not connection.features.has_native_uuid_field:
+            return lambda value: value.hex
+        return None
+
+    def _prepare(self, rows):
+        n = len(self.fields)
+        now = timezone.now()
+        # The audit values are the same for the whole batch, adapt them once
+        audit = [1, now, self.created_by, now, self.created_by, None] + [now] * len(self.created_fields)
+        for i, adapt in enumerate(self.adapters[n:]):
+            if adapt is not None and audit[i] is not None:
+                audit[i] = adapt(audit[i])
+        row_adapters = [(i, adapt) for i, adapt in enumerate(self.adapters[:n]) if adapt is not None]
+        uuid_position = n + self.AUDIT_FIELDS.index('uuid')
+        adapt_uuid = self.adapters[uuid_position] or (lambda value: value)
+
+        prepared = []
+        for row in rows:
+            values = list(row) + audit
+            for i, adapt in row_adapters:
+                values[i] = adapt(values[i])
+            values[uuid_position] = adapt_uuid(uuid.uuid4())
+            prepared.append(values)
+        return prepared
+
+    def write(self, rows):
+        rows = self._prepare(rows)
+        keys = [row[0] for row in rows]
+        if connection.vendor == 'postgresql':
+            self._write_copy(rows)
+            return self._pks(keys)
+
+        existing = self._pks(keys)
+        self._write_executemany(rows, existing)
+        if len(existing) < len(set(keys)):
+            existing = self._pks(keys)
+        return existing
+
+    def _pks(self, keys):
+        """Return {business id: pk} of the given keys (lowest pk wins)."""
+        if not keys:
+            return {}
+        wanted = set(keys)
+        # A range filter instead of a (large) IN list; business ids of a batch
+        # are usually contiguous.
+        rows = (
+            self.model.objects
+            .filter(**{f'{self.key_field}__gte': min(wanted), f'{self.key_field}__lte': max(wanted)})
+            .order_by('-pk')
+            .values_list(self.key_field, 'pk')
+        )
+        return {key: pk for key, pk in rows if key in wanted}
+
+    def _write_copy(self, rows):
+        qn = connection.ops.quote_name
+        table, tmp = qn(self.table), qn(f'load_{self.table}')
+        columns = ', '.join(qn(c) for c in self.columns)
+        key = qn(self.key_column)
+        updated = self.update_columns + ['last_update_date', 'last_updated_by']
+        assignments = ', '.join(f'{qn(c)} = s.{qn(c)}' for c in updated)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {tmp} AS SELECT {columns} FROM {table} WITH NO DATA')
+            cursor.execute(f'TRUNCATE {tmp}')
+            with cursor.cursor.copy(f'COPY {tmp} ({columns}) FROM STDIN') as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cursor.execute(
+                f'UPDATE {table} t SET {assignments} FROM {tmp} s '
+                f'WHERE t.{key} = s.{key} AND ({", ".join("t." + qn(c) for c in self.update_columns)}) '
+                f'IS DISTINCT FROM ({", ".join("s." + qn(c) for c in self.update_columns)})'
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {tmp} s '
+                f'WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{key} = s.{key})'
+            )
+
+    def _write_executemany(self, rows, existing):
+        # Existing rows are updated by primary key (the business id column is
+        # not always indexed), missing ones inserted.
+        qn = connection.ops.quote_name
+        table = qn(self.table)
+        columns = ', '.join(qn(c) for c in self.columns)
+        placeholders = ', '.join(['%s'] * len(self.columns))
+        updated = self.update_columns + ['last_update_date', 'last_updated_by']
+        assignments = ', '.join(f'{qn(c)} = %s' for c in updated)
+        positions = [self.columns.index(c) for c in updated]
+        pk = qn(self.model._meta.pk.column)
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {table} SET {assignments} WHERE {pk} = %s',
+                [[row[i] for i in positions] + [existing[row[0]]] for row in rows if row[0] in existing],
+            )
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                [row for row in rows if row[0] not in existing],
+            )
+
+
+def contribution_writers(created_by='sys'):
+    """TableWriters of the six tables a contribution line is written to."""
+    return {
+        'transaction': TableWriter(AccountTransaction, 'account_transaction_id', [
+            'account_id', 'transaction_description', 'transaction_type', 'debit_credit_flag',
+        ], created_by, created_fields=['transaction_date']),
+        'transaction_balance': TableWriter(TransactionBalance, 'transaction_balance_id', [
+            'transaction_id', 'amount', 'balance',
+        ], created_by),
+        'obligation': TableWriter(TransactionObligation, 'obligation_id', [
+            'transaction_id', 'obligation_description', 'obligation_type', 'month',
+            'reference_month', 'year', 'rf_code',
+        ], created_by),
+        'obligation_balance': TableWriter(ObligationBalance, 'obligation_balance_id', [
+            'obligation_id', 'amount', 'balance',
+        ], created_by),
+        'contribution': TableWriter(InsuranceContribution, 'insurance_contribution_id', [
+            'account_transaction_id', 'obligation_id', 'party_id', 'coverage_package_id',
+            'insurance_days', 'start_date', 'end_date', 'earning_type_id', 'gross_earnings',
+            'total_contribution', 'employer_id', 'insurance_id',
+        ], created_by),
+        'contribution_balance': TableWriter(InsuranceContributionBalance, 'insurance_contribution_balance_id', [
+            'insurance_contribution_id', 'amount', 'balance',
+        ], created_by),
+    }
+
+
+def write_obligations(writers, rows):
+    """
+    Write transaction + obligation rows (and their balances). Each row is a
+    dict with id, account, description, type, obligation_description,
+    obligation_type, month, reference_month, year, rf_code, amount, balance.
+    Returns ({id: transaction pk}, {id: obligation pk}).
+    """
+    tx_pks = writers['transaction'].write([
+        (row['id'], row['account'], row['description'], row['type'], 'D')
+        for row in rows
+    ])
+    writers['transaction_balance'].write([
+        (row['id'], tx_pks[row['id']], row['amount'], row['balance'])
+        for row in rows
+    ])
+    obl_pks = writers['obligation'].write([
+        (row['id'], tx_pks[row['id']], row['obligation_description'], row['obligation_type'],
+         row['month'], row['reference_month'], row['year'], row['rf_code'])
+        for row in rows
+    ])
+    writers['obligation_balance'].write([
+        (row['id'], obl_pks[row['id']], row['amount'], row['balance'])
+        for row in rows
+    ])
+    return tx_pks, obl_pks
+
+
+def write_contributions(writers, rows):
+    """
+    Write contribution rows: write_obligations() plus InsuranceContribution
+    and its balance. Rows additionally carry party, insurance_id, employer_id,
+    branch_code, days, start_date, end_date, earnings_type and gross.
+    """
+    tx_pks, obl_pks = write_obligations(writers, rows)
+    ic_pks = writers['contribution'].write([
+        (row['id'], tx_pks[row['id']], obl_pks[row['id']], row['party'], row['branch_code'], row['days'],
+         row['start_date'], row['end_date'], row['earnings_type'], row['gross'], row['amount'],
+         row['employer_id'], row['insurance_id'])
+        for row in rows
+    ])
+    writers['contribution_balance'].write([
+        (row['id'], ic_pks[row['id']], row['amount'], row['balance'])
+        for row in rows
+    ])
+
+
+def refresh_account_balances(account_pks, updated_by='sys'):
+    """
+    Recompute the balance of many accounts from their transactions (one
+    grouped sum), write their AccountBalance rows and bring their balance
+    journal up to date. Bulk writes skip the Account signals: refresh the
+    debt summaries of employer accounts too.
+    """
+    account_pks = list(account_pks)
+    totals = dict(
+        TransactionBalance.objects
+        .filter(transaction_id__account_id__in=account_pks)
+        .values('transaction_id__account_id')
+        .annotate(total=Sum('balance'))
+        .values_list('transaction_id__account_id', 'total')
+    )
+    accounts = list(Account.objects.filter(pk__in=account_pks))
+    now = timezone.now()
+    for account in accounts:
+        account.account_balance = totals.get(account.pk) or Decimal('0.00')
+        account.last_updated_by = updated_by
+        account.last_update_date = now
+    Account.objects.bulk_update(accounts, ['account_balance', 'last_updated_by', 'last_update_date'],
+                                batch_size=LOAD_BATCH_SIZE)
+    TableWriter(AccountBalance, 'account_balance_id', ['account_id', 'balance'], updated_by).write([
+        (account.account_id, account.pk, account.account_balance) for account in accounts
+    ])
+    sync_balance_journal([account.pk for account in accounts], source='LOAD')
+    return len(accounts)
+
+
+class ContributionLoader:
+    """
+    Load contribution lines for one insured party into one account.
+
+    multiplier  -- scales gross earnings and contributions (demo data)
+    paid_before -- lines starting before this date are loaded as paid
+    """
+
+    def __init__(self, account, party, multiplier=Decimal('1'), paid_before=PAID_BEFORE,
+                 default_employer_id=None, batch_size=LOAD_BATCH_SIZE, created_by='sys'):
+        self.account = account
+        self.party = party
+        self.multiplier = Decimal(str(multiplier))
+        self.paid_before = timezone.make_aware(datetime.combine(paid_before, datetime.min.time()))
+        self.default_employer_id = default_employer_id
+        self.batch_size = batch_size
+        self.created_by = created_by
+        self.employers = get_employers_by_ame()
+        self.loaded = 0
+        self.writers = contribution_writers(created_by)
+
+    def load(self, lines):
+        """Load an iterable of parsed lines in batches. Every call adds rows."""
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, self.batch_size))
+            if not batch:
+                break
+            # Reserved before the batch transaction, so the sequence is not held while it writes
+            row_ids = reserve_ids(LOAD_ID_SEQUENCE, len(batch), LOAD_FIRST_LINE_ID)
+            with transaction.atomic():
+                self._write_batch(zip(row_ids, batch))
+            self.loaded += len(batch)
+        return self.loaded
+
+    def _employer_id(self, ame):
+        employer_id = self.employers.get(ame, self.default_employer_id)
+        if employer_id is None:
+            raise ValueError(f"Unknown employer AME: {ame!r}")
+        return employer_id
+
+    def _write_batch(self, batch):
+        rows = []
+        for row_id, line in batch:
+            start_date = line['start_date']
+            month, year = start_date.month, start_date.year
+            total = (line['total_contribution'] * self.multiplier).quantize(TWO_PLACES)
+            rows.append({
+                'id': row_id,
+                'account': self.account.pk,
+                'description': f'APD Submission {month:02d}/{year}',
+                'type': 'APD',
+                'obligation_description': f'Contribution {month:02d}/{year}',
+                'obligation_type': 'CONTRIB',
+                'month': month,
+                'reference_month': month,
+                'year': year,
+                'rf_code': f'RF91{year}{month:02d}{row_id:010d}',
+                'amount': total,
+                'balance': Decimal('0.00') if start_date < self.paid_before else total,
+                'party': self.party.pk,
+                'insurance_id': self.party.party_id,
+                'employer_id': self._employer_id(line['employer_ame']),
+                'branch_code': line['branch_code'],
+                'days': line['days'],
+                'start_date': start_date,
+                'end_date': line['end_date'],
+                'earnings_type': line['earnings_type'],
+                'gross': (line['gross_earnings'] * self.multiplier).quantize(TWO_PLACES),
+            })
+        write_contributions(self.writers, rows)
+
+    def finalize(self):
+        """
+        Recompute the account balance from its transactions (DB-side sum) and
+        its balance journal, the party's latest contribution pointer, contribution rollups, insurance
+        days and pension projections (bulk writes skip the signals).
+        """
+        total = (
+            TransactionBalance.objects
+            .filter(transaction_id__account_id=self.account)
+            .aggregate(total=Sum('balance'))['total']
+        ) or Decimal('0.00')
+
+        self.account.account_balance = total
+        self.account.last_updated_by = self.created_by
+        self.account.save()
+        AccountBalance.objects.update_or_create(
+            account_balance_id=self.account.account_id,
+            defaults={'account_id': self.account, 'balance': total, 'created_by': self.created_by},
+        )
+        sync_balance_journal([self.account.pk], source='LOAD')
+        refresh_latest_contribution(self.party.pk)
+        refresh_contribution_rollups([self.party.pk])
+        refresh_insurance_days([self.party.pk])
+        refresh_pension_projections([self.party.pk])
+        return total
@@ -0,0 +1,95 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import (
+    BUDGETS_FILE, DATASETS, HANDLERS, budgets_from_results, check_budgets, compare_handlers, load_budgets,
+    run_benchmarks, save_budgets
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every view (insured and employer roles) against a generated dataset: "
+        "latency percentiles, SQL query counts and SQL time. Fails when a view goes over "
+        "its stored budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=sorted(DATASETS), default='small')
+        parser.add_argument('--generate', action='store_true',
+                            help="Generate the dataset first (use an empty database per dataset).")
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--view', action='append', dest='views',
+                            help="Only this view (url name or role:url_name), can be repeated.")
+        parser.add_argument('--output', '-o', help="Write the results as JSON to this file.")
+        parser.add_argument('--budgets', default=BUDGETS_FILE)
+        parser.add_argument('--update-budgets', action='store_true',
+                            help="Store the measured results as the dataset's budgets.")
+        parser.add_argument('--headroom', type=float, default=2.0,
+                            help="Latency headroom factor used by --update-budgets.")
+        parser.add_argument('--handler', choices=sorted(HANDLERS), default='wsgi',
+                            help="Send the requests through the WSGI or the ASGI handler.")
+        parser.add_argument('--compare', action='store_true',
+                            help="Run the views through both handlers and compare their latency.")
+        parser.add_argument('--query-latency', type=float, default=0, metavar='MS',
+                            help="Delay every query by MS milliseconds (a database server's round trip).")
+
+    def handle(self, *args, **options):
+        dataset = options['dataset']
+        if options['generate']:
+            call_command('generate_dataset', stdout=self.stdout, **DATASETS[dataset])
+
+        if options['update_budgets'] and options['query_latency']:
+            raise CommandError("--update-budgets records real latencies, drop --query-latency.")
+
+        handlers = ['wsgi', 'asgi'] if options['compare'] else [options['handler']]
+        runs = {}
+        try:
+            for handler in handlers:
+                self.stdout.write(f"Benchmarking views on the {dataset} dataset ({handler.upper()} handler)...")
+                runs[handler] = run_benchmarks(
+                    dataset, options['iterations'], options['warmup'], options['views'], stdout=self.stdout,
+                    handler=handler, query_latency=options['query_latency'] / 1000,
+                )
+        except LookupError as e:
+            raise CommandError(str(e))
+        results = runs[handlers[0]]
+
+        budgets = load_budgets(options['budgets'])
+        if options['update_budgets']:
+            budgets.setdefault(dataset, {}).update(budgets_from_results(results, options['headroom']))
+            save_budgets(budgets, options['budgets'])
+            self.stdout.write(self.style.SUCCESS(f"Budgets of the {dataset} dataset updated."))
+
+        # Every handler is held to the same budgets
+        failures = []
+        for handler, run in runs.items():
+            run['failures'] = check_budgets(run, budgets)
+            failures += [f"{failure} ({handler.upper()})" if len(runs) > 1 else failure for failure in run['failures']]
+        if options['compare']:
+            self._write_comparison(compare_handlers(runs))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(runs if options['compare'] else results, f, indent=2)
+
+        if results['unbudgeted']:
+            self.stdout.write(self.style.WARNING(
+                f"No budget for {', '.join(results['unbudgeted'])} (record one with --update-budgets)."
+            ))
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f"{len(failures)} view(s) over budget.")
+        self.stdout.write(self.style.SUCCESS(f"{len(results['views'])} views within budget."))
+
+    def _write_comparison(self, rows):
+        self.stdout.write(f"  {'view':<40} {'WSGI p50':>10} {'ASGI p50':>10} {'WSGI p95':>10} {'ASGI p95':>10}  ASGI/WSGI")
+        for name, latencies, ratio in rows:
+            (wsgi_p50, wsgi_p95), (asgi_p50, asgi_p95) = latencies['wsgi'], latencies['asgi']
+            self.stdout.write(
+                f"  {name:<40} {wsgi_p50:>8.1f}ms {asgi_p50:>8.1f}ms {wsgi_p95:>8.1f}ms {asgi_p95:>8.1f}ms  "
+                f"{ratio if ratio is not None else '-':>9}"
+            )
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.accrual import ACCRUAL_BATCH_SIZE, check_insurance_days
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-derive every party's InsuranceDaysAccrual from its contributions and report the "
+        "missing, stale and orphaned counters."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Rewrite the wrong counters.")
+        parser.add_argument('--batch-size', type=int, default=ACCRUAL_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = check_insurance_days(fix=options['fix'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        wrong = counts['missing'] + counts['stale'] + counts['orphaned']
+        summary = (
+            f"Checked {counts['checked']} parties in {elapsed:.1f}s: {counts['missing']} missing, "
+            f"{counts['stale']} stale, {counts['orphaned']} orphaned."
+        )
+        if wrong and not options['fix']:
+            raise CommandError(f"{summary} Run with --fix to repair them.")
+        self.stdout.write(self.style.SUCCESS(summary + (" Fixed." if wrong else "")))
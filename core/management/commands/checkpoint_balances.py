@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.journal import JOURNAL_BATCH_SIZE, check_balance_journal, checkpoint_balances, sync_balance_journal
+
+
+class Command(BaseCommand):
+    help = (
+        "Checkpoint the balance journal: store the balance of every account and obligation "
+        "changed since the previous checkpoint. Run periodically (e.g. every few minutes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync', action='store_true',
+                            help="First journal the difference to the stored balances (e.g. on an existing database).")
+        parser.add_argument('--verify', action='store_true',
+                            help="Compare the journal balances with the stored ones.")
+        parser.add_argument('--batch-size', type=int, default=JOURNAL_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['sync']:
+            synced = sync_balance_journal(batch_size=options['batch_size'])
+            self.stdout.write(f"Journaled {synced} balance corrections.")
+        written = checkpoint_balances(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} balance checkpoints in {elapsed:.1f}s."))
+
+        if options['verify']:
+            counts = check_balance_journal(batch_size=options['batch_size'])
+            summary = (
+                f"Checked {counts['accounts']} accounts and {counts['obligations']} obligations: "
+                f"{counts['account_drift']} account and {counts['obligation_drift']} obligation balances differ."
+            )
+            if counts['account_drift'] or counts['obligation_drift']:
+                raise CommandError(f"{summary} Run with --sync to journal the difference.")
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.advisor import advise
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN on the queries each view issues and report sequential scans of "
+        "large tables and sorts no index serves. Run against a large generated dataset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', action='append', dest='views',
+                            help="Only this view (url name or role:url_name), can be repeated.")
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help="Ignore scans of tables with fewer rows.")
+        parser.add_argument('--include-sorts', action='store_true',
+                            help="Also report sorts no index serves (SQLite only).")
+        parser.add_argument('--output', '-o', help="Write the findings as JSON to this file.")
+        parser.add_argument('--fail', action='store_true', help="Exit with an error if anything is reported.")
+
+    def handle(self, *args, **options):
+        try:
+            findings = advise(options['views'], options['min_rows'], options['include_sorts'])
+        except (LookupError, NotImplementedError) as e:
+            raise CommandError(str(e))
+
+        for finding in findings:
+            rows = f" ({finding['rows']} rows)" if finding['rows'] is not None else ''
+            self.stdout.write(f"{finding['view']}: {finding['detail']}{rows}")
+            self.stdout.write(f"    {finding['sql'][:300]}")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(findings, f, indent=2)
+
+        if not findings:
+            self.stdout.write(self.style.SUCCESS("No sequential scans of large tables found."))
+        elif options['fail']:
+            raise CommandError(f"{len(findings)} plan issue(s) found.")
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(findings)} plan issue(s) found."))
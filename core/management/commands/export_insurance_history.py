@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import EXPORT_CHUNK_SIZE, iter_history_csv, write_history_xlsx
+from core.models import Party
+
+
+class Command(BaseCommand):
+    help = "Export the insurance history of one or more insured persons as CSV or XLSX."
+
+    def add_arguments(self, parser):
+        parser.add_argument('party_ids', nargs='*', type=int, help="Party.party_id values to export.")
+        parser.add_argument('--all', action='store_true', help="Export every party with contributions.")
+        parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+        parser.add_argument('--output', '-o', help="Output file (default: stdout, CSV only).")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['all']:
+            parties = Party.objects.filter(contributions__isnull=False).distinct()
+        elif options['party_ids']:
+            parties = Party.objects.filter(party_id__in=options['party_ids'])
+        else:
+            raise CommandError("Give one or more party ids or --all.")
+        party_pks = parties.values('pk')
+
+        if options['format'] == 'xlsx':
+            if not options['output']:
+                raise CommandError("--output is required for XLSX exports.")
+            try:
+                xlsx = write_history_xlsx(party_pks, options['chunk_size'])
+            except ImportError:
+                raise CommandError("XLSX export needs openpyxl (pip install openpyxl).")
+            with xlsx, open(options['output'], 'wb') as f:
+                for block in iter(lambda: xlsx.read(1024 * 1024), b''):
+                    f.write(block)
+            return
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in iter_history_csv(party_pks, options['chunk_size']):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,94 @@
+import multiprocessing
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _init_worker():
+    # Spawned workers start with a fresh interpreter
+    import django
+    django.setup()
+
+
+def _generate(args):
+    from core.synthetic import generate_employer_block
+    return generate_employer_block(*args)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic dataset of employers, insured employees and years of "
+        "contributions for load and benchmark testing. Deterministic for a given seed "
+        "and safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employers', type=int, default=10, help="Number of employers.")
+        parser.add_argument('--insured', type=int, default=50, help="Insured persons per employer.")
+        parser.add_argument('--years', type=int, default=4, help="Years of monthly contributions.")
+        parser.add_argument('--until', type=int, default=202509, help="Last contribution month (YYYYMM).")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Worker processes (keep 1 on SQLite, which allows a single writer).")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        from core.accrual import check_insurance_days
+        from core.journal import checkpoint_balances
+        from core.ledger import rebuild_debt_summaries
+        from core.pensions import refresh_pension_projections
+        from core.prefill import invalidate_ama_index, rebuild_latest_contributions
+        from core.rollups import rebuild_contribution_rollups
+        from core.synthetic import check_id_space, ensure_reference_data
+
+        until = options['until']
+        if not 1 <= until % 100 <= 12:
+            raise CommandError("--until must be a YYYYMM month.")
+        try:
+            check_id_space(options['employers'], options['insured'], options['years'] * 12)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        ensure_reference_data()
+        tasks = [
+            (index, options['seed'], options['insured'], until, options['years'], options['batch_size'])
+            for index in range(options['employers'])
+        ]
+
+        started = time.perf_counter()
+        totals = {'parties': 0, 'lines': 0}
+        if options['workers'] > 1:
+            from django.db import connections
+            connections.close_all()
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(options['workers'], initializer=_init_worker) as pool:
+                for done, result in enumerate(pool.imap_unordered(_generate, tasks), start=1):
+                    self._progress(done, len(tasks), result, totals, started)
+        else:
+            for done, task in enumerate(tasks, start=1):
+                self._progress(done, len(tasks), _generate(task), totals, started)
+
+        summaries = rebuild_debt_summaries()
+        # Bulk writes skip the signals that keep the prefill lookups current
+        pointers = rebuild_latest_contributions()
+        invalidate_ama_index()
+        rollups = rebuild_contribution_rollups()
+        accruals = check_insurance_days(fix=True)
+        projected = refresh_pension_projections()
+        # The loaders journal every balance; checkpoint it all, nothing is in flight
+        checkpoints = checkpoint_balances(lag=timedelta(0))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {totals['parties']} parties and {totals['lines']} contribution lines "
+            f"in {elapsed:.1f}s ({totals['lines'] / elapsed if elapsed else 0:,.0f} lines/s); "
+            f"{summaries} employer debt summaries, {pointers} latest contributions, "
+            f"{rollups} contribution rollups, {accruals['missing'] + accruals['stale']} insurance day "
+            f"accruals, {projected} pension projections and {checkpoints} balance checkpoints rebuilt."
+        ))
+
+    def _progress(self, done, total, result, totals, started):
+        totals['parties'] += result['parties']
+        totals['lines'] += result['lines']
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"  {done}/{total} employers, {totals['lines']} lines ({elapsed:.1f}s)")
@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.apd import APD_CHUNK_SIZE, ApdFileError, create_submission, ingest
+from core.models import ApdSubmission, Party
+
+
+class LocalFile:
+    """Minimal UploadedFile stand-in for a file on disk."""
+
+    def __init__(self, path):
+        self.name = path
+        self.path = path
+
+    def chunks(self, chunk_size):
+        with open(self.path, 'rb') as f:
+            while True:
+                block = f.read(chunk_size)
+                if not block:
+                    return
+                yield block
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest an APD file for an employer (validate, then post in chunks), or resume "
+        "the submissions that did not complete."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', nargs='?')
+        parser.add_argument('--employer', type=int, help="Party.party_id of the employer.")
+        parser.add_argument('--period', type=int, help="Filing period, YYYYMM.")
+        parser.add_argument('--resume', nargs='?', const=0, type=int, metavar='SUBMISSION',
+                            help="Resume one submission (pk), or every unfinished one.")
+        parser.add_argument('--chunk-size', type=int, default=APD_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['resume'] is not None:
+            submissions = ApdSubmission.objects.exclude(
+                state__in=[ApdSubmission.STATE_COMPLETED, ApdSubmission.STATE_REJECTED]
+            ).order_by('pk')
+            if options['resume']:
+                submissions = submissions.filter(pk=options['resume'])
+            submissions = list(submissions)
+        else:
+            if not (options['csv_path'] and options['employer'] and options['period']):
+                raise CommandError("Give csv_path, --employer and --period (or --resume).")
+            try:
+                employer = Party.objects.get(party_id=options['employer'])
+                submissions = [create_submission(employer, options['period'], LocalFile(options['csv_path']))]
+            except (Party.DoesNotExist, ApdFileError, OSError) as e:
+                raise CommandError(str(e))
+
+        for submission in submissions:
+            self._ingest(submission, options['chunk_size'])
+
+    def _ingest(self, submission, chunk_size):
+        started = time.perf_counter()
+
+        def progress(sub):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"  {sub.receipt_number} {sub.state.lower()}: {sub.progress}% "
+                f"({sub.lines_validated} validated, {sub.lines_posted} posted of {sub.lines_total}, {elapsed:.1f}s)"
+            )
+
+        try:
+            ingest(submission, chunk_size, progress)
+        except Exception as e:
+            raise CommandError(f"{submission.receipt_number} failed, resume with --resume {submission.pk}: {e}")
+
+        elapsed = time.perf_counter() - started
+        if submission.state == ApdSubmission.STATE_REJECTED:
+            self.stderr.write(f"{submission.receipt_number} rejected: {submission.error_message}")
+            for error in submission.errors.all()[:20]:
+                self.stderr.write(f"  line {error.line_number}: {error.message}")
+            return
+        rate = submission.lines_total / elapsed if elapsed else submission.lines_total
+        self.stdout.write(self.style.SUCCESS(
+            f"{submission.receipt_number} completed: {submission.lines_total} lines, "
+            f"{submission.employee_count} employees, {submission.total_contributions} total "
+            f"in {elapsed:.1f}s ({rate:,.0f} lines/s)."
+        ))
@@ -0,0 +1,56 @@
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loaders import LOAD_BATCH_SIZE, PAID_BEFORE, ContributionLoader, parse_contribution_csv
+from core.models import Account, Party
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk load a contributions file (data/insurance_contributions.csv format) "
+        "for one insured party into one account. Every run adds the file's lines under new IDs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--party', type=int, required=True, help="Party.party_id of the insured person.")
+        parser.add_argument('--account', type=int, required=True, help="Account.account_id to post the transactions to.")
+        parser.add_argument('--multiplier', type=Decimal, default=Decimal('1'))
+        parser.add_argument('--paid-before', default=PAID_BEFORE.isoformat(),
+                            help="Lines starting before this date (YYYY-MM-DD) are loaded as paid.")
+        parser.add_argument('--default-employer', type=int,
+                            help="Employer party_id used for lines whose AME is unknown.")
+        parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            party = Party.objects.get(party_id=options['party'])
+            account = Account.objects.get(account_id=options['account'])
+        except (Party.DoesNotExist, Account.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        loader = ContributionLoader(
+            account, party,
+            multiplier=options['multiplier'],
+            paid_before=datetime.strptime(options['paid_before'], '%Y-%m-%d').date(),
+            default_employer_id=options['default_employer'],
+            batch_size=options['batch_size'],
+        )
+
+        started = time.perf_counter()
+        try:
+            with open(options['csv_path'], 'r', encoding='utf-8') as f:
+                count = loader.load(parse_contribution_csv(f))
+        except ValueError as e:
+            raise CommandError(str(e))
+        balance = loader.finalize()
+        elapsed = time.perf_counter() - started
+
+        rate = count / elapsed if elapsed else count
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {count} contribution lines in {elapsed:.2f}s ({rate:,.0f} lines/s). "
+            f"Account {account.account_id} balance: {balance}"
+        ))
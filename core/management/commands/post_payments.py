@@ -0,0 +1,55 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Account
+from core.payments import PAYMENT_BATCH_SIZE, PaymentError, post_payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Post a CSV of payments (account_id, amount and optional rf_code, reference columns), "
+        "allocating each to the open obligations of its account."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--batch-size', type=int, default=PAYMENT_BATCH_SIZE,
+                            help="Payments posted per transaction.")
+
+    def handle(self, *args, **options):
+        with open(options['csv_path'], newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        try:
+            account_ids = {int(row['account_id']) for row in rows}
+        except (KeyError, TypeError, ValueError):
+            raise CommandError("Every line needs a numeric account_id.")
+        accounts = dict(Account.objects.filter(account_id__in=account_ids).values_list('account_id', 'pk'))
+        missing = account_ids - set(accounts)
+        if missing:
+            raise CommandError(f"Unknown account_id(s): {', '.join(map(str, sorted(missing)))}")
+
+        payments = [
+            {
+                'account': accounts[int(row['account_id'])],
+                'amount': row.get('amount'),
+                'rf_code': row.get('rf_code'),
+                'reference': row.get('reference'),
+            }
+            for row in rows
+        ]
+        started = time.perf_counter()
+        try:
+            posted = post_payments(payments, batch_size=options['batch_size'])
+        except PaymentError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        allocated = sum(payment.allocated_amount for payment in posted)
+        total = sum(payment.amount for payment in posted)
+        rate = len(posted) / elapsed if elapsed else len(posted)
+        self.stdout.write(self.style.SUCCESS(
+            f"Posted {len(posted)} payments ({total}€, {allocated}€ allocated) in {elapsed:.2f}s "
+            f"({rate:,.0f} payments/s)."
+        ))
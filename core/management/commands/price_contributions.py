@@ -0,0 +1,61 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.calculator import SHARES, from_cents, get_rate_table, period_of, to_cents
+from core.loaders import parse_contribution_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Price a contributions file (data/insurance_contributions.csv format) from the "
+        "dn_kpk.txt rates: KPK is the branch code, the period the start month."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--output', help="Write every line with its calculated shares to this CSV file.")
+
+    def handle(self, *args, **options):
+        try:
+            table = get_rate_table()
+        except ImportError:
+            raise CommandError("Contribution pricing needs NumPy.")
+
+        try:
+            with open(options['csv_path'], 'r', encoding='utf-8') as f:
+                lines = list(parse_contribution_csv(f))
+        except (KeyError, ValueError) as e:
+            raise CommandError(f"Invalid contributions file: {e}")
+
+        # 1. Columns of the batch, then one vectorized pass
+        started = time.perf_counter()
+        gross = to_cents(line['gross_earnings'] for line in lines)
+        kpks = [line['branch_code'] for line in lines]
+        periods = [period_of(line['start_date']) for line in lines]
+        result = table.calculate(gross, kpks, periods)
+        elapsed = time.perf_counter() - started
+
+        # 2. Compare with the totals stated in the file
+        stated = to_cents(line['total_contribution'] for line in lines)
+        found = result['found']
+        differences = int((found & (result['total'] != stated)).sum())
+
+        if options['output']:
+            amounts = {share: from_cents(result[share]) for share in SHARES}
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['line', 'kpk', 'period', 'gross_earnings', 'stated_total', *SHARES])
+                for index, line in enumerate(lines):
+                    calculated = [amounts[share][index] for share in SHARES] if found[index] else [''] * len(SHARES)
+                    writer.writerow([
+                        index + 1, line['branch_code'], periods[index],
+                        line['gross_earnings'], line['total_contribution'], *calculated,
+                    ])
+
+        rate = len(lines) / elapsed if elapsed else len(lines)
+        self.stdout.write(self.style.SUCCESS(
+            f"Priced {int(found.sum())} of {len(lines)} lines in {elapsed:.3f}s ({rate:,.0f} lines/s); "
+            f"{len(lines) - int(found.sum())} without a KPK rate, {differences} totals differ from the file."
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.pensions import PENSION_BATCH_SIZE, refresh_pension_projections
+
+
+class Command(BaseCommand):
+    help = (
+        "Project the pension milestone dates of the insured parties whose insurance days changed "
+        "since their last projection (all of them with --all)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Project every party, e.g. daily (projections count from today) or after "
+                                 "changing PENSION_MILESTONES.")
+        parser.add_argument('--batch-size', type=int, default=PENSION_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = refresh_pension_projections(stale_only=not options['all'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed else count
+        self.stdout.write(self.style.SUCCESS(
+            f"Projected {count} parties in {elapsed:.1f}s ({rate:,.0f} parties/s)."
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.rollups import ROLLUP_BATCH_SIZE, rebuild_contribution_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the monthly ContributionRollup rows read by the insured's contributions page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_contribution_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {count} contribution rollups in {time.perf_counter() - started:.1f}s."
+        ))
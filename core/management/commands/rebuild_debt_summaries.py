@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.ledger import rebuild_debt_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the EmployerDebtSummary table from the employers' account balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_debt_summaries(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} employer debt summaries."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.prefill import invalidate_ama_index, rebuild_latest_contributions
+
+
+class Command(BaseCommand):
+    help = "Recompute the LatestContribution pointers used by the APD prefill lookup."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_latest_contributions(batch_size=options['batch_size'])
+        invalidate_ama_index()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} latest contribution pointers."))
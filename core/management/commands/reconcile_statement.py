@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.management.commands.ingest_apd import LocalFile
+from core.models import BankStatement
+from core.reconciliation import RECON_BATCH_SIZE, StatementFileError, create_statement, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcile a bank statement (CSV or camt.053) by RF code: post the matched credit lines "
+        "as payments and record the rest as exceptions. Or resume the statements that did not complete."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement_path', nargs='?')
+        parser.add_argument('--resume', nargs='?', const=0, type=int, metavar='STATEMENT',
+                            help="Resume one statement (pk), or every unfinished one.")
+        parser.add_argument('--batch-size', type=int, default=RECON_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['resume'] is not None:
+            statements = BankStatement.objects.exclude(state=BankStatement.STATE_COMPLETED).order_by('pk')
+            if options['resume']:
+                statements = statements.filter(pk=options['resume'])
+            statements = list(statements)
+        else:
+            if not options['statement_path']:
+                raise CommandError("Give statement_path (or --resume).")
+            try:
+                statements = [create_statement(LocalFile(options['statement_path']))]
+            except (StatementFileError, OSError) as e:
+                raise CommandError(str(e))
+
+        for statement in statements:
+            self._reconcile(statement, options['batch_size'])
+
+    def _reconcile(self, statement, batch_size):
+        started = time.perf_counter()
+
+        def progress(stmt):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"  statement {stmt.pk}: {stmt.progress}% ({stmt.lines_processed} of {stmt.lines_total} lines, "
+                f"{elapsed:.1f}s)"
+            )
+
+        try:
+            reconcile(statement, batch_size, progress)
+        except Exception as e:
+            raise CommandError(f"Statement {statement.pk} failed, resume with --resume {statement.pk}: {e}")
+
+        elapsed = time.perf_counter() - started
+        rate = statement.lines_total / elapsed if elapsed else statement.lines_total
+        self.stdout.write(self.style.SUCCESS(
+            f"Statement {statement.pk} ({statement.file_name}) reconciled: {statement.lines_total} lines, "
+            f"{statement.lines_matched} matched, {statement.lines_partial} partial, "
+            f"{statement.lines_unmatched} unmatched, {statement.amount_posted} of {statement.amount_total} posted "
+            f"in {elapsed:.1f}s ({rate:,.0f} lines/s)."
+        ))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_payment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployerDebtSummary',
+            fields=[
+                ('party_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='debt_summary', serialize=False, to='core.party')),
+                ('current_balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('settled_keao_balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('unsettled_keao_balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_change_date', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_employerdebtsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['party_role_id', 'account_id'], name='account_role_account_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='insurancecontribution',
+            index=models.Index(fields=['party_id', 'start_date'], name='icontrib_party_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='insurancecontribution',
+            index=models.Index(fields=['party_id', 'end_date'], name='icontrib_party_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='partyidentifier',
+            index=models.Index(fields=['identifier_type_id', 'identifier_value'], name='pident_type_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='partyrelationship',
+            index=models.Index(condition=models.Q(('status', 1)), fields=['relation_from', 'relationship_type_id'], name='prel_active_from_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionobligation',
+            index=models.Index(fields=['obligation_id'], name='tobl_obligation_id_idx'),
+        ),
+    ]
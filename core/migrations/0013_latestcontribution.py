@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestContribution',
+            fields=[
+                ('party_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_contribution', serialize=False, to='core.party')),
+                ('end_date', models.DateTimeField()),
+                ('coverage_package_id', models.IntegerField()),
+                ('earning_type_id', models.IntegerField()),
+                ('insurance_days', models.IntegerField()),
+                ('gross_earnings', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_contribution', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('last_change_date', models.DateTimeField()),
+                ('contribution', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.insurancecontribution')),
+            ],
+        ),
+    ]
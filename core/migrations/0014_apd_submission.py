@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:16
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_latestcontribution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApdSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.IntegerField()),
+                ('receipt_number', models.CharField(max_length=30, unique=True)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_path', models.CharField(max_length=500)),
+                ('state', models.CharField(choices=[('PENDING', 'Pending'), ('VALIDATING', 'Validating'), ('POSTING', 'Posting'), ('COMPLETED', 'Completed'), ('REJECTED', 'Rejected'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('first_line_id', models.IntegerField(unique=True)),
+                ('lines_total', models.IntegerField(default=0)),
+                ('lines_validated', models.IntegerField(default=0)),
+                ('lines_posted', models.IntegerField(default=0)),
+                ('lines_rejected', models.IntegerField(default=0)),
+                ('employee_count', models.IntegerField(default=0)),
+                ('total_contributions', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('completed_date', models.DateTimeField(blank=True, null=True)),
+                ('status', models.IntegerField(default=1)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.CharField(max_length=30)),
+                ('last_update_date', models.DateTimeField(auto_now=True)),
+                ('last_updated_by', models.CharField(max_length=30)),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('party_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='apd_submissions', to='core.party')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ApdSubmissionError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.IntegerField()),
+                ('message', models.CharField(max_length=255)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='core.apdsubmission')),
+            ],
+            options={
+                'ordering': ['line_number', 'pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='apdsubmission',
+            index=models.Index(fields=['party_id', '-creation_date'], name='apdsub_party_created_idx'),
+        ),
+    ]
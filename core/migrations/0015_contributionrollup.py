@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_apd_submission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContributionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('earning_type_id', models.IntegerField()),
+                ('contribution_count', models.IntegerField()),
+                ('insurance_days', models.IntegerField()),
+                ('gross_earnings', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('total_contribution', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('last_change_date', models.DateTimeField()),
+                ('party_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contribution_rollups', to='core.party')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('party_id', 'year', 'month', 'earning_type_id'), name='rollup_party_period_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_contributionrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InsuranceDaysAccrual',
+            fields=[
+                ('party_id', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='insurance_days', serialize=False, to='core.party')),
+                ('total_days', models.IntegerField(default=0)),
+                ('days_by_year', models.JSONField(default=dict)),
+                ('days_by_branch', models.JSONField(default=dict)),
+                ('last_change_date', models.DateTimeField()),
+            ],
+        ),
+    ]
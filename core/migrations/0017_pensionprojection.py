@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_insurancedaysaccrual'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PensionProjection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('milestone', models.CharField(max_length=20)),
+                ('accrued_days', models.IntegerField()),
+                ('required_days', models.IntegerField()),
+                ('age_date', models.DateField(blank=True, null=True)),
+                ('days_date', models.DateField(blank=True, null=True)),
+                ('eligibility_date', models.DateField(blank=True, null=True)),
+                ('accrual_date', models.DateTimeField()),
+                ('computed_date', models.DateTimeField()),
+                ('party_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pension_projections', to='core.party')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('party_id', 'milestone'), name='pension_party_milestone_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:43
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_payment_allocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_path', models.CharField(max_length=500)),
+                ('file_format', models.CharField(choices=[('CSV', 'CSV'), ('CAMT053', 'camt.053')], max_length=10)),
+                ('state', models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('lines_total', models.IntegerField(default=0)),
+                ('lines_processed', models.IntegerField(default=0)),
+                ('lines_matched', models.IntegerField(default=0)),
+                ('lines_partial', models.IntegerField(default=0)),
+                ('lines_unmatched', models.IntegerField(default=0)),
+                ('amount_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_posted', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('completed_date', models.DateTimeField(blank=True, null=True)),
+                ('status', models.IntegerField(default=1)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.CharField(max_length=30)),
+                ('last_update_date', models.DateTimeField(auto_now=True)),
+                ('last_updated_by', models.CharField(max_length=30)),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReconciliationException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.IntegerField()),
+                ('reason', models.CharField(choices=[('NO_RF', 'No RF code'), ('UNKNOWN_RF', 'Unknown RF code'), ('INVALID', 'Invalid line'), ('UNDERPAID', 'Less than the open balance'), ('OVERPAID', 'More than the open balance'), ('SETTLED', 'Obligation already settled')], max_length=20)),
+                ('rf_code', models.CharField(blank=True, default='', max_length=35)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('open_balance', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('entry_reference', models.CharField(blank=True, default='', max_length=100)),
+                ('booking_date', models.DateField(blank=True, null=True)),
+                ('message', models.CharField(blank=True, default='', max_length=255)),
+                ('resolved', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ['line_number', 'pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transactionobligation',
+            index=models.Index(fields=['rf_code'], name='tobl_rf_code_idx'),
+        ),
+        migrations.AddField(
+            model_name='reconciliationexception',
+            name='payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.payment'),
+        ),
+        migrations.AddField(
+            model_name='reconciliationexception',
+            name='statement',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='core.bankstatement'),
+        ),
+        migrations.AddIndex(
+            model_name='reconciliationexception',
+            index=models.Index(fields=['statement', 'reason'], name='reconexc_statement_reason_idx'),
+        ),
+    ]
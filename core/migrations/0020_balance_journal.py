@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_bank_statement_reconciliation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='core.account')),
+                ('obligation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='core.transactionobligation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'obligation', '-as_of'], name='bcheckpoint_key_idx'), models.Index(fields=['obligation', '-as_of'], name='bcheckpoint_obligation_idx'), models.Index(fields=['as_of'], name='bcheckpoint_as_of_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceJournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('entry_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.CharField(max_length=20)),
+                ('reference', models.CharField(blank=True, default='', max_length=50)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='journal_entries', to='core.account')),
+                ('obligation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='journal_entries', to='core.transactionobligation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'entry_date'], name='bjournal_account_date_idx'), models.Index(fields=['obligation', 'entry_date'], name='bjournal_obligation_date_idx'), models.Index(fields=['entry_date'], name='bjournal_date_idx')],
+            },
+        ),
+    ]
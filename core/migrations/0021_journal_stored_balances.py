@@ -0,0 +1,71 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+TWO_PLACES = Decimal('0.01')
+
+
+def _cents(value):
+    # SQLite sums decimals as floats
+    return Decimal(str(value or 0)).quantize(TWO_PLACES)
+
+
+def journal_stored_balances(apps, schema_editor):
+    """
+    The debt screens read their balances from the journal: journal the stored
+    balances of an existing database (what core.journal.sync_balance_journal
+    does, with the historical models).
+    """
+    Account = apps.get_model('core', 'Account')
+    ObligationBalance = apps.get_model('core', 'ObligationBalance')
+    BalanceJournalEntry = apps.get_model('core', 'BalanceJournalEntry')
+
+    now = timezone.now()
+    account_pks = list(Account.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(account_pks), BATCH_SIZE):
+        chunk = account_pks[start:start + BATCH_SIZE]
+        entries = BalanceJournalEntry.objects.filter(account_id__in=chunk)
+        journal_accounts = dict(
+            entries.values('account_id').annotate(total=Sum('amount')).order_by().values_list('account_id', 'total')
+        )
+        journal_obligations = dict(
+            entries.filter(obligation__isnull=False).values('obligation_id').annotate(total=Sum('amount'))
+            .order_by().values_list('obligation_id', 'total')
+        )
+
+        rows = []
+        obligation_deltas = defaultdict(Decimal)
+        for obligation_pk, account_pk, balance in (
+            ObligationBalance.objects
+            .filter(obligation_id__transaction_id__account_id__in=chunk)
+            .values_list('obligation_id', 'obligation_id__transaction_id__account_id', 'balance')
+        ):
+            delta = _cents(balance) - _cents(journal_obligations.get(obligation_pk))
+            obligation_deltas[account_pk] += delta
+            rows.append((account_pk, obligation_pk, delta))
+        for account_pk, balance in Account.objects.filter(pk__in=chunk).values_list('pk', 'account_balance'):
+            delta = _cents(balance) - _cents(journal_accounts.get(account_pk)) - obligation_deltas[account_pk]
+            rows.append((account_pk, None, delta))
+
+        BalanceJournalEntry.objects.bulk_create([
+            BalanceJournalEntry(
+                account_id=account_pk, obligation_id=obligation_pk, amount=amount, entry_date=now, source='SYNC',
+            )
+            for account_pk, obligation_pk, amount in rows
+            if amount
+        ], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_balance_journal'),
+    ]
+
+    operations = [
+        migrations.RunPython(journal_stored_balances, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 # core/models.py
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 # class UserProfile(models.Model):
@@ -82,7 +83,14 @@ class PartyRelationship(models.Model):
     created_by = models.CharField(max_length=30)
     last_update_date = models.DateTimeField(auto_now=True)
     last_updated_by = models.CharField(max_length=30)
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)    
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+
+    class Meta:
+        indexes = [
+            # employees of an employer (active relationships only)
+            models.Index(fields=['relation_from', 'relationship_type_id'], condition=models.Q(status=1),
+                         name='prel_active_from_type_idx'),
+        ]
 
 
 class PartyRelationshipType(models.Model):
@@ -110,6 +118,12 @@ class PartyIdentifier(models.Model):
     last_updated_by = models.CharField(max_length=30)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
+    class Meta:
+        indexes = [
+            # AMA / AMKA / AME lookups
+            models.Index(fields=['identifier_type_id', 'identifier_value'], name='pident_type_value_idx'),
+        ]
+
 class PartyIdentifierType(models.Model):
     identifier_type_id = models.IntegerField(unique=True)
     identifier_type_code = models.CharField(max_length=30)
@@ -202,6 +216,11 @@ class Account(models.Model):
     last_updated_by = models.CharField(max_length=30)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['party_role_id', 'account_id'], name='account_role_account_idx'),
+        ]
+
 
 class AccountBalance(models.Model):
     account_id = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -263,6 +282,14 @@ class TransactionObligation(models.Model):
     last_updated_by = models.CharField(max_length=30)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
+    class Meta:
+        indexes = [
+            # business id, used by the bulk loaders
+            models.Index(fields=['obligation_id'], name='tobl_obligation_id_idx'),
+            # bank statement reconciliation (core/reconciliation.py)
+            models.Index(fields=['rf_code'], name='tobl_rf_code_idx'),
+        ]
+
 class ObligationBalance(models.Model):
     obligation_id = models.ForeignKey(TransactionObligation, on_delete=models.CASCADE)
     obligation_balance_id = models.IntegerField(unique=True)
@@ -300,6 +327,13 @@ class InsuranceContribution(models.Model):
     last_updated_by = models.CharField(max_length=30)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
+    class Meta:
+        indexes = [
+            # contribution history (by period) and latest contribution (by end date)
+            models.Index(fields=['party_id', 'start_date'], name='icontrib_party_start_idx'),
+            models.Index(fields=['party_id', 'end_date'], name='icontrib_party_end_idx'),
+        ]
+
 
 class InsuranceContributionBalance(models.Model):
     insurance_contribution_id = models.ForeignKey(InsuranceContribution, on_delete=models.CASCADE)
@@ -319,10 +353,365 @@ class Payment(models.Model):
     payment_id = models.IntegerField(unique=True)
     account_transaction_id = models.ForeignKey(AccountTransaction, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Part of the amount allocated to obligations, the rest is a credit on the account
+    allocated_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    rf_code = models.CharField(max_length=30, blank=True, null=True)
+    reference = models.CharField(max_length=50, blank=True, default='')
+
+    status = models.IntegerField(default=1)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    created_by = models.CharField(max_length=30)
+    last_update_date = models.DateTimeField(auto_now=True)
+    last_updated_by = models.CharField(max_length=30)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+
+
+class PaymentAllocation(models.Model):
+    """The part of a Payment applied to one obligation (see core/payments.py)."""
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='allocations')
+    obligation_balance = models.ForeignKey(ObligationBalance, on_delete=models.CASCADE, related_name='allocations')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+class IdSequence(models.Model):
+    """Next free business id of a named id range, reserved in blocks (see core/loaders.py)."""
+    name = models.CharField(max_length=30, primary_key=True)
+    next_id = models.BigIntegerField()
+
+
+class BalanceJournalEntry(models.Model):
+    """
+    One balance change of an account, or of one of its obligations
+    (core/journal.py). Entries are only ever inserted.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='journal_entries')
+    obligation = models.ForeignKey(
+        TransactionObligation, on_delete=models.CASCADE, blank=True, null=True, related_name='journal_entries',
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    entry_date = models.DateTimeField(default=timezone.now)
+    source = models.CharField(max_length=20)
+    reference = models.CharField(max_length=50, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'entry_date'], name='bjournal_account_date_idx'),
+            models.Index(fields=['obligation', 'entry_date'], name='bjournal_obligation_date_idx'),
+            models.Index(fields=['entry_date'], name='bjournal_date_idx'),
+        ]
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Balance of an account (obligation empty: all its entries) or of one
+    obligation, summed over the journal entries up to `as_of`.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='balance_checkpoints')
+    obligation = models.ForeignKey(
+        TransactionObligation, on_delete=models.CASCADE, blank=True, null=True, related_name='balance_checkpoints',
+    )
+    as_of = models.DateTimeField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'obligation', '-as_of'], name='bcheckpoint_key_idx'),
+            models.Index(fields=['obligation', '-as_of'], name='bcheckpoint_obligation_idx'),
+            models.Index(fields=['as_of'], name='bcheckpoint_as_of_idx'),
+        ]
+
+
+class BankStatement(models.Model):
+    """
+    An imported bank statement file and the progress of its reconciliation
+    (core/reconciliation.py).
+
+    Credit lines are matched and posted in batches, each in its own
+    transaction together with `lines_processed`, so a failed import resumes
+    after the last committed batch.
+    """
+    FORMAT_CSV = 'CSV'
+    FORMAT_CAMT053 = 'CAMT053'
+    FORMAT_CHOICES = [
+        (FORMAT_CSV, 'CSV'),
+        (FORMAT_CAMT053, 'camt.053'),
+    ]
+    STATE_PENDING = 'PENDING'
+    STATE_PROCESSING = 'PROCESSING'
+    STATE_COMPLETED = 'COMPLETED'
+    STATE_FAILED = 'FAILED'
+    STATE_CHOICES = [
+        (STATE_PENDING, 'Pending'),
+        (STATE_PROCESSING, 'Processing'),
+        (STATE_COMPLETED, 'Completed'),
+        (STATE_FAILED, 'Failed'),
+    ]
+
+    file_name = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=500)
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=STATE_PENDING)
+    lines_total = models.IntegerField(default=0)
+    lines_processed = models.IntegerField(default=0)
+    lines_matched = models.IntegerField(default=0)
+    lines_partial = models.IntegerField(default=0)
+    lines_unmatched = models.IntegerField(default=0)
+    amount_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    amount_posted = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    error_message = models.TextField(blank=True, default='')
+    completed_date = models.DateTimeField(blank=True, null=True)
 
     status = models.IntegerField(default=1)
     creation_date = models.DateTimeField(auto_now_add=True)
     created_by = models.CharField(max_length=30)
     last_update_date = models.DateTimeField(auto_now=True)
     last_updated_by = models.CharField(max_length=30)
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
\ No newline at end of file
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+
+    @property
+    def progress(self):
+        """Percentage of the lines processed."""
+        if not self.lines_total:
+            return 0
+        return round(100 * self.lines_processed / self.lines_total)
+
+
+class ReconciliationException(models.Model):
+    """
+    A statement line that did not settle exactly one RF code: unmatched
+    lines are not posted, partially matched ones are (see `payment`).
+    """
+    REASON_NO_RF = 'NO_RF'
+    REASON_UNKNOWN_RF = 'UNKNOWN_RF'
+    REASON_INVALID = 'INVALID'
+    REASON_UNDERPAID = 'UNDERPAID'
+    REASON_OVERPAID = 'OVERPAID'
+    REASON_SETTLED = 'SETTLED'
+    REASON_CHOICES = [
+        (REASON_NO_RF, 'No RF code'),
+        (REASON_UNKNOWN_RF, 'Unknown RF code'),
+        (REASON_INVALID, 'Invalid line'),
+        (REASON_UNDERPAID, 'Less than the open balance'),
+        (REASON_OVERPAID, 'More than the open balance'),
+        (REASON_SETTLED, 'Obligation already settled'),
+    ]
+
+    statement = models.ForeignKey(BankStatement, on_delete=models.CASCADE, related_name='exceptions')
+    line_number = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    rf_code = models.CharField(max_length=35, blank=True, default='')
+    amount = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    open_balance = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    entry_reference = models.CharField(max_length=100, blank=True, default='')
+    booking_date = models.DateField(blank=True, null=True)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    message = models.CharField(max_length=255, blank=True, default='')
+    resolved = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['line_number', 'pk']
+        indexes = [
+            models.Index(fields=['statement', 'reason'], name='reconexc_statement_reason_idx'),
+        ]
+
+########################################
+# Materialized summaries
+########################################
+
+class EmployerDebtSummary(models.Model):
+    """
+    Per-employer debt totals read by employer_home and payments_screen.
+
+    Derived from the balances of the employer's accounts, grouped by account
+    type. Refreshed for a single party whenever one of its Account or
+    ObligationBalance rows changes (core/signals.py) and rebuilt in bulk with
+    `manage.py rebuild_debt_summaries`.
+    """
+    party_id = models.OneToOneField(Party, on_delete=models.CASCADE, primary_key=True, related_name='debt_summary')
+    current_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    settled_keao_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    unsettled_keao_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_change_date = models.DateTimeField()
+
+    def as_debts(self):
+        """Debts dict in the shape the dashboards render."""
+        return {
+            'current': float(self.current_balance),
+            'overdue_keao_settled': float(self.settled_keao_balance),
+            'overdue_keao_unsettled': float(self.unsettled_keao_balance),
+            'total': float(self.total_balance),
+        }
+
+
+class LatestContribution(models.Model):
+    """
+    Pointer to the most recent InsuranceContribution of a party (latest
+    end_date, then latest row), with the fields the APD form prefills copied
+    over, so get_last_contribution is a single primary-key read.
+
+    Kept current on every contribution save/delete (core/signals.py) and by
+    the bulk loaders, rebuilt with `manage.py rebuild_latest_contributions`.
+    """
+    party_id = models.OneToOneField(Party, on_delete=models.CASCADE, primary_key=True, related_name='latest_contribution')
+    contribution = models.ForeignKey(InsuranceContribution, on_delete=models.CASCADE, related_name='+')
+    end_date = models.DateTimeField()
+    coverage_package_id = models.IntegerField()
+    earning_type_id = models.IntegerField()
+    insurance_days = models.IntegerField()
+    gross_earnings = models.DecimalField(max_digits=10, decimal_places=2)
+    total_contribution = models.DecimalField(max_digits=10, decimal_places=2)
+    last_change_date = models.DateTimeField()
+
+    def as_prefill(self):
+        """JSON payload of get_last_contribution."""
+        return {
+            'coverage_package_id': self.coverage_package_id,
+            'earning_type_id': self.earning_type_id,
+            'insurance_days': self.insurance_days,
+            'gross_earnings': str(self.gross_earnings),
+            'total_contribution': str(self.total_contribution),
+        }
+
+
+class ContributionRollup(models.Model):
+    """
+    A party's contributions summed per (year, month, earning type) of their
+    start date, read by insurance_contributions for the chart, the year
+    selector and the totals.
+
+    Recomputed for a party on every contribution save/delete
+    (core/signals.py) and by the bulk loaders, rebuilt with
+    `manage.py rebuild_contribution_rollups` (see core/rollups.py).
+    """
+    party_id = models.ForeignKey(Party, on_delete=models.CASCADE, related_name='contribution_rollups')
+    year = models.IntegerField()
+    month = models.IntegerField()
+    earning_type_id = models.IntegerField()
+    contribution_count = models.IntegerField()
+    insurance_days = models.IntegerField()
+    gross_earnings = models.DecimalField(max_digits=14, decimal_places=2)
+    total_contribution = models.DecimalField(max_digits=14, decimal_places=2)
+    last_change_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['party_id', 'year', 'month', 'earning_type_id'], name='rollup_party_period_uniq',
+            ),
+        ]
+
+
+class InsuranceDaysAccrual(models.Model):
+    """
+    Lifetime insurance days of a party: in total, per year of the start date
+    and per branch (coverage package), as {"year": days} and
+    {"branch": days}. Read by insured_home.
+
+    Adjusted on every contribution save/delete (core/signals.py), recomputed
+    by the bulk loaders and checked with `manage.py check_insurance_days`
+    (see core/accrual.py).
+    """
+    party_id = models.OneToOneField(Party, on_delete=models.CASCADE, primary_key=True, related_name='insurance_days')
+    total_days = models.IntegerField(default=0)
+    days_by_year = models.JSONField(default=dict)
+    days_by_branch = models.JSONField(default=dict)
+    last_change_date = models.DateTimeField()
+
+
+class PensionProjection(models.Model):
+    """
+    Projected date a party reaches one pension milestone (see
+    PENSION_MILESTONES in core/pensions.py): the later of the date it reaches
+    the milestone's age and the date its insurance days reach the
+    requirement. Dates are null when out of reach or unknown.
+
+    `accrual_date` is the InsuranceDaysAccrual.last_change_date it was
+    projected from; `manage.py project_pensions` recomputes the stale ones.
+    """
+    party_id = models.ForeignKey(Party, on_delete=models.CASCADE, related_name='pension_projections')
+    milestone = models.CharField(max_length=20)
+    accrued_days = models.IntegerField()
+    required_days = models.IntegerField()
+    age_date = models.DateField(null=True, blank=True)
+    days_date = models.DateField(null=True, blank=True)
+    eligibility_date = models.DateField(null=True, blank=True)
+    accrual_date = models.DateTimeField()
+    computed_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['party_id', 'milestone'], name='pension_party_milestone_uniq'),
+        ]
+
+
+class ApdSubmission(models.Model):
+    """
+    An uploaded APD file and the progress of its ingestion (core/apd.py).
+
+    Lines are validated in a first pass and posted in chunks, each in its own
+    transaction; `lines_posted` is committed with its chunk, so a failed
+    ingestion resumes after the last posted line. Posted rows take the
+    business IDs first_line_id .. first_line_id + lines_total (the last one is
+    the employer's APD obligation), which makes re-posting a chunk harmless.
+    """
+    STATE_PENDING = 'PENDING'
+    STATE_VALIDATING = 'VALIDATING'
+    STATE_POSTING = 'POSTING'
+    STATE_COMPLETED = 'COMPLETED'
+    STATE_REJECTED = 'REJECTED'
+    STATE_FAILED = 'FAILED'
+    STATE_CHOICES = [
+        (STATE_PENDING, 'Pending'),
+        (STATE_VALIDATING, 'Validating'),
+        (STATE_POSTING, 'Posting'),
+        (STATE_COMPLETED, 'Completed'),
+        (STATE_REJECTED, 'Rejected'),
+        (STATE_FAILED, 'Failed'),
+    ]
+
+    party_id = models.ForeignKey(Party, on_delete=models.CASCADE, related_name='apd_submissions')
+    period = models.IntegerField()
+    receipt_number = models.CharField(max_length=30, unique=True)
+    file_name = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=500)
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=STATE_PENDING)
+    first_line_id = models.IntegerField(unique=True)
+    lines_total = models.IntegerField(default=0)
+    lines_validated = models.IntegerField(default=0)
+    lines_posted = models.IntegerField(default=0)
+    lines_rejected = models.IntegerField(default=0)
+    employee_count = models.IntegerField(default=0)
+    total_contributions = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    error_message = models.TextField(blank=True, default='')
+    completed_date = models.DateTimeField(blank=True, null=True)
+
+    status = models.IntegerField(default=1)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    created_by = models.CharField(max_length=30)
+    last_update_date = models.DateTimeField(auto_now=True)
+    last_updated_by = models.CharField(max_length=30)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['party_id', '-creation_date'], name='apdsub_party_created_idx'),
+        ]
+
+    @property
+    def progress(self):
+        """Percentage of the lines processed by the current pass."""
+        if not self.lines_total:
+            return 0
+        done = self.lines_posted if self.state in (self.STATE_POSTING, self.STATE_COMPLETED) else self.lines_validated
+        return round(100 * done / self.lines_total)
+
+
+class ApdSubmissionError(models.Model):
+    """A line of an APD file that failed validation (the first APD_MAX_ERRORS are kept)."""
+    submission = models.ForeignKey(ApdSubmission, on_delete=models.CASCADE, related_name='errors')
+    line_number = models.IntegerField()
+    message = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ['line_number', 'pk']
@@ -0,0 +1,297 @@
+from collections import defaultdict, deque
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Round
+
+from .journal import append_entries
+from .ledger import schedule_debt_summaries_refresh
+from .loaders import TWO_PLACES, TableWriter, contribution_writers, reserve_ids
+from .models import (
+    Account, AccountBalance, ObligationBalance, Payment, PaymentAllocation, TransactionBalance
+)
+
+
+# Payment posting
+# -----------------------------------------------------------------------------
+# A payment is allocated to the open obligations (ObligationBalance.balance >
+# 0) of one account, oldest period first (FIFO), or only to the obligations
+# with its RF code. What is left over stays on the account as a credit.
+#
+# A batch of payments is posted in one short transaction:
+#
+# 1. the accounts are locked (SELECT ... FOR UPDATE, in pk order so
+#    concurrent batches cannot deadlock), which serializes the payments of
+#    the same employer;
+# 2. the open obligations of those accounts are read once and the payments
+#    allocated in memory, in order;
+# 3. every balance is changed with one set-based UPDATE per table:
+#    balance = balance - CASE pk WHEN ... END. The amounts are deltas applied
+#    by the database (no value read in Python is written back) and each row
+#    is guarded with balance >= its deduction, so a concurrent writer that
+#    does not take the account lock (a bulk load) cannot be overwritten or
+#    driven negative: the batch is rolled back and allocated again;
+# 4. the payment transactions and Payment rows are written with the bulk
+#    TableWriters (COPY on PostgreSQL), the PaymentAllocation rows with
+#    bulk_create.
+#
+# Business ids come from IdSequence blocks reserved in their own tiny
+# transaction, so the counter is never held while a batch posts.
+
+PAYMENT_BATCH_SIZE = getattr(settings, 'PAYMENT_BATCH_SIZE', 1000)
+PAYMENT_MAX_RETRIES = getattr(settings, 'PAYMENT_MAX_RETRIES', 5)
+# Account transaction / balance ids of payments, above the APD range
+PAYMENT_FIRST_TRANSACTION_ID = getattr(settings, 'PAYMENT_FIRST_TRANSACTION_ID', 2_000_000_000)
+
+CREATED_BY = 'payments'
+PAYMENT_TYPE = 'PAYMENT'
+
+# Rows per CASE statement
+_UPDATE_CHUNK_SIZE = 500
+
+# FIFO: oldest period first
+ALLOCATION_ORDER = ('obligation_id__year', 'obligation_id__reference_month', 'obligation_id__month', 'pk')
+
+
+class PaymentError(ValueError):
+    """A payment cannot be posted (amount, account)."""
+
+
+class ConcurrentUpdate(Exception):
+    """A guarded balance update matched fewer rows than planned: another writer got there first."""
+
+
+def normalize_payment(payment):
+    """
+    Validate a payment dict: account (pk), amount, optional rf_code and
+    reference. Returns a copy with a 2-decimal Decimal amount.
+    """
+    try:
+        amount = Decimal(str(payment['amount'])).quantize(TWO_PLACES)
+    except (KeyError, InvalidOperation):
+        raise PaymentError("The amount must be a number.")
+    if not amount.is_finite() or amount <= 0:
+        raise PaymentError("The amount must be positive.")
+    if not payment.get('account'):
+        raise PaymentError("The payment has no account.")
+    return {
+        'account': payment['account'],
+        'amount': amount,
+        'rf_code': (payment.get('rf_code') or '').strip() or None,
+        'reference': (payment.get('reference') or '').strip()[:50],
+    }
+
+
+def _case(pairs, key='pk'):
+    """CASE key WHEN k THEN v ... END of (key, Decimal) pairs."""
+    return Case(
+        *(When(**{key: k}, then=Value(v)) for k, v in pairs),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def _minus(field, pairs, key='pk'):
+    """field - CASE ..., rounded to cents (SQLite stores decimals as floats)."""
+    return Round(F(field) - _case(pairs, key), 2)
+
+
+def _deduct(model, deductions, key='pk'):
+    """balance -= deduction for every {key: deduction}, guarded; raises ConcurrentUpdate."""
+    items = list(deductions.items())
+    for start in range(0, len(items), _UPDATE_CHUNK_SIZE):
+        chunk = items[start:start + _UPDATE_CHUNK_SIZE]
+        updated = (
+            model.objects
+            .filter(**{f'{key}__in': [k for k, _ in chunk]}, balance__gte=_case(chunk, key))
+            .update(balance=_minus('balance', chunk, key))
+        )
+        if updated != len(chunk):
+            raise ConcurrentUpdate(f"{model.__name__}: {updated} of {len(chunk)} balances updated")
+
+
+def payment_writer(created_by=CREATED_BY):
+    """TableWriter of the Payment rows (see core/loaders.py)."""
+    return TableWriter(Payment, 'payment_id', [
+        'account_transaction_id', 'amount', 'allocated_amount', 'rf_code', 'reference',
+    ], created_by)
+
+
+def allocate(payments, obligations):
+    """
+    Allocate payments to open obligations in memory. `obligations` are
+    (obligation balance pk, balance, transaction pk, account pk, rf_code)
+    in allocation order. Returns [[(obligation balance pk, transaction pk,
+    amount)]] per payment.
+    """
+    queues = defaultdict(deque)
+    for pk, balance, transaction_pk, account_pk, rf_code in obligations:
+        queues[account_pk].append([pk, balance, transaction_pk, rf_code])
+
+    allocations = []
+    for payment in payments:
+        remaining = payment['amount']
+        queue = queues[payment['account']]
+        lines = []
+        for obligation in queue:
+            if not remaining:
+                break
+            pk, balance, transaction_pk, rf_code = obligation
+            if not balance or (payment['rf_code'] and rf_code != payment['rf_code']):
+                continue
+            amount = min(balance, remaining)
+            obligation[1] -= amount
+            remaining -= amount
+            lines.append((pk, transaction_pk, amount))
+        # Settled obligations at the head of the queue are not looked at again
+        while queue and not queue[0][1]:
+            queue.popleft()
+        allocations.append(lines)
+    return allocations
+
+
+def _post(payments, payment_ids, transaction_ids, created_by):
+    account_pks = sorted({payment['account'] for payment in payments})
+    with transaction.atomic():
+        accounts = dict(
+            Account.objects.select_for_update(of=('self',))
+            .filter(pk__in=account_pks).order_by('pk')
+            .values_list('pk', 'party_role_id__party_id')
+        )
+        missing = set(account_pks) - set(accounts)
+        if missing:
+            raise PaymentError(f"Unknown account(s): {', '.join(map(str, sorted(missing)))}")
+
+        obligations = list(
+            ObligationBalance.objects
+            .filter(obligation_id__transaction_id__account_id__in=account_pks, balance__gt=0)
+            .order_by('obligation_id__transaction_id__account_id', *ALLOCATION_ORDER)
+            .values_list(
+                'pk', 'balance', 'obligation_id__transaction_id', 'obligation_id__transaction_id__account_id',
+                'obligation_id__rf_code', 'obligation_id',
+            )
+        )
+        obligation_of = {row[0]: row[5] for row in obligations}
+        allocations = allocate(payments, (row[:5] for row in obligations))
+
+        # Balance deltas, summed per row
+        obligation_deductions = defaultdict(Decimal)
+        transaction_deductions = defaultdict(Decimal)
+        account_deductions = defaultdict(Decimal)
+        for payment, lines in zip(payments, allocations):
+            account_deductions[payment['account']] += payment['amount']
+            for obligation_pk, transaction_pk, amount in lines:
+                obligation_deductions[obligation_pk] += amount
+                transaction_deductions[transaction_pk] += amount
+        _deduct(ObligationBalance, obligation_deductions)
+        _deduct(TransactionBalance, transaction_deductions, key='transaction_id')
+        Account.objects.filter(pk__in=account_deductions).update(
+            account_balance=_minus('account_balance', account_deductions.items()),
+            last_updated_by=created_by,
+        )
+        AccountBalance.objects.filter(account_id__in=account_deductions).update(
+            balance=_minus('balance', account_deductions.items(), key='account_id'),
+            last_updated_by=created_by,
+        )
+
+        # The payments: a credit transaction each, whose balance is the unallocated part
+        writers = contribution_writers(created_by)
+        allocated = [sum((amount for _, _, amount in lines), Decimal('0.00')) for lines in allocations]
+        tx_pks = writers['transaction'].write([
+            (transaction_id, payment['account'], f"Payment {payment['reference'] or payment['rf_code'] or ''}".strip(),
+             PAYMENT_TYPE, 'C')
+            for transaction_id, payment in zip(transaction_ids, payments)
+        ])
+        writers['transaction_balance'].write([
+            (transaction_id, tx_pks[transaction_id], -payment['amount'], allocated_amount - payment['amount'])
+            for transaction_id, payment, allocated_amount in zip(transaction_ids, payments, allocated)
+        ])
+        rows = [
+            (payment_id, tx_pks[transaction_id], payment['amount'], allocated_amount,
+             payment['rf_code'], payment['reference'])
+            for payment_id, transaction_id, payment, allocated_amount
+            in zip(payment_ids, transaction_ids, payments, allocated)
+        ]
+        payment_pks = payment_writer(created_by).write(rows)
+        created = [
+            Payment(
+                pk=payment_pks[row[0]], payment_id=row[0], account_transaction_id_id=row[1], amount=row[2],
+                allocated_amount=row[3], rf_code=row[4], reference=row[5],
+                created_by=created_by, last_updated_by=created_by,
+            )
+            for row in rows
+        ]
+        PaymentAllocation.objects.bulk_create([
+            PaymentAllocation(payment_id=payment.pk, obligation_balance_id=obligation_pk, amount=amount)
+            for payment, lines in zip(created, allocations)
+            for obligation_pk, _, amount in lines
+        ])
+        # The same changes in the balance journal, the unallocated part on the account
+        entries = []
+        for payment, row, lines in zip(payments, created, allocations):
+            entries.extend(
+                (payment['account'], obligation_of[obligation_pk], -amount, row.payment_id)
+                for obligation_pk, _, amount in lines
+            )
+            entries.append((payment['account'], None, row.allocated_amount - row.amount, row.payment_id))
+        append_entries(entries, PAYMENT_TYPE)
+
+        schedule_debt_summaries_refresh(accounts.values())
+    return created
+
+
+def reserve_payment_ids(count):
+    """Reserve the business ids of `count` payments. Returns (payment ids, transaction ids)."""
+    return reserve_ids('payment', count), reserve_ids('payment_transaction', count, PAYMENT_FIRST_TRANSACTION_ID)
+
+
+def post_reserved_payments(payments, payment_ids, transaction_ids, created_by=CREATED_BY):
+    """
+    Post payment dicts in the caller's transaction, with ids reserved
+    beforehand (see reserve_payment_ids; unused ids are left as gaps).
+    Returns the Payment rows. Raises PaymentError or ConcurrentUpdate.
+    """
+    payments = [normalize_payment(payment) for payment in payments]
+    if not payments:
+        return []
+    return _post(payments, payment_ids, transaction_ids, created_by)
+
+
+def post_payments(payments, created_by=CREATED_BY, batch_size=PAYMENT_BATCH_SIZE):
+    """
+    Post payment dicts (see normalize_payment) in batches of `batch_size`,
+    each in its own transaction. Returns the Payment rows. Raises
+    PaymentError, or ConcurrentUpdate if a batch kept conflicting.
+    """
+    payments = [normalize_payment(payment) for payment in payments]
+    posted = []
+    for start in range(0, len(payments), batch_size):
+        batch = payments[start:start + batch_size]
+        payment_ids, transaction_ids = reserve_payment_ids(len(batch))
+        for attempt in range(PAYMENT_MAX_RETRIES):
+            try:
+                posted.extend(_post(batch, payment_ids, transaction_ids, created_by))
+                break
+            except ConcurrentUpdate:
+                if attempt == PAYMENT_MAX_RETRIES - 1:
+                    raise
+    return posted
+
+
+def post_payment(account, amount, rf_code=None, reference='', created_by=CREATED_BY):
+    """Post a single payment to an Account (or account pk). Returns the Payment."""
+    account_pk = getattr(account, 'pk', account)
+    return post_payments(
+        [{'account': account_pk, 'amount': amount, 'rf_code': rf_code, 'reference': reference}], created_by,
+    )[0]
+
+
+def payment_history(party_role, limit=50):
+    """The latest payments to a party role's accounts, with their account type."""
+    return (
+        Payment.objects
+        .filter(account_transaction_id__account_id__party_role_id=party_role)
+        .select_related('account_transaction_id__account_id__account_type_id')
+        .order_by('-creation_date', '-pk')[:limit]
+    )
@@ -0,0 +1,209 @@
+import math
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import InsuranceDaysAccrual, PensionProjection, Person
+
+
+# Pension eligibility projection
+# -----------------------------------------------------------------------------
+# Projects when each insured person reaches the PENSION_MILESTONES: a
+# milestone needs an age and a number of insurance days, so its date is the
+# later of the birthday at that age and the day the accrued days (see
+# core/accrual.py) reach the requirement at the person's recent pace, the
+# mean of the days of the last PENSION_RATE_YEARS complete years (capped at
+# PENSION_MAX_DAYS_PER_YEAR). Without a date of birth, or with days missing
+# and no recent pace (or one reaching them after PENSION_HORIZON_YEARS), a
+# milestone has no date.
+#
+# Batches are projected with NumPy (optional dependency; project() is the
+# per-person version). The results are stored in PensionProjection with the
+# accrual version (its last_change_date) they were computed from, so a
+# refresh only recomputes the parties whose contributions changed since;
+# a date of birth change drops the person's projections (core/signals.py).
+
+# (code, name, age, insurance days)
+PENSION_MILESTONES = getattr(settings, 'PENSION_MILESTONES', [
+    ('REDUCED', 'Reduced Pension Eligibility', 62, 4500),
+    ('FULL', 'Full Pension Eligibility', 67, 4500),
+    ('FULL_40Y', 'Full Pension (40 Years of Insurance)', 62, 12000),
+])
+PENSION_RATE_YEARS = getattr(settings, 'PENSION_RATE_YEARS', 3)
+PENSION_MAX_DAYS_PER_YEAR = getattr(settings, 'PENSION_MAX_DAYS_PER_YEAR', 300)
+PENSION_HORIZON_YEARS = getattr(settings, 'PENSION_HORIZON_YEARS', 80)
+PENSION_BATCH_SIZE = getattr(settings, 'PENSION_BATCH_SIZE', 5000)
+
+DAYS_PER_YEAR = 365.25
+_HORIZON_DAYS = int(PENSION_HORIZON_YEARS * DAYS_PER_YEAR)
+
+
+def days_rate(days_by_year, today):
+    """Projected insurance days per year of an accrual's {"year": days}."""
+    years = range(today.year - PENSION_RATE_YEARS, today.year)
+    rate = sum(days_by_year.get(str(year), 0) for year in years) / PENSION_RATE_YEARS
+    return min(rate, PENSION_MAX_DAYS_PER_YEAR)
+
+
+def add_years(value, years):
+    """The date `years` after `value`; 29 February moves to 1 March."""
+    return date(value.year + years, value.month, 1) + timedelta(days=value.day - 1)
+
+
+def project(date_of_birth, accrued_days, rate, today, milestones=PENSION_MILESTONES):
+    """{code: (age_date, days_date, eligibility_date)} of one person, None for dates out of reach."""
+    result = {}
+    for code, _, age, days in milestones:
+        age_date = add_years(date_of_birth, age) if date_of_birth else None
+        offset = math.ceil((days - accrued_days) * DAYS_PER_YEAR / rate) if rate > 0 else None
+        if accrued_days >= days:
+            days_date = today
+        elif offset is not None and offset <= _HORIZON_DAYS:
+            days_date = today + timedelta(days=offset)
+        else:
+            days_date = None
+        eligibility_date = max(age_date, days_date) if age_date and days_date else None
+        result[code] = (age_date, days_date, eligibility_date)
+    return result
+
+
+def project_batch(dates_of_birth, accrued_days, rates, today, milestones=PENSION_MILESTONES):
+    """
+    Vectorized project(): dates of birth (None when unknown), accrued days
+    and rates of a batch. Returns {code: (age_dates, days_dates,
+    eligibility_dates)} datetime64[D] arrays, NaT out of reach.
+    """
+    import numpy as np
+
+    births = np.array(dates_of_birth, dtype='datetime64[D]')
+    accrued = np.asarray(accrued_days, dtype=np.int64)
+    rates = np.asarray(rates, dtype=np.float64)
+    today = np.datetime64(today, 'D')
+    birth_months = births.astype('datetime64[M]')
+    birth_days = births - birth_months.astype('datetime64[D]')
+    nat = np.datetime64('NaT', 'D')
+
+    result = {}
+    for code, _, age, days in milestones:
+        age_dates = (birth_months + age * 12).astype('datetime64[D]') + birth_days
+        # Days still missing at the person's pace, out of reach past the horizon
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offsets = np.ceil((days - accrued) * DAYS_PER_YEAR / rates)
+        reachable = (rates > 0) & (offsets <= _HORIZON_DAYS)
+        offsets = np.where(reachable, offsets, 0).astype('timedelta64[D]')
+        days_dates = np.where(accrued >= days, today, np.where(reachable, today + offsets, nat))
+        eligibility_dates = np.where(
+            np.isnat(age_dates) | np.isnat(days_dates), nat, np.maximum(age_dates, days_dates),
+        )
+        result[code] = (age_dates, days_dates, eligibility_dates)
+    return result
+
+
+def _stale_accruals(party_pks=None, stale_only=True):
+    """(party pk, total days, days by year, last change, date of birth) of the accruals to project."""
+    accruals = InsuranceDaysAccrual.objects.all()
+    if party_pks is not None:
+        accruals = accruals.filter(party_id__in=party_pks)
+    if stale_only:
+        current = PensionProjection.objects.filter(
+            party_id=OuterRef('party_id'), accrual_date=OuterRef('last_change_date'),
+        )
+        accruals = accruals.filter(~Exists(current))
+    birth = Person.objects.filter(party_id=OuterRef('party_id')).order_by('pk').values('date_of_birth')[:1]
+    return (
+        accruals
+        .annotate(date_of_birth=Subquery(birth))
+        .order_by('party_id')
+        .values_list('party_id', 'total_days', 'days_by_year', 'last_change_date', 'date_of_birth')
+    )
+
+
+def _project_rows(births, totals, rates, today):
+    """Milestones of a batch, per party: [{code: (age_date, days_date, eligibility_date)}]."""
+    try:
+        projected = project_batch(births, totals, rates, today)
+    except ImportError:
+        return [project(*args, today) for args in zip(births, totals, rates)]
+    # datetime64 arrays to lists of dates (None for NaT)
+    columns = {code: list(zip(*(dates.astype(object) for dates in arrays))) for code, arrays in projected.items()}
+    return [{code: columns[code][index] for code in columns} for index in range(len(totals))]
+
+
+def refresh_pension_projections(party_pks=None, stale_only=True, batch_size=PENSION_BATCH_SIZE, today=None):
+    """
+    Project the given parties (all by default), by default only those whose
+    accrual changed since their last projection. Returns the number of
+    parties projected.
+    """
+    today = today or timezone.localdate()
+    accruals = _stale_accruals(party_pks, stale_only)
+    last_party_pk = None
+    count = 0
+    while True:
+        # Keyset pages, the writes below change which accruals are stale
+        page = accruals if last_party_pk is None else accruals.filter(party_id__gt=last_party_pk)
+        batch = list(page[:batch_size])
+        if not batch:
+            return count
+        party_pks_batch, totals, years, versions, births = zip(*batch)
+        rates = [days_rate(days_by_year, today) for days_by_year in years]
+        per_party = _project_rows(births, totals, rates, today)
+
+        now = timezone.now()
+        projections = []
+        for party_pk, total, version, milestones in zip(party_pks_batch, totals, versions, per_party):
+            for code, _, _, days in PENSION_MILESTONES:
+                age_date, days_date, eligibility_date = milestones[code]
+                projections.append(PensionProjection(
+                    party_id_id=party_pk, milestone=code, accrued_days=total, required_days=days,
+                    age_date=age_date, days_date=days_date, eligibility_date=eligibility_date,
+                    accrual_date=version, computed_date=now,
+                ))
+        with transaction.atomic():
+            PensionProjection.objects.filter(party_id__in=party_pks_batch).delete()
+            PensionProjection.objects.bulk_create(projections)
+        count += len(batch)
+        last_party_pk = party_pks_batch[-1]
+
+
+def invalidate_pension_projections(party_pk):
+    """Drop a party's projections (its date of birth changed), the next refresh projects it again."""
+    PensionProjection.objects.filter(party_id=party_pk).delete()
+
+
+def get_pension_projections(accrual):
+    """The projections of an accrual's party in milestone order, recomputed if its accrual changed."""
+    order = {code: index for index, (code, *_) in enumerate(PENSION_MILESTONES)}
+    projections = list(PensionProjection.objects.filter(party_id=accrual.party_id_id))
+    if (
+        {projection.milestone for projection in projections} != set(order)
+        or any(projection.accrual_date != accrual.last_change_date for projection in projections)
+    ):
+        refresh_pension_projections([accrual.party_id_id], stale_only=False)
+        projections = list(PensionProjection.objects.filter(party_id=accrual.party_id_id))
+    return sorted(projections, key=lambda projection: order.get(projection.milestone, len(order)))
+
+
+def next_milestone(projections, today=None):
+    """
+    (name, date) of the next milestone to reach (the last one reached if
+    all are), or None. Of milestones reached the same day, the one listed
+    last in PENSION_MILESTONES wins.
+    """
+    today = today or timezone.localdate()
+    milestones = {code: (index, name) for index, (code, name, *_) in enumerate(PENSION_MILESTONES)}
+    dated = sorted(
+        (projection.eligibility_date, -milestones[projection.milestone][0], milestones[projection.milestone][1])
+        for projection in projections
+        if projection.eligibility_date and projection.milestone in milestones
+    )
+    upcoming = [(name, eligibility_date) for eligibility_date, _, name in dated if eligibility_date > today]
+    if upcoming:
+        return upcoming[0]
+    if dated:
+        reached = max(dated, key=lambda item: (item[0], -item[1]))
+        return reached[2], reached[0]
+    return None
@@ -0,0 +1,251 @@
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .database import iter_rows
+from .models import (
+    InsuranceContribution, LatestContribution, Party, PartyIdentifier, PartyIdentifierType, PartyRelationship
+)
+
+
+# APD prefill lookups
+# -----------------------------------------------------------------------------
+# The APD form asks for the last contribution of an employee on every AMA
+# change. The AMA -> party pk mapping is cached under a generation key (like
+# the role cache in core/roles.py) that is bumped whenever a PartyIdentifier
+# changes, and LatestContribution keeps a pointer to each party's most recent
+# contribution, so a lookup is a cache hit plus one primary-key read.
+
+AMA_CACHE_PREFIX = 'ama-party'
+AMA_GENERATION_KEY = 'ama-party:generation'
+AMA_CACHE_TIMEOUT = getattr(settings, 'AMA_CACHE_TIMEOUT', 60 * 60)
+
+# Cached for AMAs that match no party
+_NO_PARTY = 0
+
+# Most recent first; ties on end_date go to the row inserted last
+LATEST_ORDER = ('-end_date', '-pk')
+
+_PREFILL_FIELDS = ('coverage_package_id', 'earning_type_id', 'insurance_days', 'gross_earnings', 'total_contribution')
+
+# relationship_type_id=1 is EMPLOYMENT (relation_from: employer, relation_to: employee)
+EMPLOYMENT_RELATIONSHIP_TYPE = 1
+
+PREFILL_CHUNK_SIZE = getattr(settings, 'PREFILL_CHUNK_SIZE', 2000)
+# AMAs one batch lookup may ask for
+PREFILL_MAX_AMAS = getattr(settings, 'PREFILL_MAX_AMAS', 5000)
+
+EMPLOYEE_NOT_FOUND = 'Employee not found'
+NO_CONTRIBUTIONS = 'No previous contributions found for this employee'
+
+
+def _generation():
+    generation = cache.get(AMA_GENERATION_KEY)
+    if generation is None:
+        cache.add(AMA_GENERATION_KEY, 1, None)
+        generation = cache.get(AMA_GENERATION_KEY, 1)
+    return generation
+
+
+def _ama_key(ama):
+    return f"{AMA_CACHE_PREFIX}:{_generation()}:{ama}"
+
+
+def ama_identifiers():
+    ama_type_ids = PartyIdentifierType.objects.filter(identifier_type_code='AMA').values('identifier_type_id')
+    return PartyIdentifier.objects.filter(identifier_type_id__in=ama_type_ids)
+
+
+def resolve_ama(ama):
+    """Return the pk of the party holding an AMA (cached), or None."""
+    key = _ama_key(ama)
+    party_pk = cache.get(key)
+    if party_pk is None:
+        party_pk = (
+            ama_identifiers()
+            .filter(identifier_value=ama)
+            .order_by('pk')
+            .values_list('party_id', flat=True)
+            .first()
+        ) or _NO_PARTY
+        cache.set(key, party_pk, AMA_CACHE_TIMEOUT)
+    return party_pk or None
+
+
+def invalidate_ama_index():
+    """Drop every cached AMA by moving to a new generation."""
+    try:
+        cache.incr(AMA_GENERATION_KEY)
+    except ValueError:
+        cache.set(AMA_GENERATION_KEY, 2, None)
+
+
+def _pointer_defaults(contribution, now):
+    defaults = {field: getattr(contribution, field) for field in _PREFILL_FIELDS}
+    defaults['contribution_id'] = contribution.pk
+    defaults['end_date'] = contribution.end_date
+    defaults['last_change_date'] = now
+    return defaults
+
+
+def refresh_latest_contribution(party_pk):
+    """Recompute the LatestContribution of one party (None if it has none)."""
+    latest = InsuranceContribution.objects.filter(party_id=party_pk).order_by(*LATEST_ORDER).first()
+    if latest is None:
+        LatestContribution.objects.filter(party_id=party_pk).delete()
+        return None
+    pointer, _ = LatestContribution.objects.update_or_create(
+        party_id_id=party_pk, defaults=_pointer_defaults(latest, timezone.now()),
+    )
+    return pointer
+
+
+def contribution_saved(contribution):
+    """Move the party's pointer to a saved contribution if it is now the latest."""
+    pointer = LatestContribution.objects.filter(party_id=contribution.party_id_id).first()
+    if pointer is not None and pointer.contribution_id == contribution.pk:
+        # The latest one changed, its end date may have moved back
+        return refresh_latest_contribution(contribution.party_id_id)
+    # The stored end date: the instance holds it as assigned (naive, a string...)
+    end_date = InsuranceContribution.objects.filter(pk=contribution.pk).values_list('end_date', flat=True).first()
+    if end_date is None:
+        return pointer
+    if pointer is None or (end_date, contribution.pk) > (pointer.end_date, pointer.contribution_id):
+        defaults = _pointer_defaults(contribution, timezone.now())
+        defaults['end_date'] = end_date
+        pointer, _ = LatestContribution.objects.update_or_create(
+            party_id_id=contribution.party_id_id, defaults=defaults,
+        )
+    return pointer
+
+
+def get_latest_contribution(party_pk):
+    """Return the LatestContribution of a party, computing it if missing."""
+    pointer = LatestContribution.objects.filter(party_id=party_pk).first()
+    if pointer is None:
+        pointer = refresh_latest_contribution(party_pk)
+    return pointer
+
+
+def rebuild_latest_contributions(party_pks=None, batch_size=1000):
+    """Recompute the pointers of the given parties (all by default). Returns the number of rows."""
+    latest = (
+        InsuranceContribution.objects
+        .filter(party_id=OuterRef('pk'))
+        .order_by(*LATEST_ORDER)
+        .values('pk')[:1]
+    )
+    parties = Party.objects.all() if party_pks is None else Party.objects.filter(pk__in=party_pks)
+    pointers = iter(list(
+        parties
+        .annotate(latest_pk=Subquery(latest))
+        .filter(latest_pk__isnull=False)
+        .order_by()
+        .values_list('pk', 'latest_pk')
+    ))
+
+    now = timezone.now()
+    count = 0
+    while True:
+        chunk = dict(islice(pointers, batch_size))
+        if not chunk:
+            break
+        contributions = InsuranceContribution.objects.in_bulk(list(chunk.values()))
+        LatestContribution.objects.bulk_create(
+            [
+                LatestContribution(party_id_id=party_pk, **_pointer_defaults(contributions[contribution_pk], now))
+                for party_pk, contribution_pk in chunk.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['party_id'],
+            update_fields=['contribution', 'end_date', 'last_change_date'] + list(_PREFILL_FIELDS),
+        )
+        count += len(chunk)
+    return count
+
+
+# Batch prefill
+# -----------------------------------------------------------------------------
+# Prefilling a whole APD needs the last contribution of every employee. The
+# batch lookup resolves the AMAs of the selected parties with one query and
+# reads the latest contribution of all of them with a second one (DISTINCT ON
+# on PostgreSQL, a ROW_NUMBER() window elsewhere), streamed with a server-side
+# cursor. It reads InsuranceContribution directly, so it does not depend on
+# the LatestContribution pointers being current. Only the employer's own
+# active employees are looked up: other AMAs are reported as not found.
+
+def employee_party_pks(employer_role_pk):
+    """Queryset of the party pks of an employer's active employees."""
+    return (
+        PartyRelationship.objects
+        .filter(relation_from=employer_role_pk, relationship_type_id=EMPLOYMENT_RELATIONSHIP_TYPE, status=1)
+        .values('relation_to__party_id')
+    )
+
+
+def latest_contributions(party_pks):
+    """One contribution per party, the most recent (see LATEST_ORDER)."""
+    contributions = InsuranceContribution.objects.filter(party_id__in=party_pks)
+    if connection.vendor == 'postgresql':
+        return contributions.order_by('party_id_id', *LATEST_ORDER).distinct('party_id_id')
+    return (
+        contributions
+        .annotate(row_number=Window(
+            RowNumber(),
+            partition_by=[F('party_id_id')],
+            order_by=[F('end_date').desc(), F('pk').desc()],
+        ))
+        .filter(row_number=1)
+        .order_by('party_id_id')
+    )
+
+
+def iter_last_contributions(employer_role_pk, amas=None, chunk_size=PREFILL_CHUNK_SIZE):
+    """
+    Yield one dict per employee of an employer: the AMA and the prefill
+    fields of its latest contribution, or the AMA and an error. Employees are
+    the given AMAs, or all active employees when no AMAs are given.
+    """
+    identifiers = ama_identifiers().filter(party_id__in=employee_party_pks(employer_role_pk))
+    if amas is not None:
+        identifiers = identifiers.filter(identifier_value__in=amas)
+
+    # 1. Party -> AMA (the oldest identifier wins, as in resolve_ama)
+    party_amas = {}
+    for party_pk, ama in identifiers.order_by('-pk').values_list('party_id', 'identifier_value'):
+        party_amas[party_pk] = ama
+
+    # 2. Latest contribution of every party, in party order
+    rows = iter_rows(
+        latest_contributions(identifiers.values('party_id')),
+        ('party_id_id', *_PREFILL_FIELDS), ('party_id_id',), chunk_size,
+    )
+    found = set()
+    for party_pk, *values in rows:
+        found.add(party_pk)
+        line = {'ama': party_amas[party_pk]}
+        line.update(zip(_PREFILL_FIELDS, values))
+        yield line
+
+    # 3. Employees without contributions, then AMAs that match nobody
+    for party_pk, ama in party_amas.items():
+        if party_pk not in found:
+            yield {'ama': ama, 'error': NO_CONTRIBUTIONS}
+    if amas is not None:
+        known = set(party_amas.values())
+        for ama in dict.fromkeys(amas):
+            if ama not in known:
+                yield {'ama': ama, 'error': EMPLOYEE_NOT_FOUND}
+
+
+def iter_json_lines(rows):
+    """Encode dicts as JSON lines (decimals as strings, like JsonResponse)."""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
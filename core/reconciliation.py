@@ -0,0 +1,412 @@
+import csv
+import os
+import re
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .loaders import TWO_PLACES
+from .models import Account, BankStatement, ReconciliationException, TransactionObligation
+from .payments import PAYMENT_MAX_RETRIES, ConcurrentUpdate, post_reserved_payments, reserve_payment_ids
+
+
+# Bank statement reconciliation
+# -----------------------------------------------------------------------------
+# Matches the credit lines of a bank statement to obligations by RF code and
+# posts them as payments (core/payments.py). Statements are CSV files (see
+# STATEMENT_CSV_COLUMNS) or camt.053 XML, read as a stream (the XML with
+# iterparse, one entry at a time) in batches of RECON_BATCH_SIZE lines:
+#
+# 1. payment ids are reserved for the lines with an RF code, outside the
+#    batch transaction (the IdSequence rows stay locked for a moment only);
+# 2. in the batch transaction, the accounts of the batch's RF codes are
+#    locked, then the RF codes are looked up with one query (on
+#    tobl_rf_code_idx) into an RF code -> (account, open balance) dict,
+#    RfIndex, so the balances cannot change before the payments post;
+# 3. each line is classified: an exact match, a partial match (less or more
+#    than the open balance, or an obligation already settled) or unmatched
+#    (no RF code, unknown RF code, unreadable line);
+# 4. matched and partially matched lines are posted with
+#    post_reserved_payments(), allocated to the obligations of their RF code
+#    (what is left over stays on the account as a credit); partial and
+#    unmatched lines are written to ReconciliationException for review.
+#
+# Each batch commits with the statement's lines_processed counter, so a
+# failed import resumes after the last committed batch.
+
+RECON_UPLOAD_DIR = getattr(settings, 'RECON_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'uploads', 'statements'))
+RECON_BATCH_SIZE = getattr(settings, 'RECON_BATCH_SIZE', 5000)
+# Uploads are queued (PENDING) for `manage.py reconcile_statement --resume`;
+# True reconciles them within the upload request instead
+RECON_PROCESS_ON_UPLOAD = getattr(settings, 'RECON_PROCESS_ON_UPLOAD', False)
+
+STATEMENT_CSV_COLUMNS = ['booking_date', 'amount', 'rf_code']
+# Optional: credit_debit (C/D, credit when missing), entry_reference, debtor_name
+
+CREATED_BY = 'reconciliation'
+
+# Largest amount a payment holds (Payment.amount, 10 digits)
+MAX_AMOUNT = Decimal('99999999.99')
+
+RF_PATTERN = re.compile(r'RF\d{2}[A-Z0-9]{1,21}')
+
+_UPLOAD_BLOCK_SIZE = 64 * 1024
+# Largest amount an exception holds (ReconciliationException.amount, 12 digits)
+_MAX_STORED = Decimal('1E10')
+
+
+class StatementFileError(ValueError):
+    """The statement file cannot be reconciled at all (format, columns)."""
+
+
+def normalize_rf(value):
+    """RF code without spaces, upper case ('' when there is none)."""
+    return re.sub(r'\s+', '', value or '').upper()
+
+
+def _parse_date(value):
+    value = (value or '').strip()[:10]
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date {value!r}")
+
+
+def _line(rf_code, amount, booking_date, entry_reference):
+    """A statement line dict; unreadable values are reported in 'error'."""
+    line = {
+        'rf_code': normalize_rf(rf_code),
+        'amount': None,
+        'booking_date': None,
+        'entry_reference': (entry_reference or '').strip()[:100],
+        'error': '',
+    }
+    try:
+        line['amount'] = Decimal((amount or '').strip().replace(',', '.'))
+        if not line['amount'].is_finite() or line['amount'] != line['amount'].quantize(TWO_PLACES):
+            raise InvalidOperation
+    except InvalidOperation:
+        line['amount'] = None
+        line['error'] = f"Invalid amount {amount!r}"
+        return line
+    if not 0 < line['amount'] <= MAX_AMOUNT:
+        line['error'] = f"Amount out of range: {line['amount']}"
+    try:
+        line['booking_date'] = _parse_date(booking_date) if booking_date else None
+    except ValueError as e:
+        line['error'] = str(e)
+    return line
+
+
+def iter_csv_lines(path):
+    """Yield the statement line dicts of the credit lines of a CSV statement."""
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in STATEMENT_CSV_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise StatementFileError(f"Missing columns: {', '.join(missing)}")
+        for row in reader:
+            if (row.get('credit_debit') or 'C').strip().upper()[:1] == 'D':
+                continue
+            yield _line(row['rf_code'], row['amount'], row['booking_date'], row.get('entry_reference'))
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child(element, *path):
+    """First descendant along a path of local names (any namespace), or None."""
+    for name in path:
+        element = next((child for child in element if _local(child.tag) == name), None)
+        if element is None:
+            return None
+    return element
+
+
+def _text(element, *path):
+    found = _child(element, *path)
+    return (found.text or '').strip() if found is not None else ''
+
+
+def _entry_lines(entry):
+    """Statement line dicts of one camt.053 <Ntry>: one per transaction detail, credits only."""
+    if _text(entry, 'CdtDbtInd') != 'CRDT' or _text(entry, 'RvslInd').lower() == 'true':
+        return []
+    booking_date = _text(entry, 'BookgDt', 'Dt') or _text(entry, 'BookgDt', 'DtTm')
+    entry_reference = _text(entry, 'AcctSvcrRef')
+    details = [
+        element for element in entry.iter()
+        if _local(element.tag) == 'TxDtls'
+    ]
+    if not details:
+        match = RF_PATTERN.search(normalize_rf(_text(entry, 'AddtlNtryInf')))
+        return [_line(match.group(0) if match else '', _text(entry, 'Amt'), booking_date, entry_reference)]
+
+    lines = []
+    for detail in details:
+        if _text(detail, 'CdtDbtInd') == 'DBIT':
+            continue
+        amount = (
+            _text(detail, 'Amt') or _text(detail, 'AmtDtls', 'TxAmt', 'Amt')
+            or (_text(entry, 'Amt') if len(details) == 1 else '')
+        )
+        rf_code = _text(detail, 'RmtInf', 'Strd', 'CdtrRefInf', 'Ref')
+        if not rf_code:
+            # Unstructured remittance information holding an RF code
+            unstructured = ' '.join(
+                (element.text or '') for element in detail.iter() if _local(element.tag) == 'Ustrd'
+            )
+            match = RF_PATTERN.search(normalize_rf(unstructured))
+            rf_code = match.group(0) if match else ''
+        reference = _text(detail, 'Refs', 'AcctSvcrRef') or _text(detail, 'Refs', 'EndToEndId') or entry_reference
+        lines.append(_line(rf_code, amount, booking_date, reference))
+    return lines
+
+
+def iter_camt053_lines(path):
+    """Yield the statement line dicts of the credit entries of a camt.053 file, one <Ntry> in memory at a time."""
+    parents = []
+    try:
+        for event, element in ElementTree.iterparse(path, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if _local(element.tag) == 'Ntry':
+                yield from _entry_lines(element)
+                if parents:
+                    parents[-1].remove(element)
+    except ElementTree.ParseError as e:
+        raise StatementFileError(f"Unreadable XML: {e}")
+
+
+def detect_format(path, name=''):
+    """BankStatement format of a file, from its name or its first byte."""
+    extension = os.path.splitext(name or path)[1].lower()
+    if extension == '.xml':
+        return BankStatement.FORMAT_CAMT053
+    if extension == '.csv':
+        return BankStatement.FORMAT_CSV
+    with open(path, 'rb') as f:
+        head = f.read(512).lstrip(b'\xef\xbb\xbf \t\r\n')
+    return BankStatement.FORMAT_CAMT053 if head.startswith(b'<') else BankStatement.FORMAT_CSV
+
+
+def iter_statement_lines(statement, start=0):
+    """Yield (line number, line dict) of a statement's credit lines after `start`."""
+    lines = iter_camt053_lines if statement.file_format == BankStatement.FORMAT_CAMT053 else iter_csv_lines
+    for number, line in enumerate(lines(statement.file_path), start=1):
+        if number > start:
+            yield number, line
+
+
+def create_statement(upload, created_by=CREATED_BY):
+    """
+    Store an upload (Django UploadedFile or any object with chunks()/name)
+    block by block and register its statement. Raises StatementFileError.
+    """
+    os.makedirs(RECON_UPLOAD_DIR, exist_ok=True)
+    name = os.path.basename(getattr(upload, 'name', '') or '')
+    path = os.path.join(RECON_UPLOAD_DIR, f"{uuid.uuid4().hex}{os.path.splitext(name)[1].lower()}")
+    with open(path, 'wb') as f:
+        for block in upload.chunks(_UPLOAD_BLOCK_SIZE):
+            f.write(block)
+
+    statement = BankStatement(
+        file_name=(name or os.path.basename(path))[:255],
+        file_path=path,
+        file_format=detect_format(path, name),
+        created_by=created_by,
+        last_updated_by=created_by,
+    )
+    try:
+        statement.lines_total = sum(1 for _ in iter_statement_lines(statement))
+    except (StatementFileError, UnicodeDecodeError, csv.Error) as e:
+        os.remove(path)
+        raise StatementFileError(str(e) if isinstance(e, StatementFileError) else f"Unreadable file: {e}")
+    if not statement.lines_total:
+        os.remove(path)
+        raise StatementFileError("The statement has no credit lines.")
+    statement.save()
+    return statement
+
+
+def lock_rf_accounts(rf_codes):
+    """Lock (in pk order) the accounts holding the obligations of a set of RF codes."""
+    account_pks = TransactionObligation.objects.filter(rf_code__in=rf_codes).values('transaction_id__account_id')
+    return list(
+        Account.objects.select_for_update().filter(pk__in=account_pks).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+class RfIndex:
+    """
+    RF code -> [account pk, open balance] of the obligations of a set of RF
+    codes. The open balance is decremented as lines are matched, so several
+    lines paying the same RF code in a batch see what is left.
+    """
+
+    def __init__(self, rf_codes):
+        self.index = {}
+        rows = (
+            TransactionObligation.objects
+            .filter(rf_code__in=rf_codes)
+            .order_by('transaction_id__account_id', 'pk')
+            .values_list('rf_code', 'transaction_id__account_id', 'obligationbalance__balance')
+        )
+        for rf_code, account_pk, balance in rows:
+            entry = self.index.setdefault(rf_code, [account_pk, Decimal('0.00')])
+            if entry[0] == account_pk and balance:
+                entry[1] += max(balance, Decimal('0.00'))
+
+    def get(self, rf_code):
+        return self.index.get(rf_code)
+
+
+class StatementReconciliation:
+    """
+    Match and post one BankStatement. `progress` is called with the
+    statement after every batch. run() can be called again on a failed
+    statement to resume it.
+    """
+
+    def __init__(self, statement, batch_size=RECON_BATCH_SIZE, progress=None):
+        self.statement = statement
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def run(self):
+        """Process the statement to COMPLETED. Returns the statement."""
+        statement = self.statement
+        if statement.state == BankStatement.STATE_COMPLETED:
+            return statement
+        try:
+            self._save(state=BankStatement.STATE_PROCESSING, error_message='')
+            lines = iter_statement_lines(statement, statement.lines_processed)
+            while True:
+                batch = list(islice(lines, self.batch_size))
+                if not batch:
+                    break
+                self.process_batch(batch)
+                if self.progress:
+                    self.progress(statement)
+            self._save(state=BankStatement.STATE_COMPLETED, completed_date=timezone.now())
+        except Exception as e:
+            self._save(state=BankStatement.STATE_FAILED, error_message=str(e)[:1000])
+            raise
+        return statement
+
+    def _save(self, **fields):
+        for name, value in fields.items():
+            setattr(self.statement, name, value)
+        self.statement.last_updated_by = CREATED_BY
+        self.statement.save(update_fields=list(fields) + ['last_updated_by', 'last_update_date'])
+
+    def classify(self, batch, rf_codes):
+        """
+        Match a batch of (number, line) against the obligations of its RF
+        codes. Returns ([(number, line, account pk)] to post, [(number, line,
+        reason, open balance)] exceptions, number of exact matches).
+        """
+        index = RfIndex(rf_codes)
+        to_post, exceptions, matched = [], [], 0
+        for number, line in batch:
+            if line['error']:
+                exceptions.append((number, line, ReconciliationException.REASON_INVALID, None))
+                continue
+            if not line['rf_code']:
+                exceptions.append((number, line, ReconciliationException.REASON_NO_RF, None))
+                continue
+            entry = index.get(line['rf_code'])
+            if entry is None:
+                exceptions.append((number, line, ReconciliationException.REASON_UNKNOWN_RF, None))
+                continue
+            account_pk, open_balance = entry
+            entry[1] = max(open_balance - line['amount'], Decimal('0.00'))
+            to_post.append((number, line, account_pk))
+            if not open_balance:
+                exceptions.append((number, line, ReconciliationException.REASON_SETTLED, open_balance))
+            elif line['amount'] < open_balance:
+                exceptions.append((number, line, ReconciliationException.REASON_UNDERPAID, open_balance))
+            elif line['amount'] > open_balance:
+                exceptions.append((number, line, ReconciliationException.REASON_OVERPAID, open_balance))
+            else:
+                matched += 1
+        return to_post, exceptions, matched
+
+    def process_batch(self, batch):
+        """Post the matched lines of a batch and record its exceptions, in one transaction."""
+        # Every readable line with an RF code may become a payment
+        candidates = [line['rf_code'] for _, line in batch if line['rf_code'] and not line['error']]
+        rf_codes = set(candidates)
+        payment_ids, transaction_ids = reserve_payment_ids(len(candidates))
+        for attempt in range(PAYMENT_MAX_RETRIES):
+            try:
+                with transaction.atomic():
+                    lock_rf_accounts(rf_codes)
+                    self._post_batch(batch, rf_codes, payment_ids, transaction_ids)
+                return
+            except ConcurrentUpdate:
+                if attempt == PAYMENT_MAX_RETRIES - 1:
+                    raise
+
+    def _post_batch(self, batch, rf_codes, payment_ids, transaction_ids):
+        statement = self.statement
+        to_post, exceptions, matched = self.classify(batch, rf_codes)
+        payments = post_reserved_payments(
+            [
+                {
+                    'account': account_pk,
+                    'amount': line['amount'],
+                    'rf_code': line['rf_code'],
+                    'reference': line['entry_reference'],
+                }
+                for _, line, account_pk in to_post
+            ],
+            payment_ids,
+            transaction_ids,
+            created_by=CREATED_BY,
+        )
+        posted = {number: payment for (number, _, _), payment in zip(to_post, payments)}
+        ReconciliationException.objects.bulk_create([
+            ReconciliationException(
+                statement=statement,
+                line_number=number,
+                reason=reason,
+                rf_code=line['rf_code'][:35],
+                amount=line['amount'] if line['amount'] is not None and abs(line['amount']) < _MAX_STORED else None,
+                open_balance=open_balance,
+                entry_reference=line['entry_reference'],
+                booking_date=line['booking_date'],
+                payment=posted.get(number),
+                message=line['error'][:255],
+            )
+            for number, line, reason, open_balance in exceptions
+        ])
+        partial = sum(1 for number, *_ in exceptions if number in posted)
+        self._save(
+            lines_processed=batch[-1][0],
+            lines_matched=statement.lines_matched + matched,
+            lines_partial=statement.lines_partial + partial,
+            lines_unmatched=statement.lines_unmatched + len(exceptions) - partial,
+            amount_total=statement.amount_total + sum(line['amount'] for _, line in batch if not line['error']),
+            amount_posted=statement.amount_posted + sum(payment.amount for payment in payments),
+        )
+
+
+def reconcile(statement, batch_size=RECON_BATCH_SIZE, progress=None):
+    """Match and post (or resume) a statement. Returns it."""
+    return StatementReconciliation(statement, batch_size, progress).run()
+
+
+def recent_statements(limit=10):
+    return BankStatement.objects.order_by('-creation_date', '-pk')[:limit]
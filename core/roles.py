@@ -0,0 +1,157 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Client, PartyRole, PartyRoleType
+
+
+# Cached role resolution
+# -----------------------------------------------------------------------------
+# Every protected view needs to know the role of the logged in user. Resolving
+# it walks Client -> Party -> PartyRole -> PartyRoleType, so the result is
+# computed once per login and kept in the cache under a per-user key. The key
+# embeds a generation number that is bumped whenever a PartyRoleType changes,
+# which drops every cached entry at once. A change on the path of a user's
+# lookup only drops the entries of the users it moves: a PartyRole (its party
+# before and after), a Party (the users of its client before and after) or a
+# Client (its user before and after), see core/signals.py.
+
+ROLE_CACHE_PREFIX = 'party-role'
+ROLE_GENERATION_KEY = 'party-role:generation'
+ROLE_CACHE_TIMEOUT = getattr(settings, 'PARTY_ROLE_CACHE_TIMEOUT', 60 * 60)
+
+# Cache sentinel for users without a client/party/role so we do not hit the
+# database on every request for them either.
+_NO_ROLE = {}
+
+
+class PartyContext:
+    """
+    Per-request view of the logged in user's party.
+
+    Holds the primary keys resolved by the role lookup and loads the matching
+    PartyRole, Party and Client rows lazily with a single joined query, so views
+    can use `request.party_context.party` instead of resolving it again.
+    """
+
+    def __init__(self, role_code=None, client_pk=None, party_pk=None, party_role_pk=None):
+        self.role_code = role_code
+        self.client_pk = client_pk
+        self.party_pk = party_pk
+        self.party_role_pk = party_role_pk
+        self._party_role = None
+
+    @property
+    def party_role(self):
+        if self._party_role is None and self.party_role_pk is not None:
+            self._party_role = (
+                PartyRole.objects
+                .select_related('party_id__client_id')
+                .get(pk=self.party_role_pk)
+            )
+        return self._party_role
+
+    @property
+    def party(self):
+        return self.party_role.party_id if self.party_role else None
+
+    @property
+    def client(self):
+        return self.party.client_id if self.party else None
+
+    def as_dict(self):
+        return {
+            'role_code': self.role_code,
+            'client_pk': self.client_pk,
+            'party_pk': self.party_pk,
+            'party_role_pk': self.party_role_pk,
+        }
+
+
+def _generation():
+    generation = cache.get(ROLE_GENERATION_KEY)
+    if generation is None:
+        cache.add(ROLE_GENERATION_KEY, 1, None)
+        generation = cache.get(ROLE_GENERATION_KEY, 1)
+    return generation
+
+
+def _cache_key(user_id):
+    return f"{ROLE_CACHE_PREFIX}:{_generation()}:{user_id}"
+
+
+def _load_party_context(user):
+    """Resolve the party context of a user straight from the database."""
+    party_role = (
+        PartyRole.objects
+        .select_related('party_id__client_id')
+        .filter(party_id__client_id__user=user, status=1)
+        .order_by('party_id__id', 'id')
+        .first()
+    )
+    if not party_role:
+        return PartyContext()
+
+    role_type = PartyRoleType.objects.filter(role_type_id=party_role.role_type_id).first()
+    party = party_role.party_id
+    context = PartyContext(
+        role_code=role_type.role_type_code if role_type else None,
+        client_pk=party.client_id_id,
+        party_pk=party.pk,
+        party_role_pk=party_role.pk,
+    )
+    context._party_role = party_role
+    return context
+
+
+def get_party_context(user):
+    """Return the (cached) PartyContext for a user."""
+    if not user.is_authenticated:
+        return PartyContext()
+
+    key = _cache_key(user.pk)
+    cached = cache.get(key)
+    if cached is not None:
+        return PartyContext(**cached) if cached else PartyContext()
+
+    context = _load_party_context(user)
+    cache.set(key, context.as_dict() if context.role_code else _NO_ROLE, ROLE_CACHE_TIMEOUT)
+    return context
+
+
+def get_request_party_context(request):
+    """Return the PartyContext of a request, resolving it at most once."""
+    context = getattr(request, 'party_context', None)
+    if context is None:
+        context = get_party_context(request.user)
+        request.party_context = context
+    return context
+
+
+def invalidate_user_role(user_id):
+    """Drop the cached role of a single user."""
+    cache.delete(_cache_key(user_id))
+
+
+def invalidate_users_roles(user_ids):
+    """Drop the cached roles of the given users."""
+    for user_id in set(user_ids):
+        if user_id is not None:
+            invalidate_user_role(user_id)
+
+
+def invalidate_client_roles(client_pks):
+    """Drop the cached roles of the users of the given clients."""
+    invalidate_users_roles(Client.objects.filter(pk__in=client_pks).values_list('user_id', flat=True))
+
+
+def invalidate_party_roles(party_pks):
+    """Drop the cached roles of the users owning the given parties."""
+    invalidate_users_roles(Client.objects.filter(party__id__in=party_pks).values_list('user_id', flat=True))
+
+
+def invalidate_all_roles():
+    """Drop every cached role by moving to a new generation."""
+    try:
+        cache.incr(ROLE_GENERATION_KEY)
+    except ValueError:
+        cache.set(ROLE_GENERATION_KEY, 2, None)
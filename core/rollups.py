@@ -0,0 +1,105 @@
+from datetime import date
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .calculator import CENTS
+from .models import ContributionRollup, InsuranceContribution
+
+
+# Contribution rollups
+# -----------------------------------------------------------------------------
+# ContributionRollup keeps the contributions of each party summed per
+# (year, month, earning type) of their start date, so the insured's
+# contributions page reads a few dozen rows instead of the whole ledger.
+#
+# A party's rollups are recomputed from its contributions with one GROUP BY
+# (an index range scan on icontrib_party_start_idx) whenever one of them is
+# saved or deleted (core/signals.py) and, for the bulk writes that skip the
+# signals, by the loaders and the APD ingestion for the parties they touched.
+# Recomputing instead of adding deltas keeps updates, deletes and re-posted
+# chunks exact. `manage.py rebuild_contribution_rollups` rebuilds them all.
+
+ROLLUP_BATCH_SIZE = getattr(settings, 'ROLLUP_BATCH_SIZE', 2000)
+
+_SUM_FIELDS = ('insurance_days', 'gross_earnings', 'total_contribution')
+
+
+def _aggregate(contributions):
+    """Rollup rows (dicts) of a contributions queryset."""
+    return (
+        contributions
+        .annotate(year=ExtractYear('start_date'), month=ExtractMonth('start_date'))
+        .values('party_id', 'year', 'month', 'earning_type_id')
+        .annotate(contribution_count=Count('pk'), **{field: Sum(field) for field in _SUM_FIELDS})
+        .order_by()
+    )
+
+
+def _rollup(row, now):
+    return ContributionRollup(
+        party_id_id=row['party_id'],
+        year=row['year'],
+        month=row['month'],
+        earning_type_id=row['earning_type_id'],
+        contribution_count=row['contribution_count'],
+        insurance_days=row['insurance_days'] or 0,
+        # SQLite sums decimals as floats
+        gross_earnings=row['gross_earnings'].quantize(CENTS),
+        total_contribution=row['total_contribution'].quantize(CENTS),
+        last_change_date=now,
+    )
+
+
+def _write(rows, batch_size):
+    now = timezone.now()
+    count = 0
+    while True:
+        batch = [_rollup(row, now) for row in islice(rows, batch_size)]
+        if not batch:
+            return count
+        ContributionRollup.objects.bulk_create(batch)
+        count += len(batch)
+
+
+def refresh_contribution_rollups(party_pks, batch_size=ROLLUP_BATCH_SIZE):
+    """Recompute the rollups of the given parties. Returns the number of rows."""
+    party_pks = list(party_pks)
+    count = 0
+    for start in range(0, len(party_pks), batch_size):
+        chunk = party_pks[start:start + batch_size]
+        with transaction.atomic():
+            ContributionRollup.objects.filter(party_id__in=chunk).delete()
+            count += _write(iter(_aggregate(InsuranceContribution.objects.filter(party_id__in=chunk))), batch_size)
+    return count
+
+
+def rebuild_contribution_rollups(batch_size=ROLLUP_BATCH_SIZE):
+    """Recompute every rollup from the contributions table. Returns the number of rows."""
+    with transaction.atomic():
+        ContributionRollup.objects.all().delete()
+        return _write(_aggregate(InsuranceContribution.objects.all()).iterator(chunk_size=batch_size), batch_size)
+
+
+def contribution_rollups(party_pk):
+    """The rollups of a party in period order, computed if the party has none yet."""
+    rollups = ContributionRollup.objects.filter(party_id=party_pk).order_by('year', 'month', 'earning_type_id')
+    rows = list(rollups)
+    if not rows and InsuranceContribution.objects.filter(party_id=party_pk).exists():
+        refresh_contribution_rollups([party_pk])
+        rows = list(rollups)
+    return rows
+
+
+def monthly_totals(rollups):
+    """[(date of the month, total_contribution, gross_earnings)] of rollups in period order, earning types summed."""
+    months = {}
+    for rollup in rollups:
+        month = date(rollup.year, rollup.month, 1)
+        total, gross = months.get(month, (0, 0))
+        months[month] = (total + rollup.total_contribution, gross + rollup.gross_earnings)
+    return [(month, total, gross) for month, (total, gross) in months.items()]
@@ -0,0 +1,223 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import accrual, fragments, journal, ledger, pensions, prefill, roles, rollups
+from .employers import invalidate_employer_directory
+from .models import (
+    Account, Address, Client, InsuranceContribution, ObligationBalance, Organization, Party, PartyIdentifier,
+    PartyRelationship, PartyRole, PartyRoleType, Person
+)
+
+
+# Role cache
+# -----------------------------------------------------------------------------
+
+@receiver(user_logged_in)
+def warm_role_cache(sender, request, user, **kwargs):
+    """Resolve the role once per login so later requests hit the cache."""
+    roles.invalidate_user_role(user.pk)
+    request.party_context = roles.get_party_context(user)
+
+
+@receiver(user_logged_out)
+def drop_role_cache(sender, request, user, **kwargs):
+    if user is not None:
+        roles.invalidate_user_role(user.pk)
+
+
+def _previous_value(instance, field):
+    """Stored value of a field of a row about to be updated (None for a new row)."""
+    if instance.pk is None:
+        return None
+    return type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(pre_save, sender=PartyRole)
+def party_role_saving(sender, instance, **kwargs):
+    # A role moved to another party also drops the cached role of its previous owner
+    instance._previous_role_party = _previous_value(instance, 'party_id')
+
+
+@receiver(post_save, sender=PartyRole)
+@receiver(post_delete, sender=PartyRole)
+def party_role_changed(sender, instance, **kwargs):
+    roles.invalidate_party_roles([instance.party_id_id, getattr(instance, '_previous_role_party', None)])
+
+
+@receiver(pre_save, sender=Party)
+def party_saving(sender, instance, **kwargs):
+    instance._previous_role_client = _previous_value(instance, 'client_id')
+
+
+@receiver(post_save, sender=Party)
+@receiver(post_delete, sender=Party)
+def party_client_changed(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_role_client', None)
+    if kwargs.get('created') is False and previous == instance.client_id_id:
+        return
+    roles.invalidate_client_roles([instance.client_id_id, previous])
+
+
+@receiver(pre_save, sender=Client)
+def client_saving(sender, instance, **kwargs):
+    instance._previous_role_user = _previous_value(instance, 'user')
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def client_user_changed(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_role_user', None)
+    if kwargs.get('created') is False and previous == instance.user_id:
+        return
+    roles.invalidate_users_roles([instance.user_id, previous])
+
+
+@receiver(post_save, sender=PartyRoleType)
+@receiver(post_delete, sender=PartyRoleType)
+def party_role_type_changed(sender, instance, **kwargs):
+    roles.invalidate_all_roles()
+
+
+# Employer directory
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=Party)
+@receiver(post_delete, sender=Party)
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+@receiver(post_save, sender=PartyIdentifier)
+@receiver(post_delete, sender=PartyIdentifier)
+def employer_details_changed(sender, instance, **kwargs):
+    invalidate_employer_directory()
+
+
+# Party fragments
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=Party)
+@receiver(post_delete, sender=Party)
+def party_fragments_changed(sender, instance, **kwargs):
+    fragments.bump_party_versions([instance.pk])
+
+
+@receiver(post_save, sender=PartyIdentifier)
+@receiver(post_delete, sender=PartyIdentifier)
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+def party_details_changed(sender, instance, **kwargs):
+    fragments.bump_party_versions([instance.party_id_id])
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+def organization_changed(sender, instance, **kwargs):
+    # The employees' dashboards show the organization as their employer
+    fragments.bump_party_versions([instance.party_id_id, *fragments.employee_party_pks(instance.party_id_id)])
+
+
+@receiver(post_save, sender=PartyRelationship)
+@receiver(post_delete, sender=PartyRelationship)
+def party_relationship_changed(sender, instance, **kwargs):
+    fragments.bump_party_versions(fragments.relationship_party_pks(instance))
+
+
+# Employer debt summary
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def account_changed(sender, instance, **kwargs):
+    party_pk = PartyRole.objects.filter(pk=instance.party_role_id_id).values_list('party_id', flat=True).first()
+    ledger.schedule_debt_summary_refresh(party_pk)
+
+
+@receiver(post_save, sender=ObligationBalance)
+@receiver(post_delete, sender=ObligationBalance)
+def obligation_balance_changed(sender, instance, **kwargs):
+    party_pk = (
+        Account.objects
+        .filter(accounttransaction__transactionobligation__pk=instance.obligation_id_id)
+        .values_list('party_role_id__party_id', flat=True)
+        .first()
+    )
+    ledger.schedule_debt_summary_refresh(party_pk)
+
+
+# Single obligation edits are journaled (core/journal.py); the paths that set
+# account balances journal them themselves
+@receiver(post_save, sender=ObligationBalance)
+def obligation_balance_saved(sender, instance, **kwargs):
+    journal.sync_obligation_journal(instance.obligation_id_id)
+
+
+# APD prefill
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=PartyIdentifier)
+@receiver(post_delete, sender=PartyIdentifier)
+def identifier_changed(sender, instance, **kwargs):
+    prefill.invalidate_ama_index()
+
+
+@receiver(post_save, sender=InsuranceContribution)
+def contribution_saved(sender, instance, **kwargs):
+    prefill.contribution_saved(instance)
+
+
+@receiver(post_delete, sender=InsuranceContribution)
+def contribution_deleted(sender, instance, **kwargs):
+    prefill.refresh_latest_contribution(instance.party_id_id)
+
+
+# Contribution rollups
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=InsuranceContribution)
+@receiver(post_delete, sender=InsuranceContribution)
+def contribution_rollups_changed(sender, instance, **kwargs):
+    rollups.refresh_contribution_rollups([instance.party_id_id])
+
+
+# Insurance days accrual
+# -----------------------------------------------------------------------------
+
+@receiver(pre_save, sender=InsuranceContribution)
+def contribution_days_saving(sender, instance, **kwargs):
+    # Days the row held before an update, taken off in post_save
+    previous = None
+    if instance.pk:
+        previous = (
+            InsuranceContribution.objects.filter(pk=instance.pk)
+            .only('party_id', 'start_date', 'coverage_package_id', 'insurance_days')
+            .first()
+        )
+    instance._previous_days = accrual.contribution_days(previous) if previous else None
+
+
+@receiver(post_save, sender=InsuranceContribution)
+def contribution_days_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_days', None)
+    current = accrual.contribution_days(instance)
+    if previous == current:
+        return
+    changes = [current]
+    if previous is not None:
+        party_pk, year, branch, days = previous
+        changes.append((party_pk, year, branch, -days))
+    accrual.apply_contribution_days(changes)
+
+
+@receiver(post_delete, sender=InsuranceContribution)
+def contribution_days_deleted(sender, instance, **kwargs):
+    party_pk, year, branch, days = accrual.contribution_days(instance)
+    accrual.apply_contribution_days([(party_pk, year, branch, -days)])
+
+
+# Pension projections
+# -----------------------------------------------------------------------------
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def person_changed(sender, instance, **kwargs):
+    pensions.invalidate_pension_projections(instance.party_id_id)
@@ -0,0 +1,624 @@
+import calendar
+import os
+import random
+import statistics
+from collections import Counter
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog import get_code_catalog
+from .journal import sync_balance_journal
+from .ledger import ACCOUNT_TYPE_CURRENT, ACCOUNT_TYPE_SETTLED, ACCOUNT_TYPE_UNSETTLED
+from .loaders import (
+    TWO_PLACES, TableWriter, contribution_writers, parse_contribution_csv, write_contributions,
+    write_obligations
+)
+from .models import (
+    Account, AccountBalance, AccountType, Address, Client, Organization, Party, PartyIdentifier,
+    PartyIdentifierType, PartyRelationship, PartyRelationshipType, PartyRole, PartyRoleType, Person
+)
+
+
+# Synthetic dataset generator
+# -----------------------------------------------------------------------------
+# Builds production-sized datasets for load tests and benchmarks: employers,
+# their insured employees (users, persons, identifiers, employment
+# relationships) and years of monthly contributions with obligations and
+# balances, plus the employers' own APD and KEAO obligations.
+#
+# Salaries, bonuses and insurance days follow data/insurance_contributions.csv
+# and contributions use the dn_kpk.txt rates in force for each month. Every
+# employer (with its employees) is generated from its own RNG seeded with
+# (seed, employer number) and owns a fixed block of IDs, so the result does
+# not depend on the number of worker processes, and running the same command
+# again updates the rows in place (loaders.TableWriter) instead of
+# duplicating them.
+
+CREATED_BY = 'synthetic'
+SYNTHETIC_PASSWORD = 'password123'
+
+FIRST_PARTY_ID = 1_000_000
+FIRST_LINE_ID = 100_000_000
+MAX_ID = 2 ** 31 - 1
+# Contribution line ids per insured and month (regular earnings + bonus)
+LINES_PER_MONTH = 4
+# Lines of the last PAID_LAG_MONTHS months are still outstanding
+PAID_LAG_MONTHS = 2
+OPEN_ENDED = date(2099, 12, 31)
+
+CONTRIBUTIONS_CSV = os.path.join(settings.BASE_DIR, 'data', 'insurance_contributions.csv')
+
+# AccountType / PartyRoleType / PartyIdentifierType ids (seeded in populate_db.py)
+ROLE_INSURED, ROLE_EMPLOYER = 1, 2
+ID_AMA, ID_AMKA, ID_AFM, ID_ADT, ID_AME = 1, 2, 3, 4, 5
+RELATIONSHIP_EMPLOYMENT = 1
+
+FIRST_NAMES = {
+    'M': ['Ioannis', 'Georgios', 'Konstantinos', 'Dimitrios', 'Nikolaos', 'Panagiotis',
+          'Vasileios', 'Christos', 'Athanasios', 'Michail', 'Evangelos', 'Spyridon'],
+    'F': ['Maria', 'Eleni', 'Aikaterini', 'Vasiliki', 'Sofia', 'Angeliki', 'Georgia',
+          'Dimitra', 'Konstantina', 'Paraskevi', 'Christina', 'Anna'],
+}
+LAST_NAMES = {
+    'M': ['Papadopoulos', 'Papadakis', 'Georgiou', 'Nikolaidis', 'Dimitriou', 'Ioannou',
+          'Vlachos', 'Oikonomou', 'Makris', 'Konstantinidis', 'Pappas', 'Karagiannis'],
+    'F': ['Papadopoulou', 'Papadaki', 'Georgiou', 'Nikolaidou', 'Dimitriou', 'Ioannou',
+          'Vlachou', 'Oikonomou', 'Makri', 'Konstantinidou', 'Pappa', 'Karagianni'],
+}
+COMPANY_WORDS = ['Hellenic', 'Aegean', 'Attica', 'Olympus', 'Ionian', 'Delta', 'Acropolis',
+                 'Macedonian', 'Cretan', 'Poseidon', 'Athena', 'Hermes']
+COMPANY_KINDS = ['Energy', 'Logistics', 'Foods', 'Construction', 'Software', 'Textiles',
+                 'Shipping', 'Retail', 'Pharma', 'Metals', 'Tourism', 'Plastics']
+COMPANY_FORMS = ['S.A.', 'Ltd', 'P.C.', 'G.P.']
+STREETS = ['Ermou', 'Stadiou', 'Panepistimiou', 'Akadimias', 'Kifisias', 'Syngrou',
+           'Vasilissis Sofias', 'Patision', 'Tsimiski', 'Egnatia', 'Artemidos', 'Athinas']
+CITIES = [('Athina', '10431'), ('Thessaloniki', '54624'), ('Patra', '26221'),
+          ('Irakleio', '71202'), ('Larisa', '41222'), ('Volos', '38221'),
+          ('Ioannina', '45221'), ('Maroussi', '15124')]
+
+
+def luhn_digit(digits):
+    """Luhn check digit of a string of digits."""
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if i % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+def make_amka(date_of_birth, serial):
+    """AMKA: DDMMYY + 4 digit serial + Luhn check digit (11 digits)."""
+    body = f"{date_of_birth:%d%m%y}{serial % 10000:04d}"
+    return body + luhn_digit(body)
+
+
+def make_afm(body):
+    """AFM: 8 digits + mod 11 check digit (9 digits)."""
+    body = f"{body % 10 ** 8:08d}"
+    total = sum(int(digit) * 2 ** (8 - i) for i, digit in enumerate(body))
+    return body + str(total % 11 % 10)
+
+
+def make_ama(party_id):
+    """AMA: 9 digit registry number + Luhn check digit (10 digits)."""
+    body = f"9{party_id % 10 ** 8:08d}"
+    return body + luhn_digit(body)
+
+
+def make_ame(party_id):
+    """AME (employer registry number), 10 digits."""
+    return f"7{party_id % 10 ** 9:09d}"
+
+
+def contribution_profile(path=CONTRIBUTIONS_CSV):
+    """
+    Distributions taken from a contributions CSV: median regular salary,
+    insurance days of a full month, branch codes, and for every bonus
+    earnings type the month it is paid in and its ratio to the salary.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = list(parse_contribution_csv(f))
+
+    salaries = {}
+    days = Counter()
+    branch_codes = Counter()
+    for line in lines:
+        branch_codes[line['branch_code']] += 1
+        if line['earnings_type'] == 1:
+            salaries[(line['start_date'].year, line['start_date'].month)] = line['gross_earnings']
+            days[line['days']] += 1
+
+    bonus_months = {}
+    bonus_ratios = {}
+    for line in lines:
+        earnings_type = line['earnings_type']
+        period = (line['start_date'].year, line['start_date'].month)
+        if earnings_type == 1 or period not in salaries:
+            continue
+        bonus_months.setdefault(earnings_type, Counter())[period[1]] += 1
+        bonus_ratios.setdefault(earnings_type, []).append(line['gross_earnings'] / salaries[period])
+
+    return {
+        'salary': statistics.median(salaries.values()),
+        'days': days.most_common(1)[0][0],
+        'branch_codes': [str(code).zfill(3) for code, _ in branch_codes.most_common()],
+        'bonuses': {
+            earnings_type: (bonus_months[earnings_type].most_common(1)[0][0],
+                            statistics.median(bonus_ratios[earnings_type]))
+            for earnings_type in bonus_months
+        },
+    }
+
+
+def month_periods(until, years):
+    """The `years` * 12 (year, month) periods ending with `until` (YYYYMM)."""
+    year, month = divmod(until, 100)
+    periods = []
+    for _ in range(years * 12):
+        periods.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return periods[::-1]
+
+
+def check_id_space(employers, insured_per_employer, months):
+    """Raise ValueError if the generated IDs would not fit in an IntegerField."""
+    slots = employers * (insured_per_employer + 1)
+    if FIRST_PARTY_ID + slots >= 10 ** 8:
+        raise ValueError("Too many parties for the synthetic id range.")
+    if FIRST_LINE_ID + slots * months * LINES_PER_MONTH > MAX_ID:
+        raise ValueError("Too many contribution lines for the synthetic id range, use fewer years or parties.")
+
+
+def ensure_reference_data():
+    """Create the role, identifier, account and relationship types if missing."""
+    for type_id, code, description in [(ROLE_INSURED, 'INS', 'Insured Person'), (ROLE_EMPLOYER, 'EMP', 'Employer')]:
+        PartyRoleType.objects.get_or_create(
+            role_type_id=type_id,
+            defaults={'role_type_code': code, 'role_type_description': description, 'created_by': 'sys'},
+        )
+    for type_id, code in [(ID_AMA, 'AMA'), (ID_AMKA, 'AMKA'), (ID_AFM, 'AFM'), (ID_ADT, 'ADT'), (ID_AME, 'AME')]:
+        PartyIdentifierType.objects.get_or_create(
+            identifier_type_id=type_id,
+            defaults={'identifier_type_code': code, 'identifier_type_description': code, 'created_by': 'sys'},
+        )
+    for type_id, code, description in [
+        (ACCOUNT_TYPE_CURRENT, 'CONTRIB', 'Current Contributions'),
+        (ACCOUNT_TYPE_SETTLED, 'SET_DEBT_OVERDUE', 'Settled Overdue Debts'),
+        (ACCOUNT_TYPE_UNSETTLED, 'UNSET_DEBT_OVERDUE', 'Unsettled Overdue Debts'),
+    ]:
+        AccountType.objects.get_or_create(
+            account_type_id=type_id,
+            defaults={'account_type_code': code, 'account_type_description': description, 'created_by': 'sys'},
+        )
+    PartyRelationshipType.objects.get_or_create(
+        relationship_type_id=RELATIONSHIP_EMPLOYMENT,
+        defaults={'relationship_type_code': 'EMPLOYMENT', 'relationship_type_description': 'Employer-Employee',
+                  'created_by': 'sys'},
+    )
+
+
+def _entity_writers():
+    return {
+        'party': TableWriter(Party, 'party_id', [
+            'client_id', 'party_type', 'display_name', 'distinct_type', 'distinct_value',
+        ], CREATED_BY),
+        'role': TableWriter(PartyRole, 'role_id', ['party_id', 'role_type_id'], CREATED_BY),
+        'person': TableWriter(Person, 'person_id', [
+            'party_id', 'first_name', 'last_name', 'date_of_birth', 'gender',
+        ], CREATED_BY),
+        'organization': TableWriter(Organization, 'organization_id', [
+            'party_id', 'name', 'address', 'phone', 'email',
+        ], CREATED_BY),
+        'address': TableWriter(Address, 'address_id', [
+            'party_id', 'address_street', 'address_number', 'city', 'country', 'postal_code',
+        ], CREATED_BY),
+        'identifier': TableWriter(PartyIdentifier, 'identifier_id', [
+            'party_id', 'identifier_value', 'identifier_type_id',
+        ], CREATED_BY),
+        'relationship': TableWriter(PartyRelationship, 'relationship_id', [
+            'party_id', 'relationship_type_id', 'relation_from', 'relation_to',
+            'active_date_from', 'active_date_to',
+        ], CREATED_BY),
+        'account': TableWriter(Account, 'account_id', [
+            'party_role_id', 'account_type_id', 'account_balance',
+        ], CREATED_BY),
+        'account_balance': TableWriter(AccountBalance, 'account_balance_id', [
+            'account_id', 'balance',
+        ], CREATED_BY),
+    }
+
+
+class EmployerGenerator:
+    """
+    Generate and write one employer block: the employer, its employees and
+    their contributions. Instances are cheap, one is built per block.
+    """
+
+    def __init__(self, index, seed, insured_per_employer, periods, profile, password_hash,
+                 batch_size=5000):
+        self.index = index
+        self.rng = random.Random(f"{seed}:{index}")
+        self.insured_per_employer = insured_per_employer
+        self.periods = periods
+        self.profile = profile
+        self.password_hash = password_hash
+        self.batch_size = batch_size
+        self.catalog = get_code_catalog()
+        self.first_slot = index * (insured_per_employer + 1)
+        self.employer_id = FIRST_PARTY_ID + self.first_slot
+        self.paid_until = periods[-PAID_LAG_MONTHS - 1] if len(periods) > PAID_LAG_MONTHS else (0, 0)
+
+    # IDs ---------------------------------------------------------------------
+
+    def line_id(self, party_id, period_index, line):
+        slot = party_id - FIRST_PARTY_ID
+        return FIRST_LINE_ID + (slot * len(self.periods) + period_index) * LINES_PER_MONTH + line
+
+    @staticmethod
+    def account_id(party_id, account_type):
+        return party_id * 4 + account_type
+
+    # Parties -----------------------------------------------------------------
+
+    def _employer(self):
+        rng = self.rng
+        name = f"{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_KINDS)} {rng.choice(COMPANY_FORMS)}"
+        city, postal_code = rng.choice(CITIES)
+        kpk = self._pick_kpk()
+        return {
+            'party_id': self.employer_id,
+            'name': name,
+            'city': city,
+            'postal_code': postal_code,
+            'street': rng.choice(STREETS),
+            'number': str(rng.randint(1, 200)),
+            'kpk': kpk,
+        }
+
+    def _pick_kpk(self):
+        # Mostly the CSV branch codes, otherwise any KPK with a plausible rate
+        codes = [code for code in self.profile['branch_codes'] if code in self.catalog.kpk_rates]
+        if codes and self.rng.random() < 0.6:
+            return self.rng.choice(codes)
+        candidates = sorted(
+            code for code, rates in self.catalog.kpk_rates.items()
+            if Decimal('10') <= rates[0][3] <= Decimal('60')
+        )
+        return self.rng.choice(candidates or codes)
+
+    def _insured(self, number):
+        rng = self.rng
+        gender = rng.choice('MF')
+        first_name, last_name = rng.choice(FIRST_NAMES[gender]), rng.choice(LAST_NAMES[gender])
+        date_of_birth = date(rng.randint(1960, 2003), rng.randint(1, 12), rng.randint(1, 28))
+        city, postal_code = rng.choice(CITIES)
+        months = len(self.periods)
+        hired = 0 if rng.random() < 0.6 else rng.randrange(months)
+        left = months if rng.random() < 0.85 else rng.randint(hired + 1, months)
+        return {
+            'party_id': self.employer_id + 1 + number,
+            'first_name': first_name,
+            'last_name': last_name,
+            'gender': gender,
+            'date_of_birth': date_of_birth,
+            'city': city,
+            'postal_code': postal_code,
+            'street': rng.choice(STREETS),
+            'number': str(rng.randint(1, 200)),
+            'hired': hired,
+            'left': left,
+            # log-normal around the CSV median salary
+            'salary': Decimal(self.profile['salary'] * Decimal(rng.lognormvariate(0, 0.35))).quantize(TWO_PLACES),
+        }
+
+    def _party_rows(self, employer, insured):
+        """Rows of every party-level table, keyed by writer name."""
+        rows = {name: [] for name in ('person', 'organization', 'address', 'identifier')}
+        employer_id = employer['party_id']
+        rows['organization'].append((
+            employer_id, employer_id, employer['name'],
+            f"{employer['street']} {employer['number']}, {employer['city']}",
+            f"210{employer_id % 10 ** 7:07d}", f"info{employer_id}@example.com",
+        ))
+        rows['identifier'] += [
+            (employer_id * 8 + ID_AFM, employer_id, make_afm(80_000_000 + employer_id), ID_AFM),
+            (employer_id * 8 + ID_AME, employer_id, make_ame(employer_id), ID_AME),
+        ]
+        for person in [employer] + insured:
+            rows['address'].append((
+                person['party_id'], person['party_id'], person['street'], person['number'],
+                person['city'], 'Greece', person['postal_code'],
+            ))
+        for person in insured:
+            party_id = person['party_id']
+            rows['person'].append((
+                party_id, party_id, person['first_name'], person['last_name'],
+                person['date_of_birth'], person['gender'],
+            ))
+            rows['identifier'] += [
+                (party_id * 8 + ID_AMA, party_id, make_ama(party_id), ID_AMA),
+                (party_id * 8 + ID_AMKA, party_id, person['amka'], ID_AMKA),
+                (party_id * 8 + ID_AFM, party_id, make_afm(10_000_000 + party_id), ID_AFM),
+                (party_id * 8 + ID_ADT, party_id, f"A{'BEHIKMNOPTXZ'[party_id % 12]}{party_id % 10 ** 6:06d}", ID_ADT),
+            ]
+        return rows
+
+    # Contributions -----------------------------------------------------------
+
+    def _rate(self, kpk, year, month):
+        rates = self.catalog.kpk_rates[kpk]
+        rate = self.catalog.kpk_rate(kpk, year * 100 + month)
+        # Periods older than the first known rate use the oldest one
+        return (rate or rates[-1])[3]
+
+    def _contribution_lines(self, person):
+        """Yield (period index, line, earnings type, days, gross) of an insured."""
+        rng = self.rng
+        salary = person['salary']
+        bonuses = self.profile['bonuses']
+        for period_index in range(person['hired'], person['left']):
+            year, month = self.periods[period_index]
+            if month == 1 and period_index > person['hired']:
+                salary = (salary * Decimal(str(rng.uniform(1.0, 1.05)))).quantize(TWO_PLACES)
+            days = self.profile['days']
+            if period_index == person['hired'] and period_index > 0:
+                days = rng.randint(1, days)
+            yield period_index, 0, 1, days, salary
+            for line, (earnings_type, (bonus_month, ratio)) in enumerate(sorted(bonuses.items()), start=1):
+                if month == bonus_month and line < LINES_PER_MONTH:
+                    yield period_index, line, earnings_type, 0, (salary * ratio).quantize(TWO_PLACES)
+
+    def _contribution_rows(self, employer, person, party_pk, account_pk, monthly_totals):
+        rows = []
+        balance_total = Decimal('0.00')
+        for period_index, line, earnings_type, days, gross in self._contribution_lines(person):
+            year, month = self.periods[period_index]
+            rate = self._rate(employer['kpk'], year, month)
+            total = (gross * rate / 100).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+            balance = total if (year, month) > self.paid_until else Decimal('0.00')
+            row_id = self.line_id(person['party_id'], period_index, line)
+            rows.append({
+                'id': row_id,
+                'account': account_pk,
+                'description': f'APD Submission {month:02d}/{year}',
+                'type': 'APD',
+                'obligation_description': f'Contribution {month:02d}/{year}',
+                'obligation_type': 'CONTRIB',
+                'month': month,
+                'reference_month': month,
+                'year': year,
+                'rf_code': f'RF91{year}{month:02d}{row_id:010d}',
+                'amount': total,
+                'balance': balance,
+                'party': party_pk,
+                'insurance_id': person['party_id'],
+                'employer_id': employer['party_id'],
+                'branch_code': int(employer['kpk']),
+                'days': days,
+                'start_date': timezone.make_aware(datetime(year, month, 1)),
+                'end_date': timezone.make_aware(datetime(year, month, calendar.monthrange(year, month)[1])),
+                'earnings_type': earnings_type,
+                'gross': gross,
+            })
+            balance_total += balance
+            monthly_totals[period_index] = monthly_totals.get(period_index, Decimal('0.00')) + total
+        return rows, balance_total
+
+    def _employer_rows(self, employer, account_pks, monthly_totals):
+        """APD obligations per month plus (sometimes) KEAO debts, per account type."""
+        rng = self.rng
+        employer_id = employer['party_id']
+        rows = {ACCOUNT_TYPE_CURRENT: [], ACCOUNT_TYPE_SETTLED: [], ACCOUNT_TYPE_UNSETTLED: []}
+
+        def obligation(account_type, period_index, line, description, obligation_type, amount, balance):
+            year, month = self.periods[period_index]
+            row_id = self.line_id(employer_id, period_index, line)
+            rows[account_type].append({
+                'id': row_id,
+                'account': account_pks[account_type],
+                'description': description,
+                'type': 'KEAO' if account_type != ACCOUNT_TYPE_CURRENT else 'APD',
+                'obligation_description': description,
+                'obligation_type': obligation_type,
+                'month': month,
+                'reference_month': month,
+                'year': year,
+                'rf_code': f'RF91{year}{month:02d}{row_id:010d}',
+                'amount': amount,
+                'balance': balance,
+            })
+
+        for period_index, amount in sorted(monthly_totals.items()):
+            year, month = self.periods[period_index]
+            balance = amount if (year, month) > self.paid_until else Decimal('0.00')
+            obligation(ACCOUNT_TYPE_CURRENT, period_index, 0, f'APD {month:02d}/{year}', 'CONTRIB', amount, balance)
+
+        months = len(self.periods)
+        if monthly_totals and rng.random() < 0.2:
+            # Settlement plan: monthly installments, the recent ones still open
+            count = rng.randint(6, 24)
+            first = rng.randrange(max(1, months - count))
+            installment = Decimal(str(rng.uniform(50, 800))).quantize(TWO_PLACES)
+            for number, period_index in enumerate(range(first, min(first + count, months)), start=1):
+                year, month = self.periods[period_index]
+                balance = installment if (year, month) > self.paid_until else Decimal('0.00')
+                obligation(ACCOUNT_TYPE_SETTLED, period_index, 1, f'Installment {number} (Settlement Plan)',
+                           'SETTLED_DEBT', installment, balance)
+        if monthly_totals and rng.random() < 0.25:
+            for period_index in sorted(rng.sample(range(months), min(months, rng.randint(1, 4)))):
+                amount = Decimal(str(rng.uniform(50, 2000))).quantize(TWO_PLACES)
+                obligation(ACCOUNT_TYPE_UNSETTLED, period_index, 2, 'KEAO Natural Charges', 'KEAO_DEBT',
+                           amount, amount)
+        return rows
+
+    # Writing -----------------------------------------------------------------
+
+    def _users_and_clients(self, parties):
+        """Create a login (User + Client) per party. Returns {party_id: client pk}."""
+        usernames = {f"syn{party['party_id']}": party for party in parties}
+        User.objects.bulk_create([
+            User(username=username, password=self.password_hash, email=f"{username}@example.com",
+                 first_name=party.get('first_name', ''), last_name=party.get('last_name', ''))
+            for username, party in usernames.items()
+        ], ignore_conflicts=True)
+        user_pks = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+
+        Client.objects.bulk_create([
+            Client(user_id=user_pks[username], client_id=party['party_id'],
+                   name=party.get('name') or f"{party['first_name']} {party['last_name']}",
+                   address=f"{party['street']} {party['number']}, {party['city']}",
+                   phone=f"69{party['party_id'] % 10 ** 8:08d}", email=f"{username}@example.com",
+                   insurance_id=f"SYN-{party['party_id']}")
+            for username, party in usernames.items()
+        ], ignore_conflicts=True)
+        return dict(
+            Client.objects.filter(client_id__in=[party['party_id'] for party in parties])
+            .values_list('client_id', 'pk')
+        )
+
+    def run(self):
+        """Generate and write the block. Returns {'parties': n, 'lines': n}."""
+        employer = self._employer()
+        insured = [self._insured(number) for number in range(self.insured_per_employer)]
+        for person in insured:
+            person['amka'] = make_amka(person['date_of_birth'], person['party_id'])
+        parties = [employer] + insured
+        writers = _entity_writers()
+        lines = 0
+
+        with transaction.atomic():
+            # 1. Logins, parties and roles
+            client_pks = self._users_and_clients(parties)
+            party_pks = writers['party'].write(
+                [(employer['party_id'], client_pks[employer['party_id']], 'ORGANIZATION', employer['name'],
+                  'AME', make_ame(employer['party_id']))] +
+                [(person['party_id'], client_pks[person['party_id']], 'PERSON',
+                  f"{person['first_name']} {person['last_name']}", 'AMKA', person['amka'])
+                 for person in insured]
+            )
+            role_pks = writers['role'].write(
+                [(employer['party_id'], party_pks[employer['party_id']], ROLE_EMPLOYER)] +
+                [(person['party_id'], party_pks[person['party_id']], ROLE_INSURED) for person in insured]
+            )
+
+            # 2. Persons, organization, addresses and identifiers
+            for name, rows in self._party_rows(employer, insured).items():
+                writers[name].write([(row[0], party_pks[row[1]]) + tuple(row[2:]) for row in rows])
+
+            # 3. Employment relationships
+            writers['relationship'].write([
+                (person['party_id'], party_pks[person['party_id']], RELATIONSHIP_EMPLOYMENT,
+                 role_pks[employer['party_id']], role_pks[person['party_id']],
+                 date(*self.periods[person['hired']], 1),
+                 OPEN_ENDED if person['left'] == len(self.periods)
+                 else date(*self.periods[person['left'] - 1], 28))
+                for person in insured
+            ])
+
+            # 4. Contributions, written in batches into the insured's CONTRIB account
+            account_type_pks = dict(AccountType.objects.values_list('account_type_id', 'pk'))
+            insured_accounts = [
+                (self.account_id(person['party_id'], ACCOUNT_TYPE_CURRENT), role_pks[person['party_id']],
+                 account_type_pks[ACCOUNT_TYPE_CURRENT], Decimal('0.00'))
+                for person in insured
+            ]
+            account_pks = writers['account'].write(insured_accounts)
+            contribution = contribution_writers(CREATED_BY)
+            monthly_totals = {}
+            balances = {}
+            pending = []
+            for person in insured:
+                account_id = self.account_id(person['party_id'], ACCOUNT_TYPE_CURRENT)
+                rows, balance = self._contribution_rows(
+                    employer, person, party_pks[person['party_id']], account_pks[account_id], monthly_totals,
+                )
+                balances[account_id] = balance
+                pending += rows
+                while len(pending) >= self.batch_size:
+                    write_contributions(contribution, pending[:self.batch_size])
+                    lines += self.batch_size
+                    pending = pending[self.batch_size:]
+            if pending:
+                write_contributions(contribution, pending)
+                lines += len(pending)
+
+            # 5. Employer accounts and their obligations
+            employer_accounts = {
+                account_type: self.account_id(employer['party_id'], account_type)
+                for account_type in (ACCOUNT_TYPE_CURRENT, ACCOUNT_TYPE_SETTLED, ACCOUNT_TYPE_UNSETTLED)
+            }
+            employer_account_pks = writers['account'].write([
+                (account_id, role_pks[employer['party_id']], account_type_pks[account_type], Decimal('0.00'))
+                for account_type, account_id in employer_accounts.items()
+            ])
+            employer_rows = self._employer_rows(
+                employer,
+                {account_type: employer_account_pks[account_id] for account_type, account_id in employer_accounts.items()},
+                monthly_totals,
+            )
+            for account_type, rows in employer_rows.items():
+                for batch in _batches(rows, self.batch_size):
+                    write_obligations(contribution, batch)
+                balances[employer_accounts[account_type]] = sum((row['balance'] for row in rows), Decimal('0.00'))
+
+            # 6. Account balances (signals are bypassed)
+            account_rows = [
+                (account_id, role_pks[person['party_id']], account_type_pks[ACCOUNT_TYPE_CURRENT], balances[account_id])
+                for person in insured
+                for account_id in [self.account_id(person['party_id'], ACCOUNT_TYPE_CURRENT)]
+            ] + [
+                (account_id, role_pks[employer['party_id']], account_type_pks[account_type], balances[account_id])
+                for account_type, account_id in employer_accounts.items()
+            ]
+            account_pks = writers['account'].write(account_rows)
+            writers['account_balance'].write([
+                (row[0], account_pks[row[0]], row[3]) for row in account_rows
+            ])
+            sync_balance_journal(account_pks.values(), source='LOAD')
+
+        return {'parties': len(parties), 'lines': lines}
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def generate_employer_block(index, seed, insured_per_employer, until, years, batch_size=5000):
+    """Generate employer block `index`. Entry point of the worker processes."""
+    generator = EmployerGenerator(
+        index, seed, insured_per_employer, month_periods(until, years),
+        _profile(), _password_hash(), batch_size=batch_size,
+    )
+    return generator.run()
+
+
+_profile_cache = {}
+
+
+def _profile():
+    if 'profile' not in _profile_cache:
+        _profile_cache['profile'] = contribution_profile()
+    return _profile_cache['profile']
+
+
+def _password_hash():
+    # Hashing is deliberately slow; every synthetic login shares one hash
+    if 'password' not in _profile_cache:
+        _profile_cache['password'] = make_password(SYNTHETIC_PASSWORD)
+    return _profile_cache['password']
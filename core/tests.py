@@ -1,3 +1,1244 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta
+from importlib import import_module
+from decimal import Decimal
+from io import BytesIO, StringIO
+from itertools import islice
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.apps import apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.db.models import OuterRef, Sum
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from . import accrual, apd, employers, fragments, journal, payments, pensions, reconciliation, roles, rollups
+from .calculator import calculate_contribution, kpk_code
+from .catalog import CodeCatalog, get_code_catalog, merge_intervals
+from .database import iter_rows, server_side_cursors
+from .exports import EXPORT_HEADER, iter_history_rows
+from .ledger import (
+    ACCOUNT_TYPE_CURRENT, get_debt_summary, ledger_rows, ledger_totals, obligations_ledger, refresh_debt_summary
+)
+from .loaders import ContributionLoader, parse_contribution_csv
+from .models import (
+    Account, AccountBalance, Address, ApdSubmission, BalanceCheckpoint, BalanceJournalEntry, BankStatement,
+    Client, ContributionRollup, EmployerDebtSummary, IdSequence, InsuranceContribution, InsuranceDaysAccrual,
+    LatestContribution, ObligationBalance, Organization, Party, PartyIdentifier, PartyRole, Payment,
+    PensionProjection, ReconciliationException, TransactionBalance, TransactionObligation
+)
+from .prefill import EMPLOYEE_NOT_FOUND, PREFILL_MAX_AMAS, ama_identifiers
+from .synthetic import FIRST_PARTY_ID, ID_AME, ROLE_INSURED, make_ama
+from .validity import OUT_OF_PERIOD, UNKNOWN, VALID, ValidityIndex
+
+
+def generate_dataset(employers=1, insured=2, years=1, until=202510):
+    """A small synthetic dataset (core/synthetic.py) with every summary built."""
+    call_command(
+        'generate_dataset', employers=employers, insured=insured, years=years, until=until, stdout=StringIO(),
+    )
+
+
+def employer_party_id(index, insured=2):
+    """Business party_id of synthetic employer `index`; its employees follow it."""
+    return FIRST_PARTY_ID + index * (insured + 1)
+
+
+def login(test, party_id):
+    """Log a synthetic party's user in, with URLs reversed in English (LANGUAGE_CODE has no URL prefix)."""
+    test.client.force_login(User.objects.get(username=f"syn{party_id}"))
+    test.enterContext(translation.override('en'))
+
+
+class DatasetTestCase(TestCase):
+    """Tests reading one synthetic employer with two insured employees."""
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_dataset()
+
+    def insured_contribution(self):
+        """The latest contribution of an insured party."""
+        return (
+            InsuranceContribution.objects
+            .filter(party_id__partyrole__role_type_id=ROLE_INSURED)
+            .order_by('-end_date', '-pk').first()
+        )
+
+    def copy_contribution(self, contribution, **values):
+        """Save a copy of a contribution under new ids, with `values` assigned as given."""
+        last_id = InsuranceContribution.objects.order_by('-insurance_contribution_id').first()
+        contribution.pk = None
+        contribution.insurance_contribution_id = last_id.insurance_contribution_id + 1
+        contribution.uuid = uuid.uuid4()
+        for field, value in values.items():
+            setattr(contribution, field, value)
+        contribution.save()
+        return contribution
+
+
+class LatestContributionTests(DatasetTestCase):
+
+    def test_save_with_naive_datetimes(self):
+        contribution = self.insured_contribution()
+        party_pk, latest_pk = contribution.party_id_id, contribution.pk
+        days = InsuranceDaysAccrual.objects.get(party_id=party_pk).total_days
+
+        copy = self.copy_contribution(
+            contribution, start_date=datetime(2025, 11, 1), end_date=datetime(2025, 11, 30),
+        )
+
+        pointer = LatestContribution.objects.get(party_id=party_pk)
+        self.assertEqual(pointer.contribution_id, copy.pk)
+        accrual = InsuranceDaysAccrual.objects.get(party_id=party_pk)
+        self.assertEqual(accrual.total_days, days + copy.insurance_days)
+
+        copy.delete()
+        pointer = LatestContribution.objects.get(party_id=party_pk)
+        self.assertEqual(pointer.contribution_id, latest_pk)
+        accrual = InsuranceDaysAccrual.objects.get(party_id=party_pk)
+        self.assertEqual(accrual.total_days, days)
+        self.assertTrue(all(value > 0 for value in accrual.days_by_year.values()))
+
+    def test_older_contribution_keeps_pointer(self):
+        contribution = self.insured_contribution()
+        latest_pk = contribution.pk
+        self.copy_contribution(contribution, start_date=datetime(2020, 1, 1), end_date='2020-01-31 00:00:00')
+        self.assertEqual(LatestContribution.objects.get(party_id=contribution.party_id_id).contribution_id, latest_pk)
+
+
+class ContributionRollupTests(DatasetTestCase):
+
+    def assertRollups(self, party_pk):
+        """The party's rollups are its contributions summed per (year, month, earning type)."""
+        expected = {}
+        for contribution in InsuranceContribution.objects.filter(party_id=party_pk):
+            key = (contribution.start_date.year, contribution.start_date.month, contribution.earning_type_id)
+            count, days, gross, total = expected.get(key, (0, 0, 0, 0))
+            expected[key] = (
+                count + 1, days + contribution.insurance_days,
+                gross + contribution.gross_earnings, total + contribution.total_contribution,
+            )
+        stored = {
+            (rollup.year, rollup.month, rollup.earning_type_id): (
+                rollup.contribution_count, rollup.insurance_days, rollup.gross_earnings, rollup.total_contribution,
+            )
+            for rollup in ContributionRollup.objects.filter(party_id=party_pk)
+        }
+        self.assertEqual(stored, expected)
+
+    def test_save_refreshes_the_rollups(self):
+        contribution = self.insured_contribution()
+        party_pk = contribution.party_id_id
+        rollups.contribution_rollups(party_pk)
+        self.assertRollups(party_pk)
+
+        contribution.gross_earnings += Decimal('100.00')
+        contribution.total_contribution += Decimal('25.00')
+        contribution.save()
+        self.assertRollups(party_pk)
+
+        # A new month and earning type
+        copy = self.copy_contribution(
+            contribution, start_date=datetime(2020, 1, 1), end_date=datetime(2020, 1, 31), earning_type_id=99,
+        )
+        self.assertRollups(party_pk)
+        self.assertTrue(ContributionRollup.objects.filter(party_id=party_pk, year=2020, earning_type_id=99).exists())
+
+        copy.delete()
+        self.assertRollups(party_pk)
+        self.assertFalse(ContributionRollup.objects.filter(party_id=party_pk, year=2020).exists())
+
+    def test_rebuild(self):
+        ContributionRollup.objects.all().delete()
+        rollups.rebuild_contribution_rollups(batch_size=3)
+        for party_pk in InsuranceContribution.objects.values_list('party_id', flat=True).distinct():
+            self.assertRollups(party_pk)
+
+
+class RoleCacheTests(DatasetTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.party = Party.objects.select_related('client_id__user').get(party_id=employer_party_id(0) + 1)
+        self.user = self.party.client_id.user
+        self.other_user = User.objects.create(username='other')
+
+    def other_client(self):
+        return Client.objects.create(
+            user=self.other_user, client_id=1, name='Other', address='', phone='', email='other@example.com',
+            insurance_id='OTHER',
+        )
+
+    def warm(self):
+        for user in (self.user, self.other_user):
+            roles.get_party_context(user)
+
+    def assertRoles(self, user, other_user):
+        """The cached roles of both users are the ones the database resolves now."""
+        self.assertEqual(roles.get_party_context(self.user).role_code, user)
+        self.assertEqual(roles.get_party_context(self.other_user).role_code, other_user)
+
+    def test_roles_are_cached(self):
+        self.assertEqual(roles.get_party_context(self.user).party_pk, self.party.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(roles.get_party_context(self.user).role_code, 'INS')
+
+    def test_client_user_change(self):
+        self.warm()
+        client = self.party.client_id
+        client.user = self.other_user
+        client.save()
+        self.assertRoles(None, 'INS')
+
+    def test_party_client_change(self):
+        self.warm()
+        self.party.client_id = self.other_client()
+        self.party.save()
+        self.assertRoles(None, 'INS')
+
+    def test_party_role_party_change(self):
+        other_party = Party.objects.create(
+            client_id=self.other_client(), party_id=1, party_type='PERSON', display_name='Other',
+            distinct_type='AMKA', distinct_value='1',
+        )
+        self.warm()
+        role = PartyRole.objects.get(party_id=self.party)
+        role.party_id = other_party
+        role.save()
+        self.assertRoles(None, 'INS')
+
+    def test_other_party_edits_keep_the_cache(self):
+        self.warm()
+        self.party.display_name = 'Renamed'
+        self.party.save()
+        with self.assertNumQueries(0):
+            roles.get_party_context(self.user)
+
+
+class BatchPrefillTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_dataset(employers=2)
+
+    def setUp(self):
+        login(self, employer_party_id(0))
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content).decode()
+        return {line['ama']: line for line in map(json.loads, body.splitlines())}
+
+    def test_all_employees(self):
+        lines = self.lines(self.client.get(reverse('get_last_contributions')))
+        employees = [make_ama(employer_party_id(0) + offset) for offset in (1, 2)]
+        self.assertEqual(sorted(lines), sorted(employees))
+        self.assertTrue(all('gross_earnings' in line for line in lines.values()))
+
+    def test_other_employers_employees_not_found(self):
+        own, other = make_ama(employer_party_id(0) + 1), make_ama(employer_party_id(1) + 1)
+        response = self.client.post(
+            reverse('get_last_contributions'), {'amas': [own, other]}, content_type='application/json',
+        )
+        lines = self.lines(response)
+        self.assertIn('gross_earnings', lines[own])
+        self.assertEqual(lines[other], {'ama': other, 'error': EMPLOYEE_NOT_FOUND})
+
+    def test_too_many_amas(self):
+        response = self.client.post(
+            reverse('get_last_contributions'), {'amas': [str(n) for n in range(PREFILL_MAX_AMAS + 1)]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class DebtSummaryTests(DatasetTestCase):
+
+    def test_missing_summary_is_computed(self):
+        employer = Party.objects.get(party_id=employer_party_id(0))
+        EmployerDebtSummary.objects.all().delete()
+
+        debts = get_debt_summary(employer)
+
+        accounts = Account.objects.filter(party_role_id__party_id=employer)
+        balance = sum(accounts.values_list('account_balance', flat=True))
+        self.assertGreater(balance, 0)
+        self.assertEqual(debts['total'], float(balance))
+        self.assertTrue(EmployerDebtSummary.objects.filter(party_id=employer).exists())
+
+    def test_party_without_accounts(self):
+        insured = Party.objects.get(party_id=employer_party_id(0) + 1)
+        Account.objects.filter(party_role_id__party_id=insured).delete()
+        self.assertEqual(get_debt_summary(insured)['total'], 0)
+
+
+class PaymentTests(DatasetTestCase):
+
+    def setUp(self):
+        self.account = Account.objects.get(
+            party_role_id__party_id__party_id=employer_party_id(0),
+            account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT,
+        )
+        # Two open obligations, oldest first
+        self.obligations = list(
+            ObligationBalance.objects
+            .filter(obligation_id__transaction_id__account_id=self.account, balance__gt=0)
+            .order_by(*payments.ALLOCATION_ORDER).select_related('obligation_id')
+        )
+        self.assertEqual(len(self.obligations), 2)
+
+    def balances(self):
+        self.account.refresh_from_db()
+        return [balance.balance for balance in ObligationBalance.objects.filter(
+            pk__in=[obligation.pk for obligation in self.obligations]).order_by(*payments.ALLOCATION_ORDER)]
+
+    def assertJournalMatches(self):
+        counts = journal.check_balance_journal()
+        self.assertEqual((counts['account_drift'], counts['obligation_drift']), (0, 0))
+        self.assertEqual(journal.account_balance(self.account), self.account.account_balance)
+
+    def test_fifo_allocation(self):
+        first, second = [obligation.balance for obligation in self.obligations]
+        payment = payments.post_payment(self.account, first + Decimal('10.00'))
+
+        self.assertEqual(self.balances(), [Decimal('0.00'), second - Decimal('10.00')])
+        self.assertEqual(payment.allocated_amount, first + Decimal('10.00'))
+        self.assertEqual(payment.allocations.count(), 2)
+        self.assertEqual(self.account.account_balance, first + second - payment.amount)
+        self.assertEqual(AccountBalance.objects.get(account_id=self.account).balance, self.account.account_balance)
+        self.assertJournalMatches()
+
+    def test_rf_code_allocation(self):
+        first, second = [obligation.balance for obligation in self.obligations]
+        rf_code = self.obligations[1].obligation_id.rf_code
+        payments.post_payment(self.account, Decimal('100.00'), rf_code=rf_code)
+        self.assertEqual(self.balances(), [first, second - Decimal('100.00')])
+        self.assertJournalMatches()
+
+    def test_overpayment_is_a_credit(self):
+        total = sum(obligation.balance for obligation in self.obligations)
+        payment = payments.post_payment(self.account, total + Decimal('50.00'))
+
+        self.assertEqual(self.balances(), [Decimal('0.00'), Decimal('0.00')])
+        self.assertEqual(payment.allocated_amount, total)
+        self.assertEqual(self.account.account_balance, Decimal('-50.00'))
+        credit = TransactionBalance.objects.get(transaction_id=payment.account_transaction_id)
+        self.assertEqual(credit.balance, Decimal('-50.00'))
+        self.assertJournalMatches()
+
+    def test_unknown_rf_code_is_a_credit(self):
+        payment = payments.post_payment(self.account, Decimal('20.00'), rf_code='RF00UNKNOWN')
+        self.assertEqual(payment.allocated_amount, 0)
+        self.assertEqual(self.balances(), [obligation.balance for obligation in self.obligations])
+        self.assertJournalMatches()
+
+    def test_invalid_payments(self):
+        for amount in ('0', '-5', 'ten'):
+            with self.assertRaises(payments.PaymentError):
+                payments.post_payment(self.account, amount)
+        with self.assertRaises(payments.PaymentError):
+            payments.post_payment(0, '10')
+        with self.assertRaises(payments.PaymentError):
+            payments.post_payment(self.account.pk + 1000, '10')
+        self.assertFalse(Payment.objects.exists())
+
+    def test_guarded_deduction(self):
+        obligation = self.obligations[0]
+        with self.assertRaises(payments.ConcurrentUpdate):
+            with transaction.atomic():
+                payments._deduct(ObligationBalance, {obligation.pk: obligation.balance + Decimal('0.01')})
+        obligation.refresh_from_db()
+        self.assertEqual(obligation.balance, self.obligations[0].balance)
+
+    def test_concurrent_update_is_retried(self):
+        deduct = payments._deduct
+        calls = []
+
+        def conflict_once(*args, **kwargs):
+            calls.append(args[0])
+            if len(calls) == 1:
+                raise payments.ConcurrentUpdate("conflict")
+            return deduct(*args, **kwargs)
+
+        first = self.obligations[0].balance
+        with mock.patch.object(payments, '_deduct', side_effect=conflict_once):
+            payments.post_payment(self.account, first)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(self.balances()[0], Decimal('0.00'))
+        self.assertJournalMatches()
+
+    def test_retries_give_up(self):
+        with mock.patch.object(payments, '_deduct', side_effect=payments.ConcurrentUpdate("conflict")):
+            with self.assertRaises(payments.ConcurrentUpdate):
+                payments.post_payment(self.account, '10')
+        self.assertFalse(Payment.objects.exists())
+
+    def test_reserve_ids(self):
+        self.assertEqual(payments.reserve_ids('test', 3, first=10), range(10, 13))
+        self.assertEqual(payments.reserve_ids('test', 2, first=10), range(13, 15))
+        self.assertEqual(IdSequence.objects.get(name='test').next_id, 15)
+
+    def test_payment_ids_are_consecutive(self):
+        posted = payments.post_payments([{'account': self.account.pk, 'amount': '1.00'}] * 3)
+        ids = [payment.payment_id for payment in posted]
+        self.assertEqual(ids, list(range(ids[0], ids[0] + 3)))
+        self.assertEqual(len(set(TransactionBalance.objects.filter(
+            transaction_id__in=[payment.account_transaction_id_id for payment in posted]
+        ).values_list('transaction_balance_id', flat=True))), 3)
+
+    def test_payment_screen_is_read_only(self):
+        payments.post_payment(self.account, Decimal('100.00'), rf_code=None, reference='BANK-1')
+        login(self, employer_party_id(0))
+        response = self.client.post(reverse('payments'), {'account_type': ACCOUNT_TYPE_CURRENT, 'amount': '500'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'name="amount"')
+        self.assertContains(response, 'BANK-1')
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(self.balances(), [self.obligations[0].balance - Decimal('100.00'), self.obligations[1].balance])
+
+
+class BalanceJournalTests(DatasetTestCase):
+
+    def setUp(self):
+        self.employer = Party.objects.get(party_id=employer_party_id(0))
+        self.account = Account.objects.get(
+            party_role_id__party_id=self.employer, account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT,
+        )
+
+    def assertNoDrift(self):
+        counts = journal.check_balance_journal()
+        self.assertEqual((counts['account_drift'], counts['obligation_drift']), (0, 0))
+
+    def test_generated_balances_are_journaled(self):
+        self.assertNoDrift()
+        stored = dict(ObligationBalance.objects.values_list('obligation_id', 'balance'))
+        self.assertEqual(journal.balances(journal.OBLIGATION, stored), stored)
+
+    def test_balances_as_of(self):
+        before = timezone.now()
+        payments.post_payment(self.account, Decimal('100.00'))
+        self.assertEqual(journal.account_balance(self.account, as_of=before), Decimal('1301.26'))
+        self.assertEqual(journal.account_balance(self.account), Decimal('1201.26'))
+
+    def test_checkpoints(self):
+        self.assertGreater(BalanceCheckpoint.objects.count(), 0)
+        # Nothing new to checkpoint
+        self.assertEqual(journal.checkpoint_balances(lag=timedelta(0)), 0)
+
+        payments.post_payment(self.account, Decimal('100.00'))
+        self.assertEqual(journal.checkpoint_balances(lag=timedelta(0)), 2)
+        payments.post_payment(self.account, Decimal('50.00'))
+        self.assertEqual(journal.account_balance(self.account), Decimal('1151.26'))
+        self.assertNoDrift()
+
+    def test_checkpoints_wait_for_open_transactions(self):
+        payments.post_payment(self.account, Decimal('100.00'))
+        # A transaction that started (and wrote its entry) before the
+        # checkpoint runs, and commits after it
+        started = timezone.now()
+        with mock.patch.object(journal, 'oldest_open_transaction', return_value=started):
+            self.assertEqual(journal.checkpoint_balances(lag=timedelta(0)), 2)
+        self.assertLessEqual(BalanceCheckpoint.objects.latest('as_of').as_of, started)
+        journal.append_entries(
+            [(self.account.pk, None, Decimal('-25.00'))], 'TEST', entry_date=started + timedelta(microseconds=1),
+        )
+        self.assertEqual(journal.account_balance(self.account), Decimal('1176.26'))
+        journal.checkpoint_balances(lag=timedelta(0))
+        self.assertEqual(journal.account_balance(self.account), Decimal('1176.26'))
+
+    def test_balance_expression(self):
+        payments.post_payment(self.account, Decimal('700.00'))
+        journal.checkpoint_balances(lag=timedelta(0))
+        payments.post_payment(self.account, Decimal('1.00'))
+        annotated = dict(
+            ObligationBalance.objects.annotate(
+                journal_balance=journal.balance_expression(journal.OBLIGATION, OuterRef('obligation_id')),
+            ).values_list('obligation_id', 'journal_balance')
+        )
+        self.assertEqual(annotated, journal.balances(journal.OBLIGATION, annotated))
+
+    def test_debt_screens_read_the_journal(self):
+        role = self.account.party_role_id_id
+        # A stored balance changed without the journal is not what the screens show
+        ObligationBalance.objects.filter(obligation_id__transaction_id__account_id=self.account).update(balance=0)
+        Account.objects.filter(pk=self.account.pk).update(account_balance=0)
+
+        balances = obligations_ledger(role, account_type_id=ACCOUNT_TYPE_CURRENT, positive_only=True)
+        self.assertEqual([row['amount'] for row in ledger_rows(balances)], [Decimal('650.63')] * 2)
+        self.assertEqual(ledger_totals(balances), {'total': Decimal('1301.26'), 'count': 2})
+        refresh_debt_summary(self.employer.pk)
+        self.assertEqual(get_debt_summary(self.employer)['current'], 1301.26)
+
+        counts = journal.check_balance_journal()
+        self.assertEqual((counts['account_drift'], counts['obligation_drift']), (1, 2))
+
+    def test_obligation_edits_are_journaled(self):
+        obligation = ObligationBalance.objects.filter(obligation_id__transaction_id__account_id=self.account).first()
+        obligation.balance = Decimal('600.00')
+        obligation.save()
+        self.assertEqual(journal.obligation_balance(obligation.obligation_id_id), Decimal('600.00'))
+        # A plain account save is not journaled until its path syncs it
+        self.account.account_balance = Decimal('1000.00')
+        self.account.save()
+        self.assertEqual(journal.check_balance_journal()['account_drift'], 1)
+        journal.sync_balance_journal([self.account.pk], source='EDIT')
+        self.assertEqual(journal.account_balance(self.account), Decimal('1000.00'))
+        self.assertNoDrift()
+
+    def test_migration_journals_stored_balances(self):
+        BalanceCheckpoint.objects.all().delete()
+        BalanceJournalEntry.objects.filter(source='LOAD').delete()
+        migration = import_module('core.migrations.0021_journal_stored_balances')
+        migration.journal_stored_balances(apps, None)
+        self.assertNoDrift()
+        # Running it again adds nothing
+        count = BalanceJournalEntry.objects.count()
+        migration.journal_stored_balances(apps, None)
+        self.assertEqual(BalanceJournalEntry.objects.count(), count)
+
+
+class CodeValidityTests(SimpleTestCase):
+
+    # kad|eid|kpk|from|to: adjacent intervals, a gap, overlapping intervals,
+    # a closed one and a line without from/to (always valid)
+    mapping = [
+        '0001|000001|101|201301|201306',
+        '0001|000001|101|201307|201312',
+        '0001|000001|101|201501|999912',
+        '0002|000001|101|201301|201406',
+        '0002|000001|101|201405|201412',
+        '0003|000003|103|201301|201312',
+        '0002|000002|102',
+    ]
+
+    def setUp(self):
+        texts_dir = self.enterContext(tempfile.TemporaryDirectory())
+        files = {
+            'dn_kad.txt': ['0001|A', '0002|B', '0003|C'],
+            'dn_eid.txt': ['000001|A', '000002|B', '000003|C'],
+            'dn_kpk.txt': ['101|A', '102|B', '103|C'],
+            'dn_kadeidkpk.txt': self.mapping,
+        }
+        for filename, lines in files.items():
+            with open(f"{texts_dir}/{filename}", 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        self.catalog = CodeCatalog(texts_dir, None)
+
+    def test_merge_intervals(self):
+        # Adjacent (also across a year) and overlapping intervals merge, gaps stay
+        self.assertEqual(merge_intervals([(201307, 201312), (201301, 201306)]), ((201301, 201312),))
+        self.assertEqual(merge_intervals([(201301, 201312), (201401, 201406)]), ((201301, 201406),))
+        self.assertEqual(merge_intervals([(201301, 201406), (201405, 201412)]), ((201301, 201412),))
+        self.assertEqual(merge_intervals([(201301, 201412), (201302, 201303)]), ((201301, 201412),))
+        self.assertEqual(
+            merge_intervals([(201501, 999912), (201301, 201312)]), ((201301, 201312), (201501, 999912)),
+        )
+
+    def test_catalog_validity(self):
+        self.assertEqual(
+            self.catalog.validity[('0001', '000001', '101')], ((201301, 201312), (201501, 999912)),
+        )
+        self.assertEqual(self.catalog.validity[('0002', '000001', '101')], ((201301, 201412),))
+
+    def test_exists_at_period(self):
+        self.assertTrue(self.catalog.exists(kad='0001'))
+        self.assertTrue(self.catalog.exists(kad='0001', period=201306))
+        self.assertFalse(self.catalog.exists(kad='0001', period=201406))
+        self.assertFalse(self.catalog.exists(kad='0001', period=201212))
+        self.assertTrue(self.catalog.exists(eid='000001', kpk='101', period=201406))
+        self.assertTrue(self.catalog.exists(kpk='102', period=190001))
+        self.assertFalse(self.catalog.exists(kad='0001', eid='000001', kpk='999'))
+
+    def test_lookup_at_period(self):
+        self.assertEqual(self.catalog.lookup('kad', eid='000001'), {'0001', '0002'})
+        self.assertEqual(self.catalog.lookup('kad', eid='000001', period=201406), {'0002'})
+        self.assertEqual(self.catalog.lookup('kad', eid='000001', period=201212), set())
+        self.assertEqual(self.catalog.lookup('kpk', period=201406), {'101', '102'})
+        self.assertEqual(self.catalog.lookup('kpk', period=202001), {'101', '102'})
+        self.assertEqual(self.catalog.lookup('kad', kad='0003', period=201401), set())
+        self.assertEqual(self.catalog.lookup('kad', kad='9999'), set())
+
+    def test_index_check(self):
+        lines = [
+            (('0001', '000001', '101', 201212), OUT_OF_PERIOD),  # before the first interval
+            (('0001', '000001', '101', 201301), VALID),
+            (('0001', '000001', '101', 201312), VALID),  # across the merged adjacent intervals
+            (('0001', '000001', '101', 201406), OUT_OF_PERIOD),  # in the gap
+            (('0001', '000001', '101', 202001), VALID),
+            (('0002', '000001', '101', 201405), VALID),
+            (('0003', '000003', '103', 201401), OUT_OF_PERIOD),  # after the end
+            (('0002', '000002', '102', 190001), VALID),
+            (('0001', '000001', '999', 201301), UNKNOWN),  # unknown code
+            (('9999', '000001', '101', 201301), UNKNOWN),
+            (('0001', '000002', '102', 201301), UNKNOWN),  # known codes, no such combination
+        ]
+        kads, eids, kpks, periods = zip(*(line for line, status in lines))
+        status = ValidityIndex(self.catalog.validity).check(kads, eids, kpks, periods)
+        self.assertEqual(list(status), [expected for line, expected in lines])
+        # The same answers as the catalog
+        for (kad, eid, kpk, period), line_status in zip(zip(kads, eids, kpks, periods), status):
+            expected = (
+                VALID if self.catalog.valid_at(kad, eid, kpk, period)
+                else OUT_OF_PERIOD if self.catalog.exists(kad, eid, kpk)
+                else UNKNOWN
+            )
+            self.assertEqual(line_status, expected)
+
+
+class CodeLookupTests(TestCase):
+
+    query = {'type': 'kpk', 'q': '1', 'limit': '5'}
+
+    def lookup(self, params, **headers):
+        with translation.override('en'):
+            return self.client.get(reverse('code_lookup'), params, **headers)
+
+    def test_etag(self):
+        response = self.lookup(self.query)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        etag = response['ETag']
+
+        # The same query revalidates to a 304 that stays cacheable
+        response = self.lookup(self.query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('public', response['Cache-Control'])
+
+        # Another query has another ETag
+        response = self.lookup({'type': 'kad'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_errors_are_not_cacheable(self):
+        response = self.lookup({'type': 'kpk', 'limit': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+
+class ApdIngestionTests(DatasetTestCase):
+
+    period = 202511
+
+    def setUp(self):
+        self.employer = Party.objects.get(party_id=employer_party_id(0))
+        self.account = Account.objects.get(
+            party_role_id__party_id=self.employer, account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT,
+        )
+        self.enterContext(mock.patch.object(apd, 'APD_UPLOAD_DIR', self.enterContext(tempfile.TemporaryDirectory())))
+
+    def apd_file(self, total=None):
+        """An APD file with one line per employee of the employer, totals at the KPK rate unless given."""
+        employees = range(self.employer.party_id + 1, self.employer.party_id + 3)
+        amas = ama_identifiers().filter(party_id__party_id__in=employees).values_list('identifier_value', flat=True)
+        kpk = kpk_code(InsuranceContribution.objects.filter(employer_id=self.employer.party_id)
+                       .values_list('coverage_package_id', flat=True).first())
+        catalog = get_code_catalog()
+        kad, eid, _ = next(t for t in sorted(catalog.triples) if t[2] == kpk and catalog.valid_at(*t, self.period))
+        lines = StringIO()
+        writer = csv.writer(lines)
+        writer.writerow(apd.APD_COLUMNS)
+        for ama in sorted(amas):
+            gross = Decimal('1500.00')
+            expected = calculate_contribution(gross, kpk, self.period)['total']
+            writer.writerow([ama, kad, eid, kpk, 1, 25, '01/11/2025', '28/11/2025', gross, total or expected])
+        return SimpleUploadedFile('apd.csv', lines.getvalue().encode())
+
+    def posted(self, submission):
+        return InsuranceContribution.objects.filter(
+            insurance_contribution_id__range=(submission.first_line_id, submission.first_line_id + submission.lines_total - 1),
+        )
+
+    def test_upload_is_queued(self):
+        login(self, self.employer.party_id)
+        response = self.client.post(reverse('apd_submission'), {'period': '2025-11', 'apd_file': self.apd_file()})
+        self.assertEqual(response.status_code, 302)
+        submission = ApdSubmission.objects.get(party_id=self.employer)
+        self.assertEqual(submission.state, ApdSubmission.STATE_PENDING)
+
+        status_url = reverse('apd_submission_status', args=[submission.pk])
+        self.assertContains(self.client.get(reverse('apd_submission')), f'data-status-url="{status_url}"')
+        self.assertEqual(self.client.get(status_url).json()['status'], 'Pending')
+
+        call_command('ingest_apd', resume=0, stdout=StringIO())
+        self.assertEqual(self.client.get(status_url).json()['state'], ApdSubmission.STATE_COMPLETED)
+
+    def test_upload_processed_on_request(self):
+        login(self, self.employer.party_id)
+        with mock.patch('core.views.APD_PROCESS_ON_UPLOAD', True):
+            self.client.post(reverse('apd_submission'), {'period': '2025-11', 'apd_file': self.apd_file()})
+        self.assertEqual(ApdSubmission.objects.get(party_id=self.employer).state, ApdSubmission.STATE_COMPLETED)
+
+    def test_ingest(self):
+        submission = apd.ingest(apd.create_submission(self.employer, self.period, self.apd_file()))
+        self.assertEqual(submission.state, ApdSubmission.STATE_COMPLETED)
+        self.assertEqual((submission.lines_posted, submission.employee_count), (2, 2))
+        self.assertEqual(self.posted(submission).count(), 2)
+        # The employer obligation is the file total, in the employer's balance
+        self.assertEqual(journal.account_balance(self.account), Decimal('1301.26') + submission.total_contributions)
+        counts = journal.check_balance_journal()
+        self.assertEqual((counts['account_drift'], counts['obligation_drift']), (0, 0))
+
+    def test_invalid_lines_reject_the_file(self):
+        submission = apd.ingest(apd.create_submission(self.employer, self.period, self.apd_file(total='1.00')))
+        self.assertEqual(submission.state, ApdSubmission.STATE_REJECTED)
+        self.assertEqual(submission.lines_rejected, 2)
+        self.assertEqual(submission.errors.count(), 2)
+        self.assertFalse(self.posted(submission).exists())
+
+    def test_failed_ingestion_resumes(self):
+        submission = apd.create_submission(self.employer, self.period, self.apd_file())
+        write_contributions = apd.write_contributions
+
+        def fail_second_chunk(writers, rows):
+            if apd.write_contributions.call_count > 1:
+                raise RuntimeError('connection lost')
+            return write_contributions(writers, rows)
+
+        with mock.patch.object(apd, 'write_contributions', side_effect=fail_second_chunk):
+            with self.assertRaises(RuntimeError):
+                apd.ingest(submission, chunk_size=1)
+        submission.refresh_from_db()
+        self.assertEqual((submission.state, submission.lines_posted), (ApdSubmission.STATE_FAILED, 1))
+
+        apd.ingest(submission, chunk_size=1)
+        self.assertEqual(submission.state, ApdSubmission.STATE_COMPLETED)
+        self.assertEqual(self.posted(submission).count(), 2)
+
+    def test_submissions_reserve_disjoint_ids(self):
+        first = apd.create_submission(self.employer, self.period, self.apd_file())
+        second = apd.create_submission(self.employer, self.period, self.apd_file())
+        self.assertEqual(first.first_line_id, apd.APD_FIRST_LINE_ID)
+        # The lines, then the employer obligation
+        self.assertEqual(second.first_line_id, first.first_line_id + first.lines_total + 1)
+
+    def test_reservation_starts_after_existing_submissions(self):
+        existing = apd.create_submission(self.employer, self.period, self.apd_file())
+        # A database whose submissions predate the sequence
+        IdSequence.objects.filter(name=apd.APD_ID_SEQUENCE).delete()
+        submission = apd.create_submission(self.employer, self.period, self.apd_file())
+        self.assertEqual(submission.first_line_id, existing.first_line_id + existing.lines_total + 1)
+
+
+class ReconciliationTests(DatasetTestCase):
+
+    def setUp(self):
+        self.account = Account.objects.get(
+            party_role_id__party_id__party_id=employer_party_id(0),
+            account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT,
+        )
+        # Two open obligations of 650.63, oldest first
+        self.obligations = list(
+            ObligationBalance.objects
+            .filter(obligation_id__transaction_id__account_id=self.account, balance__gt=0)
+            .order_by(*payments.ALLOCATION_ORDER).select_related('obligation_id')
+        )
+        self.enterContext(mock.patch.object(
+            reconciliation, 'RECON_UPLOAD_DIR', self.enterContext(tempfile.TemporaryDirectory()),
+        ))
+
+    def statement_file(self):
+        first, second = [obligation.obligation_id.rf_code for obligation in self.obligations]
+        rows = [
+            ('2025-11-03', '650.63', first, 'C'),
+            ('2025-11-03', '100.00', second, 'C'),
+            ('2025-11-04', '600.00', second, 'C'),
+            ('2025-11-04', '5.00', 'RF99000000000001', 'C'),
+            ('2025-11-05', '7.00', '', 'C'),
+            ('2025-11-05', 'abc', first, 'C'),
+            ('2025-11-05', '99.00', first, 'D'),
+        ]
+        lines = StringIO()
+        writer = csv.writer(lines)
+        writer.writerow(['booking_date', 'amount', 'rf_code', 'credit_debit'])
+        writer.writerows(rows)
+        return SimpleUploadedFile('statement.csv', lines.getvalue().encode())
+
+    def statement(self):
+        return reconciliation.create_statement(self.statement_file())
+
+    def upload(self):
+        self.client.force_login(User.objects.create(username='reconciler', is_staff=True))
+        self.enterContext(translation.override('en'))
+        return self.client.post(reverse('reconcile_statement'), {'statement': self.statement_file()})
+
+    def assertReconciled(self, statement):
+        self.assertEqual(statement.state, BankStatement.STATE_COMPLETED)
+        self.assertEqual(statement.lines_total, 6)
+        self.assertEqual(
+            (statement.lines_matched, statement.lines_partial, statement.lines_unmatched), (1, 2, 3),
+        )
+        self.assertEqual(statement.amount_posted, Decimal('1350.63'))
+        self.assertEqual(Payment.objects.filter(created_by=reconciliation.CREATED_BY).count(), 3)
+        self.assertEqual([obligation.balance for obligation in ObligationBalance.objects.filter(
+            pk__in=[obligation.pk for obligation in self.obligations])], [Decimal('0.00')] * 2)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.account_balance, Decimal('-49.37'))
+        counts = journal.check_balance_journal()
+        self.assertEqual((counts['account_drift'], counts['obligation_drift']), (0, 0))
+
+    def test_reconcile(self):
+        statement = reconciliation.reconcile(self.statement())
+        self.assertReconciled(statement)
+        self.assertEqual(
+            dict(statement.exceptions.values_list('line_number', 'reason')),
+            {
+                2: ReconciliationException.REASON_UNDERPAID,
+                3: ReconciliationException.REASON_OVERPAID,
+                4: ReconciliationException.REASON_UNKNOWN_RF,
+                5: ReconciliationException.REASON_NO_RF,
+                6: ReconciliationException.REASON_INVALID,
+            },
+        )
+        # The overpayment saw what the underpayment left open
+        self.assertEqual(statement.exceptions.get(line_number=3).open_balance, Decimal('550.63'))
+
+    def test_upload_is_queued(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['state'], BankStatement.STATE_PENDING)
+
+        call_command('reconcile_statement', resume=0, stdout=StringIO())
+        self.assertReconciled(BankStatement.objects.get(pk=response.json()['pk']))
+
+    def test_failed_upload_reports_the_failure(self):
+        with mock.patch('core.views.RECON_PROCESS_ON_UPLOAD', True), mock.patch.object(
+            reconciliation, 'post_reserved_payments', side_effect=RuntimeError('connection lost'),
+        ):
+            response = self.upload()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(
+            (response.json()['state'], response.json()['error_message']),
+            (BankStatement.STATE_FAILED, 'connection lost'),
+        )
+
+    def test_failed_batch_resumes(self):
+        statement = self.statement()
+        post_reserved_payments = reconciliation.post_reserved_payments
+
+        def fail_second_batch(*args, **kwargs):
+            if reconciliation.post_reserved_payments.call_count > 1:
+                raise RuntimeError('connection lost')
+            return post_reserved_payments(*args, **kwargs)
+
+        with mock.patch.object(reconciliation, 'post_reserved_payments', side_effect=fail_second_batch):
+            with self.assertRaises(RuntimeError):
+                reconciliation.reconcile(statement, batch_size=2)
+        statement.refresh_from_db()
+        self.assertEqual((statement.state, statement.lines_processed), (BankStatement.STATE_FAILED, 2))
+
+        self.assertReconciled(reconciliation.reconcile(statement, batch_size=2))
+
+    def test_retry_reuses_the_reserved_ids(self):
+        post_reserved_payments = reconciliation.post_reserved_payments
+
+        def conflict_once(*args, **kwargs):
+            if reconciliation.post_reserved_payments.call_count == 1:
+                raise payments.ConcurrentUpdate('ObligationBalance: 0 of 1 balances updated')
+            return post_reserved_payments(*args, **kwargs)
+
+        with mock.patch.object(reconciliation, 'post_reserved_payments', side_effect=conflict_once):
+            statement = reconciliation.reconcile(self.statement())
+        self.assertReconciled(statement)
+        # One reservation for the four lines with an RF code, taken before the batch transaction
+        self.assertEqual(IdSequence.objects.get(name='payment').next_id, 5)
+        self.assertEqual(
+            sorted(Payment.objects.values_list('payment_id', flat=True)), [1, 2, 3],
+        )
+
+
+class InsuranceDaysAccrualTests(DatasetTestCase):
+
+    def assertNoDrift(self):
+        counts = accrual.check_insurance_days()
+        self.assertEqual((counts['missing'], counts['stale'], counts['orphaned']), (0, 0, 0))
+        return counts
+
+    def test_generated_accruals_match_the_contributions(self):
+        counts = self.assertNoDrift()
+        parties = InsuranceContribution.objects.values('party_id').distinct().count()
+        self.assertEqual(counts['checked'], parties)
+
+    def test_update_moves_days(self):
+        contribution = self.insured_contribution()
+        party_pk, days = contribution.party_id_id, contribution.insurance_days
+        before = InsuranceDaysAccrual.objects.get(party_id=party_pk)
+        year, branch = str(contribution.start_date.year), str(contribution.coverage_package_id)
+
+        contribution.start_date = contribution.start_date.replace(year=2019)
+        contribution.coverage_package_id = 999
+        contribution.insurance_days = days + 5
+        contribution.save()
+
+        after = InsuranceDaysAccrual.objects.get(party_id=party_pk)
+        self.assertEqual(after.total_days, before.total_days + 5)
+        self.assertEqual(after.days_by_year['2019'], days + 5)
+        self.assertEqual(after.days_by_year.get(year, 0), before.days_by_year[year] - days)
+        self.assertEqual(after.days_by_branch['999'], days + 5)
+        self.assertEqual(after.days_by_branch.get(branch, 0), before.days_by_branch[branch] - days)
+        self.assertNoDrift()
+
+    def test_check_reports_and_fixes(self):
+        party_pks = list(InsuranceDaysAccrual.objects.order_by('party_id').values_list('party_id', flat=True))
+        InsuranceDaysAccrual.objects.filter(party_id=party_pks[0]).update(total_days=0)
+        InsuranceDaysAccrual.objects.filter(party_id=party_pks[1]).delete()
+        # An accrual left behind by a party without contributions
+        employer = Party.objects.get(party_id=employer_party_id(0))
+        self.assertFalse(InsuranceContribution.objects.filter(party_id=employer).exists())
+        InsuranceDaysAccrual.objects.create(
+            party_id=employer, total_days=1, days_by_year={'2025': 1}, days_by_branch={'1': 1},
+            last_change_date=timezone.now(),
+        )
+
+        counts = accrual.check_insurance_days(fix=True)
+        self.assertEqual((counts['missing'], counts['stale'], counts['orphaned']), (1, 1, 1))
+        self.assertNoDrift()
+        self.assertFalse(InsuranceDaysAccrual.objects.filter(party_id=employer).exists())
+
+    def test_missing_accrual_is_computed(self):
+        party_pk = self.insured_contribution().party_id_id
+        expected = InsuranceDaysAccrual.objects.get(party_id=party_pk).total_days
+        InsuranceDaysAccrual.objects.filter(party_id=party_pk).delete()
+        self.assertEqual(accrual.get_insurance_days(party_pk).total_days, expected)
+
+
+class PensionProjectionTests(SimpleTestCase):
+
+    today = date(2026, 10, 18)
+
+    def batch(self, births, totals, rates):
+        """project_batch() of a batch as per-person project() results."""
+        projected = pensions.project_batch(births, totals, rates, self.today)
+        columns = {code: [dates.astype(object) for dates in arrays] for code, arrays in projected.items()}
+        return [
+            {code: tuple(dates[index] for dates in columns[code]) for code in columns}
+            for index in range(len(totals))
+        ]
+
+    def test_batch_matches_project(self):
+        births = [date(1960, 5, 15), date(1964, 2, 29), None, date(1990, 1, 31), date(1970, 12, 31)]
+        totals = [5000, 3000, 4000, 100, 12500]
+        rates = [250, 0, 200, 1, 300]
+        expected = [pensions.project(*args, self.today) for args in zip(births, totals, rates)]
+        self.assertEqual(self.batch(births, totals, rates), expected)
+
+    def test_29_february_birthday(self):
+        reduced = pensions.project(date(1964, 2, 29), 5000, 250, self.today)['REDUCED']
+        self.assertEqual(reduced, (date(2026, 3, 1), self.today, self.today))
+        self.assertEqual(pensions.add_years(date(1964, 2, 29), 64), date(2028, 2, 29))
+
+    def test_without_date_of_birth(self):
+        full = pensions.project(None, 4000, 200, self.today)['FULL']
+        # 500 days at 200 a year
+        self.assertEqual(full, (None, self.today + timedelta(days=914), None))
+
+    def test_without_a_pace(self):
+        milestones = pensions.project(date(1960, 5, 15), 5000, 0, self.today)
+        # Days already reached do not need a pace
+        self.assertEqual(milestones['REDUCED'], (date(2022, 5, 15), self.today, self.today))
+        self.assertEqual(milestones['FULL_40Y'], (date(2022, 5, 15), None, None))
+
+    def test_horizon(self):
+        # 4400 days at one a year is out of reach, at 100 a year 44 years away
+        self.assertIsNone(pensions.project(date(1990, 1, 31), 100, 1, self.today)['REDUCED'][1])
+        self.assertEqual(
+            pensions.project(date(1990, 1, 31), 100, 100, self.today)['REDUCED'][1],
+            self.today + timedelta(days=16071),
+        )
+
+    def test_next_milestone(self):
+        def projections(**dates):
+            return [PensionProjection(milestone=code, eligibility_date=dates.get(code)) for code in dates]
+
+        names = {code: name for code, name, *_ in pensions.PENSION_MILESTONES}
+        # Upcoming: the earliest, the one listed last on the same day
+        self.assertEqual(
+            pensions.next_milestone(projections(
+                REDUCED=date(2030, 1, 1), FULL=date(2035, 1, 1), FULL_40Y=date(2030, 1, 1),
+            ), self.today),
+            (names['FULL_40Y'], date(2030, 1, 1)),
+        )
+        self.assertEqual(
+            pensions.next_milestone(projections(
+                REDUCED=date(2020, 1, 1), FULL=date(2035, 1, 1), FULL_40Y=None,
+            ), self.today),
+            (names['FULL'], date(2035, 1, 1)),
+        )
+        # All reached: the last one
+        self.assertEqual(
+            pensions.next_milestone(projections(
+                REDUCED=date(2020, 1, 1), FULL=date(2025, 1, 1), FULL_40Y=date(2025, 1, 1),
+            ), self.today),
+            (names['FULL_40Y'], date(2025, 1, 1)),
+        )
+        self.assertIsNone(pensions.next_milestone(projections(REDUCED=None), self.today))
+
+
+class EmployerDirectoryTests(DatasetTestCase):
+
+    def setUp(self):
+        self.employer_id = employer_party_id(0)
+        self.organization = Organization.objects.get(party_id__party_id=self.employer_id)
+        employers.employer_cache.clear()
+
+    def name(self):
+        return employers.get_employer_directory([self.employer_id])[self.employer_id][0]
+
+    def test_changes_invalidate_the_directory(self):
+        self.assertEqual(self.name(), self.organization.name)
+        self.organization.name = 'Renamed S.A.'
+        self.organization.save()
+        self.assertEqual(self.name(), 'Renamed S.A.')
+
+    def test_other_processes_invalidations_are_seen(self):
+        self.name()
+        # A change in another process: no local signal, only the shared generation moves
+        Organization.objects.filter(pk=self.organization.pk).update(name='Renamed S.A.')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.name(), self.organization.name)
+        cache.incr(employers.EMPLOYER_GENERATION_KEY)
+        self.assertEqual(self.name(), 'Renamed S.A.')
+
+    def test_stale_reads_are_not_cached(self):
+        generation = employers._generation()
+        employers.invalidate_employer_directory()
+        self.name()
+        employers.employer_cache.set_many({self.employer_id: ('Stale', 'N/A')}, generation)
+        self.assertEqual(self.name(), self.organization.name)
+
+
+class ApdIdentityTests(DatasetTestCase):
+
+    def test_employer_without_organization(self):
+        employer_id = employer_party_id(0)
+        Organization.objects.filter(party_id__party_id=employer_id).delete()
+        login(self, employer_id)
+        response = self.client.get(reverse('apd_submission'))
+        self.assertContains(response, 'Employer Not Found (AME: N/A)')
+        self.assertNotContains(response, 'METLEN')
+
+
+class PartyFragmentTests(DatasetTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.employer_id = employer_party_id(0)
+        self.employer = Party.objects.get(party_id=self.employer_id)
+        self.organization = Organization.objects.get(party_id=self.employer)
+
+    def shared_cache(self):
+        # The test cache is process-local, where fragments are not cached
+        self.enterContext(mock.patch.object(fragments, 'caching_fragments', return_value=True))
+
+    def employer_home(self):
+        login(self, self.employer_id)
+        return self.client.get(reverse('employer_home'))
+
+    def test_fragments_are_not_cached_in_a_process_local_cache(self):
+        self.assertContains(self.employer_home(), self.organization.name)
+        # Even a change no signal sees shows on the next request
+        Organization.objects.filter(pk=self.organization.pk).update(name='Renamed SA')
+        self.assertContains(self.employer_home(), 'Renamed SA')
+
+    def test_cached_fragments(self):
+        self.shared_cache()
+        self.assertContains(self.employer_home(), self.organization.name)
+        Organization.objects.filter(pk=self.organization.pk).update(name='Renamed SA')
+        response = self.employer_home()
+        self.assertContains(response, self.organization.name)
+        self.assertNotContains(response, 'Renamed SA')
+
+    def test_identifier_change_renders_the_fragment_again(self):
+        self.shared_cache()
+        self.employer_home()
+        PartyIdentifier.objects.filter(party_id=self.employer, identifier_type_id=ID_AME).update(
+            identifier_value='0000000001',
+        )
+        self.assertNotContains(self.employer_home(), '0000000001')
+        identifier = PartyIdentifier.objects.get(party_id=self.employer, identifier_type_id=ID_AME)
+        identifier.identifier_value = '0000000002'
+        identifier.save()
+        self.assertContains(self.employer_home(), '0000000002')
+
+    def test_address_change_renders_the_fragment_again(self):
+        self.shared_cache()
+        self.employer_home()
+        addresses = Address.objects.filter(party_id=self.employer)
+        addresses.update(address_street='Ermou', address_number='10', city='Athens', postal_code='10563')
+        self.assertNotContains(self.employer_home(), 'Ermou 10')
+        addresses.get().save()
+        self.assertContains(self.employer_home(), 'Ermou 10, Athens, 10563')
+
+    def test_organization_change_renders_the_employees_fragments_again(self):
+        self.shared_cache()
+        self.employer_home()
+        login(self, self.employer_id + 1)
+        self.client.get(reverse('insured_home'))
+        self.organization.name = 'Renamed SA'
+        self.organization.save()
+        self.assertContains(self.employer_home(), 'Renamed SA')
+        login(self, self.employer_id + 1)
+        self.assertContains(self.client.get(reverse('insured_home')), 'Renamed SA')
+
+
+class AsyncDashboardTests(DatasetTestCase):
+    """The async views (core/dashboards.py) served through the ASGI handler."""
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(translation.override('en'))
+        self.employer = Party.objects.get(party_id=employer_party_id(0))
+        self.insured = Party.objects.get(party_id=employer_party_id(0) + 1)
+        self.organization = Organization.objects.get(party_id=self.employer)
+
+    async def get(self, party, url_name):
+        user = await User.objects.aget(username=f"syn{party.party_id}")
+        await self.async_client.aforce_login(user)
+        return await self.async_client.get(reverse(url_name))
+
+    async def test_employer_home(self):
+        response = await self.get(self.employer, 'employer_home')
+        self.assertContains(response, self.organization.name)
+        self.assertContains(response, '1301.26')
+
+    async def test_insured_home(self):
+        response = await self.get(self.insured, 'insured_home')
+        self.assertContains(response, self.insured.display_name)
+        # The current employer
+        self.assertContains(response, self.organization.name)
+
+    async def test_apd_submission(self):
+        response = await self.get(self.employer, 'apd_submission')
+        self.assertContains(response, f"{self.organization.name} (AME: ")
+
+    async def test_roles(self):
+        response = await self.get(self.insured, 'employer_home')
+        self.assertRedirects(response, reverse('insured_home'), fetch_redirect_response=False)
+        await self.async_client.alogout()
+        response = await self.async_client.get(reverse('insured_home'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse('login')))
+
+
+class ContributionLoaderTests(DatasetTestCase):
+
+    def load(self, party, multiplier=1):
+        account = Account.objects.get(
+            party_role_id__party_id=party, account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT,
+        )
+        loader = ContributionLoader(account, party, multiplier=Decimal(multiplier),
+                                    default_employer_id=employer_party_id(0))
+        with open(settings.BASE_DIR / 'data' / 'insurance_contributions.csv', encoding='utf-8') as f:
+            count = loader.load(parse_contribution_csv(f))
+        loader.finalize()
+        return count
+
+    def test_loads_do_not_overwrite_each_other(self):
+        first, second = Party.objects.filter(
+            party_id__in=[employer_party_id(0) + 1, employer_party_id(0) + 2],
+        ).order_by('party_id')
+        before = {party.pk: party.contributions.count() for party in (first, second)}
+
+        count = self.load(first)
+        self.load(second, multiplier=2)
+
+        for party in (first, second):
+            self.assertEqual(party.contributions.count(), before[party.pk] + count)
+        loaded = InsuranceContribution.objects.filter(created_by='sys')
+        self.assertEqual(loaded.count(), 2 * count)
+        self.assertEqual(
+            loaded.filter(party_id=second).aggregate(total=Sum('total_contribution'))['total'],
+            2 * loaded.filter(party_id=first).aggregate(total=Sum('total_contribution'))['total'],
+        )
+        # Every obligation has an RF code of its own
+        rf_codes = list(TransactionObligation.objects.values_list('rf_code', flat=True))
+        self.assertEqual(len(rf_codes), len(set(rf_codes)))
+
+
+class HistoryExportTests(DatasetTestCase):
+
+    def setUp(self):
+        self.party = Party.objects.get(party_id=employer_party_id(0) + 1)
+        self.contributions = self.party.contributions.order_by('-start_date', 'pk')
+
+    def export(self, export_format):
+        login(self, self.party.party_id)
+        return self.client.get(reverse('export_insurance_history'), {'format': export_format})
+
+    def test_rows(self):
+        rows = list(iter_history_rows([self.party.pk]))
+        self.assertEqual(len(rows), self.contributions.count())
+        # Most recent period first, with the employer's name and AME
+        latest = self.contributions.first()
+        employer = Party.objects.get(party_id=latest.employer_id)
+        self.assertEqual(rows[0][:6], [
+            self.party.party_id, latest.start_date.strftime('%d/%m/%Y'), latest.end_date.strftime('%d/%m/%Y'),
+            latest.start_date.year, latest.start_date.month, latest.insurance_days,
+        ])
+        self.assertEqual(rows[0][8:], [
+            latest.gross_earnings, latest.total_contribution, Organization.objects.get(party_id=employer).name,
+            PartyIdentifier.objects.get(party_id=employer, identifier_type_id=ID_AME).identifier_value,
+        ])
+        # Chunks do not change the rows
+        self.assertEqual(list(iter_history_rows([self.party.pk], chunk_size=1)), rows)
+
+    def test_csv(self):
+        response = self.export('csv')
+        self.assertEqual(
+            response['Content-Disposition'], f'attachment; filename="insurance_history_{self.party.party_id}.csv"',
+        )
+        lines = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(lines[0], EXPORT_HEADER)
+        self.assertEqual(lines[1:], [[str(value) for value in row] for row in iter_history_rows([self.party.pk])])
+
+    def test_xlsx(self):
+        from openpyxl import load_workbook
+
+        response = self.export('xlsx')
+        self.assertEqual(response.status_code, 200)
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+        lines = list(workbook['Insurance History'].iter_rows(values_only=True))
+        self.assertEqual(list(lines[0]), EXPORT_HEADER)
+        rows = list(iter_history_rows([self.party.pk]))
+        self.assertEqual(len(lines), len(rows) + 1)
+        self.assertEqual([list(line[:8]) for line in lines[1:]], [row[:8] for row in rows])
+        self.assertEqual([Decimal(str(line[9])) for line in lines[1:]], [row[9] for row in rows])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.export('pdf').status_code, 400)
+
+
+class IterRowsTests(DatasetTestCase):
+
+    fields = ('party_id__party_id', 'insurance_days', 'gross_earnings')
+
+    def assertPagesMatchIterator(self, queryset, keys):
+        expected = list(queryset.values_list(*self.fields).iterator())
+        connection = connections[queryset.db]
+        with mock.patch.dict(connection.settings_dict, {'DISABLE_SERVER_SIDE_CURSORS': True}):
+            self.assertFalse(server_side_cursors(connection))
+            for chunk_size in (1, 3, len(expected)):
+                # One row more than expected, should the paging repeat rows
+                rows = islice(iter_rows(queryset, self.fields, keys, chunk_size), len(expected) + 1)
+                self.assertEqual(list(rows), expected)
+
+    def test_keyset_pages(self):
+        queryset = InsuranceContribution.objects.order_by('pk')
+        self.assertPagesMatchIterator(queryset, ['pk'])
+
+    def test_keyset_pages_descending_keys_with_ties(self):
+        # Many rows share the leading start date
+        keys = ['-start_date', 'party_id', '-pk']
+        self.assertPagesMatchIterator(InsuranceContribution.objects.order_by(*keys), keys)
@@ -13,12 +13,19 @@ urlpatterns = [
     path("profile_update/", views.profile_update, name='profile_update'),
     path("insurance_contributions/", views.insurance_contributions, name='insurance_contributions'),
     path("print_insurance_history/", views.print_insurance_history, name='print_insurance_history'),
+    path("export_insurance_history/", views.export_insurance_history, name='export_insurance_history'),
     path("apd_submission/", views.apd_submission, name='apd_submission'),
+    path("apd_submission/<int:pk>/status/", views.apd_submission_status, name='apd_submission_status'),
     path("code_info/", views.code_info, name='code_info'),
+    path("code_lookup/", views.code_lookup, name='code_lookup'),
     path("get_last_contribution/", views.get_last_contribution, name='get_last_contribution'),
+    path("get_last_contributions/", views.get_last_contributions, name='get_last_contributions'),
     path("current_obligations/", views.current_obligations, name='current_obligations'),
     path("unsettled_overdue/", views.unsettled_overdue, name='unsettled_overdue'),
     path("settled_overdue/", views.settled_overdue, name='settled_overdue'),
     path("employees/", views.employees_list, name='employees_list'),
     path("payments/", views.payments_screen, name='payments'),
+    path("reconciliation/statements/", views.reconcile_statement, name='reconcile_statement'),
+    path("reconciliation/statements/<int:pk>/", views.bank_statement_status, name='bank_statement_status'),
+    path("monitoring/db-connections/", views.db_connections, name='db_connections'),
 ]
\ No newline at end of file
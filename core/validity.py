@@ -0,0 +1,114 @@
+import threading
+
+from .catalog import CODE_TYPES, get_code_catalog
+
+
+# KAD / EID / KPK validity index
+# -----------------------------------------------------------------------------
+# Checks whole batches of (kad, eid, kpk, period) lines against the validity
+# intervals of dn_kadeidkpk.txt with NumPy (optional dependency). Codes are
+# mapped to integers per column, each combination to one integer, and every
+# merged validity interval (see CodeCatalog.validity) is stored as a sorted
+# (combination, from) key with its end month. A line is then one
+# searchsorted: the last interval starting at or before its period, valid if
+# it belongs to the same combination and has not ended.
+
+VALID = 0
+UNKNOWN = 1         # no such combination
+OUT_OF_PERIOD = 2   # the combination exists but is not valid in the period
+
+STATUS_MESSAGES = {
+    UNKNOWN: "Invalid KAD/EID/KPK combination",
+    OUT_OF_PERIOD: "KAD/EID/KPK combination not valid in the period",
+}
+
+_PERIOD_SPAN = 1000000  # YYYYMM < _PERIOD_SPAN
+
+
+class ValidityIndex:
+    """Validity intervals of the catalog's combinations as NumPy arrays."""
+
+    def __init__(self, validity):
+        import numpy as np
+
+        self.codes = {
+            code_type: {code: index for index, code in enumerate(sorted({triple[position] for triple in validity}))}
+            for position, code_type in enumerate(CODE_TYPES)
+        }
+        self.sizes = [len(self.codes[code_type]) for code_type in CODE_TYPES]
+        if self.sizes[0] * self.sizes[1] * self.sizes[2] * _PERIOD_SPAN >= 2 ** 63:
+            raise OverflowError("Too many codes for 64-bit combination keys.")
+
+        keys, ends = [], []
+        for triple, intervals in validity.items():
+            combination = self._combination(*(self.codes[code_type][code] for code_type, code in zip(CODE_TYPES, triple)))
+            for start, end in intervals:
+                keys.append(combination * _PERIOD_SPAN + start)
+                ends.append(end)
+        order = np.argsort(np.array(keys, dtype=np.int64), kind='stable')
+        self.keys = np.array(keys, dtype=np.int64)[order]
+        self.ends = np.array(ends, dtype=np.int64)[order]
+
+    def _combination(self, kad, eid, kpk):
+        return (kad * self.sizes[1] + eid) * self.sizes[2] + kpk
+
+    def _code_indexes(self, code_type, values):
+        import numpy as np
+
+        # Map the distinct codes in Python, then every line by indexing
+        unique, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        codes = self.codes[code_type]
+        return np.array([codes.get(code, -1) for code in unique], dtype=np.int64)[inverse]
+
+    def check(self, kads, eids, kpks, periods):
+        """
+        Return the status (VALID, UNKNOWN or OUT_OF_PERIOD, int8 array) of
+        every line. `periods` is a YYYYMM array or a single month.
+        """
+        import numpy as np
+
+        kad, eid, kpk = (
+            self._code_indexes(code_type, values)
+            for code_type, values in zip(CODE_TYPES, (kads, eids, kpks))
+        )
+        periods = np.broadcast_to(np.asarray(periods, dtype=np.int64), kad.shape)
+        status = np.full(kad.shape, UNKNOWN, dtype=np.int8)
+        if not len(self.keys):
+            return status
+
+        known_codes = (kad >= 0) & (eid >= 0) & (kpk >= 0)
+        combination = np.where(known_codes, self._combination(kad, eid, kpk), -1)
+        base = combination * _PERIOD_SPAN
+
+        # Does the combination exist at all: its first key
+        first = np.minimum(np.searchsorted(self.keys, base, side='left'), len(self.keys) - 1)
+        exists = known_codes & (self.keys[first] // _PERIOD_SPAN == combination)
+
+        # Interval in force: the last one starting at or before the period
+        position = np.searchsorted(self.keys, base + periods, side='right') - 1
+        clipped = np.maximum(position, 0)
+        valid = (
+            exists & (position >= 0)
+            & (self.keys[clipped] // _PERIOD_SPAN == combination)
+            & (periods <= self.ends[clipped])
+        )
+
+        status[exists] = OUT_OF_PERIOD
+        status[valid] = VALID
+        return status
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_validity_index():
+    """Return the process-wide ValidityIndex, rebuilt with the code catalog. Raises ImportError without NumPy."""
+    global _index, _index_version
+    catalog = get_code_catalog()
+    with _index_lock:
+        if _index is None or _index_version != catalog.version:
+            _index = ValidityIndex(catalog.validity)
+            _index_version = catalog.version
+        return _index
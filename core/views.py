@@ -2,52 +2,88 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponseForbidden
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse,
+    StreamingHttpResponse
+)
+from django.views.decorators.http import condition, require_POST
 from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from datetime import datetime, timedelta
 from functools import wraps
+import hashlib
+import json
 import os
 from .models import (
     Client, Party, PartyRole, PartyRoleType, PartyIdentifier, PartyIdentifierType, 
     Organization, Address, Person, Account, AccountType, AccountBalance, 
     AccountTransaction, TransactionBalance, TransactionObligation, 
     ObligationBalance, InsuranceContribution, InsuranceContributionBalance, 
-    PartyRelationship, PartyRelationshipType
+    PartyRelationship, PartyRelationshipType, ApdSubmission, BankStatement
+)
+from .apd import APD_PROCESS_ON_UPLOAD, ApdFileError, create_submission, ingest
+from .catalog import CODE_TYPES, get_code_catalog
+from .database import connection_stats
+from . import dashboards, fragments
+from .employers import get_employer_directory
+from .exports import iter_history_csv, write_history_xlsx
+from .ledger import (
+    ACCOUNT_TYPE_CURRENT, ACCOUNT_TYPE_SETTLED, ACCOUNT_TYPE_UNSETTLED,
+    get_debt_summary, ledger_rows, ledger_totals, obligations_ledger
 )
+from .payments import payment_history
+from .prefill import (
+    EMPLOYEE_NOT_FOUND, NO_CONTRIBUTIONS, PREFILL_MAX_AMAS, get_latest_contribution, iter_json_lines,
+    iter_last_contributions, resolve_ama
+)
+from .reconciliation import RECON_PROCESS_ON_UPLOAD, StatementFileError, create_statement, reconcile
+from .roles import get_party_context, get_request_party_context
+from .rollups import contribution_rollups, monthly_totals
+
+
+CODE_LOOKUP_DEFAULT_LIMIT = 50
+CODE_LOOKUP_MAX_LIMIT = getattr(settings, 'CODE_LOOKUP_MAX_LIMIT', 5000)
+CODE_LOOKUP_MAX_AGE = getattr(settings, 'CODE_LOOKUP_MAX_AGE', 60 * 60)
 
 
 def get_user_role_code(user):
-    """Helper to get the role code for a user."""
-    try:
-        client = Client.objects.get(user=user)
-        party = Party.objects.filter(client_id=client).first()
-        if party:
-            party_role = PartyRole.objects.filter(party_id=party, status=1).first()
-            if party_role:
-                role_type = PartyRoleType.objects.filter(role_type_id=party_role.role_type_id).first()
-                return role_type.role_type_code if role_type else None
-    except (Client.DoesNotExist, Exception):
-        pass
-    return None
+    """Helper to get the role code for a user (cached, see core/roles.py)."""
+    return get_party_context(user).role_code
+
+
+def _role_redirect(role_code):
+    # Redirect to appropriate home or return 403
+    if role_code == 'INS':
+        return redirect('insured_home')
+    elif role_code == 'EMP':
+        return redirect('employer_home')
+    else:
+        return HttpResponseForbidden("Access Denied: You do not have permission to view this page.")
 
 
 def role_required(allowed_roles):
-    """Decorator to restrict view access based on user's party role."""
+    """Decorator to restrict view access based on user's party role (sync or async views)."""
     def decorator(view_func):
-        @wraps(view_func)
-        @login_required
-        def wrapper(request, *args, **kwargs):
-            role_code = get_user_role_code(request.user)
-            if role_code in allowed_roles:
-                return view_func(request, *args, **kwargs)
-            else:
-                # Redirect to appropriate home or return 403
-                if role_code == 'INS':
-                    return redirect('insured_home')
-                elif role_code == 'EMP':
-                    return redirect('employer_home')
-                else:
-                    return HttpResponseForbidden("Access Denied: You do not have permission to view this page.")
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            @login_required
+            async def wrapper(request, *args, **kwargs):
+                role_code = (await sync_to_async(get_request_party_context)(request)).role_code
+                if role_code in allowed_roles:
+                    return await view_func(request, *args, **kwargs)
+                return _role_redirect(role_code)
+        else:
+            @wraps(view_func)
+            @login_required
+            def wrapper(request, *args, **kwargs):
+                role_code = get_request_party_context(request).role_code
+                if role_code in allowed_roles:
+                    return view_func(request, *args, **kwargs)
+                return _role_redirect(role_code)
+        wrapper.allowed_roles = tuple(allowed_roles)
         return wrapper
     return decorator
 
@@ -55,7 +91,7 @@ def role_required(allowed_roles):
 @login_required
 def login_redirect_view(request):
     """Redirect user to appropriate home based on their role."""
-    role_code = get_user_role_code(request.user)
+    role_code = get_request_party_context(request).role_code
     if role_code == 'EMP':
         return redirect('employer_home')
     elif role_code == 'INS':
@@ -94,73 +130,31 @@ def client_home(request):
     
     return render(request, "core/client_home.html", context)
 
+
+def get_employer_organization(request):
+    """Organization of the logged in employer (party resolved by role_required)."""
+    party = request.party_context.party
+    if party is None:
+        return None
+    return Organization.objects.filter(party_id=party).first()
+
+
 @role_required(['EMP'])
-def employer_home(request):
-    # Retrieve Employer details from DB
-    try:
-        # Fetching the default employer record seeded in the database
-        employer_org = Organization.objects.get(name='METLEN ENERGY & METALS S.A.')
-        party = employer_org.party_id
-        
-        # Identifiers
-        tax_id = "N/A"
-        ame = "N/A"
-        try:
-            afm_type = PartyIdentifierType.objects.filter(identifier_type_code='AFM').first()
-            if afm_type:
-                afm_ident = PartyIdentifier.objects.filter(party_id=party, identifier_type_id=afm_type.identifier_type_id).last()
-                tax_id = afm_ident.identifier_value if afm_ident else "N/A"
-        except: pass
-        
-        try:
-            ame_type = PartyIdentifierType.objects.filter(identifier_type_code='AME').first()
-            if ame_type:
-                ame_ident = PartyIdentifier.objects.filter(party_id=party, identifier_type_id=ame_type.identifier_type_id).first()
-                ame = ame_ident.identifier_value if ame_ident else "N/A"
-        except: pass
-        
-        # Address
-        full_address = "N/A"
-        try:
-            addr = Address.objects.filter(party_id=party).first()
-            if addr:
-                full_address = f"{addr.address_street} {addr.address_number}, {addr.city}, {addr.postal_code}"
-        except: pass
-        
-        # Get Accounts and Balances for the employer role
-        debts = {'current': 0.00, 'overdue_keao_settled': 0.00, 'overdue_keao_unsettled': 0.00}
-        try:
-            role_employer_obj = PartyRole.objects.get(party_id=party, role_type_id=2)
-            # Account 1: Current
-            acc_current = Account.objects.filter(party_role_id=role_employer_obj, account_id=1).first()
-            if acc_current: debts['current'] = float(acc_current.account_balance)
-            
-            # Account 2: Settled KEAO
-            acc_settled = Account.objects.filter(party_role_id=role_employer_obj, account_id=2).first()
-            if acc_settled: debts['overdue_keao_settled'] = float(acc_settled.account_balance)
-            
-            # Account 3: Unsettled KEAO
-            acc_unsettled = Account.objects.filter(party_role_id=role_employer_obj, account_id=3).first()
-            if acc_unsettled: debts['overdue_keao_unsettled'] = float(acc_unsettled.account_balance)
-            
-            unpaid_contributions_total = debts['current']
-        except (PartyRole.DoesNotExist):
-            unpaid_contributions_total = 0.00
-            
-        company_name = employer_org.name
-    except Organization.DoesNotExist:
-        company_name = "Employer Not Found"
-        tax_id = "N/A"
-        ame = "N/A"
-        full_address = "N/A"
-        unpaid_contributions_total = 0.00
-        debts = {'current': 0.00, 'overdue_keao_settled': 0.00, 'overdue_keao_unsettled': 0.00}
+async def employer_home(request):
+    # Employer details of the logged in user (party resolved by role_required),
+    # the independent lookups run concurrently and the identity block only
+    # when its cached fragments are missing (see core/dashboards.py)
+    party_pk = request.party_context.party_pk
+    fragment_context, cached = await fragments.fragment_state(party_pk, dashboards.EMPLOYER_FRAGMENTS)
+    identity, (debts,) = await dashboards.gather_identity(
+        cached, dashboards.employer_identity, dashboards.employer_identity_calls(party_pk),
+        # Debts by account type, materialized in EmployerDebtSummary (see core/ledger.py)
+        (get_debt_summary, party_pk),
+    )
+    unpaid_contributions_total = debts['current']
 
     context = {
-        'company_name': company_name,
-        'tax_id': tax_id,
-        'ame': ame,
-        'address': full_address,
+        'identity': identity,
         'current_period': datetime.now().strftime('%B %Y'),
         'pending_apd_count': 2,
         'next_apd_deadline': datetime.now() + timedelta(days=15),
@@ -177,15 +171,15 @@ def employer_home(request):
         ],
         'debts': debts,
     }
+    context.update(fragment_context)
     
-    return render(request, "core/employer_home.html", context)
+    return await sync_to_async(render)(request, "core/employer_home.html", context)
 
 
 @role_required(['INS'])
 def profile_update(request):
-    try:
-        client = Client.objects.get(user=request.user)
-    except Client.DoesNotExist:
+    client = request.party_context.client
+    if client is None:
         messages.error(request, "Client record not found.")
         return redirect('insured_home')
 
@@ -211,106 +205,63 @@ def profile_update(request):
 
 
 @role_required(['INS'])
-def insured_home(request):
-    # Retrieve data from database
-    full_name = "User Not Found"
-    insurance_id = "N/A"
-    address_display = "N/A"
-    total_days = 0
-    current_employer = "Not Available"
-    next_milestone = "N/A"
-    recent_activity = []
-
-    # Try to get the client and party associated with the user
-    # In a real scenario, we'd use request.user. In this seed case, we'll look for 'seed_user' 
-    # if the user is not authenticated or as a fallback for demonstration.
-    try:
-        if request.user.is_authenticated:
-            user = request.user
-        else:
-            from django.contrib.auth.models import User
-            user = User.objects.get(username='seed_user')
-
-        client = Client.objects.get(user=user)
-        
-        # Find the party associated with this client that has the 'INS' role
-        ins_role_type = PartyRoleType.objects.get(role_type_code='INS')
-        party_role = PartyRole.objects.get(role_type_id=ins_role_type.role_type_id, party_id__client_id=client)
-        party = party_role.party_id
-        full_name = party.display_name
-        
-        # Get Identifiers
-        amka = "N/A"
-        adt = "N/A"
-        try:
-            ama_type = PartyIdentifierType.objects.filter(identifier_type_code='AMA').first()
-            if ama_type:
-                ama_ident = PartyIdentifier.objects.filter(party_id=party, identifier_type_id=ama_type.identifier_type_id).first()
-                insurance_id = ama_ident.identifier_value if ama_ident else "N/A"
-            
-            amka_type = PartyIdentifierType.objects.filter(identifier_type_code='AMKA').first()
-            if amka_type:
-                amka_ident = PartyIdentifier.objects.filter(party_id=party, identifier_type_id=amka_type.identifier_type_id).first()
-                amka = amka_ident.identifier_value if amka_ident else "N/A"
-
-            adt_type = PartyIdentifierType.objects.filter(identifier_type_code='ADT').first()
-            if adt_type:
-                adt_ident = PartyIdentifier.objects.filter(party_id=party, identifier_type_id=adt_type.identifier_type_id).first()
-                adt = adt_ident.identifier_value if adt_ident else "N/A"
-        except Exception as id_e:
-            print(f"Error fetching insured identifiers: {id_e}")
-
-        # Get Address
-        try:
-            addr = Address.objects.filter(party_id=party).first()
-            if addr:
-                address_display = f"{addr.address_street} {addr.address_number}, {addr.city}"
-            else:
-                address_display = "N/A"
-        except:
-            address_display = "N/A"
-
-        # Additional fields can be populated from contribution records
-        # Fetch current employer through PartyRelationship
-        try:
-            # Look for active employment relationship (relation_to is the insured)
-            emp_relationship = PartyRelationship.objects.filter(
-                relation_to=party_role,
-                relationship_type_id=1, # EMPLOYMENT type seeded earlier
-                status=1
-            ).first()
-            
-            if emp_relationship:
-                employer_party = emp_relationship.relation_from.party_id
-                org = Organization.objects.filter(party_id=employer_party).first()
-                current_employer = org.name if org else "Unknown Employer"
-            else:
-                current_employer = "No Active Employer"
-        except Exception as e:
-            current_employer = "Not Available"
-
-        next_milestone = "Full Pension Eligibility"
-        recent_activity = [
-            {'label': 'Monthly contribution updated for November 2025', 'date': datetime.now() - timedelta(days=2)},
-            {'label': 'Insurance record downloaded', 'date': datetime.now() - timedelta(days=10)},
-            {'label': 'Profile information updated', 'date': datetime.now() - timedelta(days=25)},
-        ]
-    except (Client.DoesNotExist, Party.DoesNotExist, Exception) as e:
-        print(f"Error fetching insured data: {e}")
+async def insured_home(request):
+    # The party holding the 'INS' role was already resolved by role_required,
+    # the independent lookups run concurrently and the identity block only
+    # when its cached fragments are missing (see core/dashboards.py)
+    party_context = request.party_context
+    party_pk = party_context.party_pk
+    fragment_context, cached = await fragments.fragment_state(party_pk, dashboards.INSURED_FRAGMENTS)
+    identity, (insurance_days,) = await dashboards.gather_identity(
+        cached, dashboards.insured_identity,
+        dashboards.insured_identity_calls(party_pk, party_context.party_role_pk),
+        # Lifetime insurance days (maintained counter, see core/accrual.py) and
+        # projected pension milestones (see core/pensions.py)
+        (dashboards.insurance_days_summary, party_pk),
+    )
+    total_days, days_updated, next_milestone_name, milestone_date = insurance_days
+
+    recent_activity = [
+        {'label': 'Monthly contribution updated for November 2025', 'date': datetime.now() - timedelta(days=2)},
+        {'label': 'Insurance record downloaded', 'date': datetime.now() - timedelta(days=10)},
+        {'label': 'Profile information updated', 'date': datetime.now() - timedelta(days=25)},
+    ]
 
     context = {
-        'full_name': full_name,
-        'insurance_id': insurance_id,
-        'amka': amka,
-        'adt': adt,
-        'address': address_display,
+        'identity': identity,
         'total_days': total_days,
-        'current_employer': current_employer,
-        'next_milestone': next_milestone,
+        'days_updated': days_updated,
+        'next_milestone': next_milestone_name,
+        'milestone_date': milestone_date,
         'recent_activity': recent_activity,
     }
+    context.update(fragment_context)
     
-    return render(request, "core/insured_home.html", context)
+    return await sync_to_async(render)(request, "core/insured_home.html", context)
+
+
+def build_contribution_history(contributions):
+    """Build the contribution history table rows, resolving employers in bulk."""
+    contributions = list(contributions)
+    employers = get_employer_directory(ic.employer_id for ic in contributions)
+
+    history = []
+    for ic in contributions:
+        emp_name, emp_ame = employers[ic.employer_id]
+        history.append({
+            'from': ic.start_date.strftime('%d/%m/%Y'),
+            'to': ic.end_date.strftime('%d/%m/%Y'),
+            'year': ic.start_date.year,
+            'month': ic.start_date.month,
+            'days': ic.insurance_days,
+            'earnings_type': f"{ic.earning_type_id:02d}",
+            'coverage_package': str(ic.coverage_package_id),
+            'gross_earnings': float(ic.gross_earnings),
+            'total_contributions': float(ic.total_contribution),
+            'employer_name': emp_name,
+            'employer_ame': emp_ame
+        })
+    return history
 
 
 @role_required(['INS'])
@@ -318,114 +269,55 @@ def insurance_contributions(request):
     import json # Moved import here as it's only used in this function
 
     labels = []
-    historical_values = []
-    predictive_values = []
-    ytd_total = 0.0
-    projected_total = 0.0
+    historical_contributions = []
+    historical_gross = []
     history = []
-    avg_contribution = 0.0 # Initialize for fallback context
 
     try:
-        # 1. Identify User and Party
-        if request.user.is_authenticated:
-            user = request.user
-        else:
-            from django.contrib.auth.models import User
-            user = User.objects.get(username='insured_user') # Fallback for demonstration
-
-        client = Client.objects.get(user=user)
-        ins_role_type = PartyRoleType.objects.get(role_type_code='INS')
-        party_role = PartyRole.objects.get(role_type_id=ins_role_type.role_type_id, party_id__client_id=client)
-        party = party_role.party_id
+        # 1. Identify Party (resolved by role_required)
+        party_pk = request.party_context.party_pk
         
-        # 2. Fetch Contributions from DB
-        contributions = InsuranceContribution.objects.filter(party_id=party).order_by('start_date')
+        # 2. Monthly rollups (pre-aggregated, see core/rollups.py)
+        rollups = contribution_rollups(party_pk)
         
-        if not contributions.exists():
+        if not rollups:
             raise Exception("No contributions found for user")
 
-        historical_contributions = []
-        historical_gross = []
-        
         # 3. Process Data for Chart
         # Filter by year if provided
         selected_year = request.GET.get('year')
         current_year = datetime.now().year
         
-        # Get distinct years from contributions for the filter dropdown
-        available_years = contributions.dates('start_date', 'year').distinct().order_by('-start_date')
-        years_list = [d.year for d in available_years]
-        if current_year not in years_list and not contributions.exists():
-             years_list = [current_year] # Default if no data
+        # Distinct years of the rollups for the filter dropdown
+        years_list = sorted({rollup.year for rollup in rollups}, reverse=True)
         
-        if selected_year and selected_year != 'all':
-            try:
-                selected_year_int = int(selected_year)
-                contributions = contributions.filter(start_date__year=selected_year_int)
-            except ValueError:
-                selected_year = current_year
-                contributions = contributions.filter(start_date__year=selected_year)
-        elif selected_year == 'all':
+        contributions = InsuranceContribution.objects.filter(party_id=party_pk)
+        if selected_year == 'all':
             # No filtering by year
             pass
         else:
-             # Default to current year
-             selected_year = str(current_year)
-             contributions = contributions.filter(start_date__year=current_year)
-        
-        # 3. Chart Data (Chronological)
-        # Re-sort for chart after filtering
-        chart_contributions = contributions.order_by('start_date')
-        
-        for ic in chart_contributions:
-            labels.append(ic.start_date.strftime('%b %Y'))
-            historical_contributions.append(float(ic.total_contribution))
-            historical_gross.append(float(ic.gross_earnings))
+            try:
+                selected_year_int = int(selected_year) if selected_year else current_year
+            except ValueError:
+                selected_year_int = current_year
+            # Default to current year
+            selected_year = str(selected_year_int)
+            rollups = [rollup for rollup in rollups if rollup.year == selected_year_int]
+            contributions = contributions.filter(start_date__year=selected_year_int)
+        
+        # 3. Chart Data (Chronological, one point per month)
+        for month, total, gross in monthly_totals(rollups):
+            labels.append(month.strftime('%b %Y'))
+            historical_contributions.append(float(total))
+            historical_gross.append(float(gross))
         
         # 4. Summary Stats
         # If 'all' is selected, these are "Total to Date" rather than "Year to Date"
-        ytd_total_contributions = sum(historical_contributions)
-        ytd_total_gross = sum(historical_gross)
+        ytd_total_contributions = float(sum(rollup.total_contribution for rollup in rollups))
+        ytd_total_gross = float(sum(rollup.gross_earnings for rollup in rollups))
 
         # 5. History Table Data (Reverse chronological)
-        for ic in contributions.order_by('-start_date'):
-            # Find employer name through relationship
-            emp_name = "N/A"
-            emp_ame = "N/A"
-            try:
-                # Lookup Employer Party (employer_id in IC is the party_id)
-                employer_party = Party.objects.filter(party_id=ic.employer_id).first()
-                if employer_party:
-                    # Find name
-                    org = Organization.objects.filter(party_id=employer_party).first()
-                    emp_name = org.name if org else "Unknown Employer"
-                    
-                    # Find AME (type 5)
-                    ame_type = PartyIdentifierType.objects.filter(identifier_type_code='AME').first()
-                    if ame_type:
-                        ame_id = PartyIdentifier.objects.filter(
-                            party_id=employer_party, 
-                            identifier_type_id=ame_type.identifier_type_id
-                        ).first()
-                        if ame_id:
-                            emp_ame = ame_id.identifier_value
-            except Exception as lookup_e:
-                print(f"Error looking up employer details: {lookup_e}")
-                pass
-
-            history.append({
-                'from': ic.start_date.strftime('%d/%m/%Y'),
-                'to': ic.end_date.strftime('%d/%m/%Y'),
-                'year': ic.start_date.year,
-                'month': ic.start_date.month,
-                'days': ic.insurance_days,
-                'earnings_type': f"{ic.earning_type_id:02d}",
-                'coverage_package': str(ic.coverage_package_id),
-                'gross_earnings': float(ic.gross_earnings),
-                'total_contributions': float(ic.total_contribution),
-                'employer_name': emp_name,
-                'employer_ame': emp_ame
-            })
+        history = build_contribution_history(contributions.order_by('-start_date'))
 
     except Exception as e:
         print(f"Error in insurance_contributions view: {e}")
@@ -456,49 +348,14 @@ def insurance_contributions(request):
 @role_required(['INS'])
 def print_insurance_history(request):
     try:
-        # Get user
-        user = request.user
-        # Get insured client
-        client = Client.objects.get(user=user)
-        # Get insured party
-        party = Party.objects.get(client_id=client, party_type='PERSON')
+        # Get insured party (resolved by role_required)
+        party = request.party_context.party
         
         # Always fetch all contributions for the print view
         contributions = InsuranceContribution.objects.filter(party_id=party)
         
         # Provide history list
-        history = []
-        for ic in contributions.order_by('-start_date'):
-            # Fetch Employer details (simplified for print view consistency)
-             # Find employer name through relationship
-            emp_name = "N/A"
-            emp_ame = "N/A"
-            try:
-                employer_party = Party.objects.filter(party_id=ic.employer_id).first()
-                if employer_party:
-                    org = Organization.objects.filter(party_id=employer_party).first()
-                    emp_name = org.name if org else "Unknown Employer"
-                    
-                    ame_type = PartyIdentifierType.objects.filter(identifier_type_code='AME').first()
-                    if ame_type:
-                        ame_id = PartyIdentifier.objects.filter(party_id=employer_party, identifier_type_id=ame_type.identifier_type_id).first()
-                        if ame_id:
-                            emp_ame = ame_id.identifier_value
-            except: pass
-
-            history.append({
-                'from': ic.start_date.strftime('%d/%m/%Y'),
-                'to': ic.end_date.strftime('%d/%m/%Y'),
-                'year': ic.start_date.year,
-                'month': ic.start_date.month,
-                'days': ic.insurance_days,
-                'earnings_type': f"{ic.earning_type_id:02d}",
-                'coverage_package': str(ic.coverage_package_id),
-                'gross_earnings': float(ic.gross_earnings),
-                'total_contributions': float(ic.total_contribution),
-                'employer_name': emp_name,
-                'employer_ame': emp_ame
-            })
+        history = build_contribution_history(contributions.order_by('-start_date'))
             
         context = {
             'contribution_history': history,
@@ -513,143 +370,154 @@ def print_insurance_history(request):
         print(f"Error in print_history: {e}")
         return render(request, "core/print_contributions.html", {'error': 'Could not generate report'})
 
+@role_required(['INS'])
+def export_insurance_history(request):
+    """Stream the full insurance history as CSV (default) or XLSX."""
+    export_format = request.GET.get('format', 'csv')
+    party = request.party_context.party
+    if party is None:
+        return HttpResponseForbidden("Insured party not found.")
+    filename = f"insurance_history_{party.party_id}"
+
+    if export_format == 'csv':
+        response = StreamingHttpResponse(iter_history_csv([party.pk]), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
+
+    if export_format == 'xlsx':
+        try:
+            output = write_history_xlsx([party.pk])
+        except ImportError:
+            return HttpResponse("XLSX export is not available (openpyxl is not installed).", status=501)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f"{filename}.xlsx",
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+
+    return HttpResponseBadRequest("format must be csv or xlsx")
+
+
+def _upload_apd(request, user):
+    """
+    Store an uploaded APD file for `manage.py ingest_apd`, or ingest it right
+    away with APD_PROCESS_ON_UPLOAD (see core/apd.py). Returns the upload error, if any.
+    """
+    try:
+        period = int(request.POST.get('period', '').replace('-', ''))
+    except ValueError:
+        period = 0
+    try:
+        submission = create_submission(
+            request.party_context.party, period, request.FILES['apd_file'], user.username[:30],
+        )
+    except ApdFileError as e:
+        return str(e)
+    if APD_PROCESS_ON_UPLOAD:
+        try:
+            ingest(submission)
+        except Exception as e:
+            # The submission is FAILED (and resumable with `ingest_apd --resume`)
+            return f"{submission.receipt_number}: {e}"
+    return None
+
+
 @role_required(['EMP'])
-def apd_submission(request):
+async def apd_submission(request):
     # Context data for APD submission page
     now = datetime.now()
+    upload_error = None
+
+    # 1. Bulk upload
+    if request.method == 'POST' and 'apd_file' in request.FILES:
+        upload_error = await sync_to_async(_upload_apd)(request, await request.auser())
+        if upload_error is None:
+            return redirect('apd_submission')
+
+    # 2. Submission history and the employer's details, fetched concurrently
+    # (the details only when their cached fragment is missing, see core/dashboards.py)
+    party_pk = request.party_context.party_pk
+    fragment_context, cached = await fragments.fragment_state(party_pk, dashboards.APD_FRAGMENTS)
+    identity, ((submissions, failed_submission, submission_errors),) = await dashboards.gather_identity(
+        cached, dashboards.apd_identity, dashboards.employer_identity_calls(party_pk),
+        (dashboards.apd_history, party_pk),
+    )
     submission_history = [
         {
-            'period': (now - timedelta(days=30)).strftime('%m/%Y'),
-            'submission_date': (now - timedelta(days=5)).strftime('%d/%m/%Y %H:%M'),
-            'receipt_number': 'APD-99887766',
-            'status': 'Accepted',
-            'employee_count': 25,
-            'total_contributions': 1250.50,
-        },
-        {
-            'period': (now - timedelta(days=60)).strftime('%m/%Y'),
-            'submission_date': (now - timedelta(days=35)).strftime('%d/%m/%Y %H:%M'),
-            'receipt_number': 'APD-99887700',
-            'status': 'Accepted',
-            'employee_count': 24,
-            'total_contributions': 1200.00,
-        },
-        {
-            'period': (now - timedelta(days=90)).strftime('%m/%Y'),
-            'submission_date': (now - timedelta(days=65)).strftime('%d/%m/%Y %H:%M'),
-            'receipt_number': 'APD-99887655',
-            'status': 'Accepted',
-            'employee_count': 24,
-            'total_contributions': 1180.20,
-        },
+            'pk': sub.pk,
+            'period': f"{sub.period % 100:02d}/{sub.period // 100}",
+            'submission_date': timezone.localtime(sub.creation_date).strftime('%d/%m/%Y %H:%M'),
+            'receipt_number': sub.receipt_number,
+            'state': sub.state,
+            'status': sub.get_state_display(),
+            'progress': sub.progress,
+            'employee_count': sub.employee_count,
+            'total_contributions': sub.total_contributions,
+            'lines_total': sub.lines_total,
+            'lines_rejected': sub.lines_rejected,
+        }
+        for sub in submissions
     ]
-    
-    # Fetch Employer details from DB
-    try:
-        employer_org = Organization.objects.get(name='METLEN ENERGY & METALS S.A.')
-        party = employer_org.party_id
-        
-        tax_id = "N/A"
-        ame = "N/A"
-        try:
-            afm_type = PartyIdentifierType.objects.get(identifier_type_code='AFM')
-            # Use filter().first() to avoid MultipleObjectsReturned
-            tax_id_obj = PartyIdentifier.objects.filter(party_id=party, identifier_type_id=afm_type.identifier_type_id).first()
-            if tax_id_obj:
-                tax_id = tax_id_obj.identifier_value
-        except: pass
-        
-        try:
-            ame_type = PartyIdentifierType.objects.get(identifier_type_code='AME')
-            # Use filter().first() to avoid MultipleObjectsReturned
-            ame_obj = PartyIdentifier.objects.filter(party_id=party, identifier_type_id=ame_type.identifier_type_id).first()
-            if ame_obj:
-                ame = ame_obj.identifier_value
-        except: pass
-        
-        full_address = "N/A"
-        try:
-            addr = Address.objects.filter(party_id=party).first()
-            if addr:
-                full_address = f"{addr.address_street} {addr.address_number}, {addr.city}, {addr.postal_code}"
-        except: pass
-        
-        company_name = employer_org.name
-    except:
-        company_name = "METLEN ENERGY & METALS S.A."
-        full_address = "8 Artemidos Str., Maroussi, Athens, 15125"
-        tax_id = "998877665"
-        ame = "1234567890"
 
     context = {
-        'company_name': company_name,
-        'company_address': full_address,
-        'tax_id': tax_id,
-        'ame': ame,
+        'identity': identity,
         'current_period': now.strftime('%B %Y'),
+        'filing_period': now.strftime('%Y%m'),
         'submission_history': submission_history,
+        'failed_submission': failed_submission,
+        'submission_errors': submission_errors,
+        'upload_error': upload_error,
+        'code_lookup_max_limit': CODE_LOOKUP_MAX_LIMIT,
     }
-    return render(request, "core/apd_submission.html", context)
+    context.update(fragment_context)
+    return await sync_to_async(render)(request, "core/apd_submission.html", context)
+
+
+@role_required(['EMP'])
+def apd_submission_status(request, pk):
+    """Progress of one of the employer's APD submissions (JSON, for polling)."""
+    submission = get_object_or_404(ApdSubmission, pk=pk, party_id=request.party_context.party_pk)
+    return JsonResponse({
+        'receipt_number': submission.receipt_number,
+        'state': submission.state,
+        'status': submission.get_state_display(),
+        'progress': submission.progress,
+        'lines_total': submission.lines_total,
+        'lines_validated': submission.lines_validated,
+        'lines_posted': submission.lines_posted,
+        'lines_rejected': submission.lines_rejected,
+        'employee_count': submission.employee_count,
+        'total_contributions': str(submission.total_contributions),
+        'error_message': submission.error_message,
+        'errors': [
+            {'line': error.line_number, 'message': error.message}
+            for error in submission.errors.all()[:20]
+        ],
+    })
 
 def code_info(request):
     info_type = request.GET.get('type', 'kad')
     kad_filter = request.GET.get('kad', '')
     eid_filter = request.GET.get('eid', '')
     kpk_filter = request.GET.get('kpk', '')
-    
-    file_map = {
-        'kad': 'dn_kad.txt',
-        'eid': 'dn_eid.txt',
-        'kpk': 'dn_kpk.txt'
-    }
-    
-    filename = file_map.get(info_type, 'dn_kad.txt')
-    filepath = os.path.join(settings.BASE_DIR, 'core', 'static', 'core', 'texts', filename)
-    
-    codes = []
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.split('|')
-                if len(parts) >= 2:
-                    codes.append({
-                        'code': parts[0].strip(),
-                        'description': parts[1].strip(),
-                        'is_appropriate': True # Default
-                    })
-    except Exception as e:
-        print(f"Error reading {filename}: {e}")
-
-    # Triple mapping for green/red logic
-    mapping_path = os.path.join(settings.BASE_DIR, 'core', 'static', 'core', 'texts', 'dn_kadeidkpk.txt')
-    appropriate_codes = set()
-    has_filter = False
+        period = _parse_period(request.GET.get('period'))
+    except ValueError:
+        period = None
+    
+    catalog = get_code_catalog()
+    code_type = info_type if info_type in CODE_TYPES else 'kad'
 
-    try:
-        with open(mapping_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.split('|')
-                if len(parts) >= 3:
-                    m_kad = parts[0].strip()
-                    m_eid = parts[1].strip()
-                    m_kpk = parts[2].strip()
-                    
-                    match = True
-                    if kad_filter and m_kad != kad_filter: match = False
-                    if eid_filter and m_eid != eid_filter: match = False
-                    if kpk_filter and m_kpk != kpk_filter: match = False
-                    
-                    if match:
-                        if info_type == 'kad': appropriate_codes.add(m_kad)
-                        elif info_type == 'eid': appropriate_codes.add(m_eid)
-                        elif info_type == 'kpk': appropriate_codes.add(m_kpk)
-                        
-        if kad_filter or eid_filter or kpk_filter:
-            has_filter = True
-    except Exception as e:
-        print(f"Error reading mapping: {e}")
+    codes = [
+        {'code': code, 'description': description, 'is_appropriate': True}
+        for code, description in catalog.codes[code_type]
+    ]
 
+    # Triple mapping for green/red logic (indexed lookup, see core/catalog.py)
+    has_filter = bool(kad_filter or eid_filter or kpk_filter or period)
     if has_filter:
+        appropriate_codes = catalog.lookup(info_type, kad=kad_filter, eid=eid_filter, kpk=kpk_filter, period=period)
         for c in codes:
             c['is_appropriate'] = c['code'] in appropriate_codes
 
@@ -660,56 +528,127 @@ def code_info(request):
         'kad_filter': kad_filter,
         'eid_filter': eid_filter,
         'kpk_filter': kpk_filter,
+        'period': period,
     }
     return render(request, "core/code_info.html", context)
 
 
+def _parse_period(value):
+    """YYYYMM int of a `period` query parameter (YYYYMM or YYYY-MM), None if empty."""
+    value = (value or '').strip().replace('-', '')
+    if not value:
+        return None
+    if len(value) != 6 or not value.isdigit() or not 1 <= int(value[4:]) <= 12:
+        raise ValueError("period must be YYYYMM or YYYY-MM")
+    return int(value)
+
+
+def _code_lookup_params(request):
+    """Parse and validate the code_lookup query parameters."""
+    info_type = request.GET.get('type', 'kad')
+    if info_type not in CODE_TYPES:
+        raise ValueError(f"type must be one of {', '.join(CODE_TYPES)}")
+
+    limit = request.GET.get('limit', CODE_LOOKUP_DEFAULT_LIMIT)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+
+    return {
+        'type': info_type,
+        'kad': request.GET.get('kad', '').strip(),
+        'eid': request.GET.get('eid', '').strip(),
+        'kpk': request.GET.get('kpk', '').strip(),
+        'q': request.GET.get('q', '').strip(),
+        'period': _parse_period(request.GET.get('period')),
+        'limit': min(limit, CODE_LOOKUP_MAX_LIMIT),
+    }
+
+
+def _code_lookup_etag(request):
+    """Strong ETag derived from the catalog version and the normalized query."""
+    try:
+        params = _code_lookup_params(request)
+    except ValueError:
+        return None
+    catalog = get_code_catalog()
+    key = '|'.join([catalog.version] + [str(params[k]) for k in ('type', 'kad', 'eid', 'kpk', 'q', 'period', 'limit')])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _cache_lookups(view):
+    """Make the lookup results (200, and 304 on a matching ETag) cacheable, not the errors."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=CODE_LOOKUP_MAX_AGE)
+        return response
+    return wrapper
+
+
+@_cache_lookups
+@condition(etag_func=_code_lookup_etag)
+def code_lookup(request):
+    """
+    JSON lookup of KAD/EID/KPK codes for the APD form.
+
+    Returns the `type` codes appearing in an allowed combination that matches
+    any given kad/eid/kpk filters, prefix matched on the code with `q` and
+    capped with `limit`. `valid` tells whether the filters match at least one
+    allowed combination. With `period` (YYYYMM or YYYY-MM) only combinations
+    valid in that month count.
+    """
+    try:
+        params = _code_lookup_params(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    catalog = get_code_catalog()
+    info_type = params['type']
+    filters = {k: params[k] for k in ('kad', 'eid', 'kpk', 'period')}
+
+    appropriate_codes = catalog.lookup(info_type, **filters)
+    codes = [code for code in catalog.prefix_search(info_type, params['q']) if code in appropriate_codes]
+
+    descriptions = catalog.descriptions[info_type]
+    results = [
+        {'code': code, 'description': descriptions[code]}
+        for code in codes[:params['limit']]
+    ]
+
+    data = {
+        'type': info_type,
+        'version': catalog.version,
+        'valid': catalog.exists(**filters),
+        'count': len(codes),
+        'truncated': len(codes) > params['limit'],
+        'results': results,
+    }
+    return JsonResponse(data)
+
+
 @role_required(['EMP'])
 def current_obligations(request):
     # Retrieve organization details for the context
     try:
-        employer_org = Organization.objects.get(name='METLEN ENERGY & METALS S.A.')
-        party = employer_org.party_id
-        
-        # Get Account for the employer role (Current Contributions account id=1)
-        role_employer = PartyRole.objects.get(party_id=party, role_type_id=2)
-        account = Account.objects.filter(party_role_id=role_employer, account_id=1).first()
-        
-        if not account:
+        employer_org = get_employer_organization(request)
+        if not employer_org:
+            raise Organization.DoesNotExist("Employer organization not found")
+        role_employer = request.party_context.party_role
+
+        # Current Contributions account of the employer role
+        if not Account.objects.filter(party_role_id=role_employer, account_type_id__account_type_id=ACCOUNT_TYPE_CURRENT).exists():
             raise Account.DoesNotExist("Current Contributions account not found")
-        
-        # Fetch obligations through transactions
-        transactions = AccountTransaction.objects.filter(account_id=account).order_by('-transaction_date')
-        
-        obligations_list = []
-        total_debt = 0
-        
-        for tx in transactions:
-            # For each transaction, find associated obligations that have a non-zero balance
-            tx_obligations = TransactionObligation.objects.filter(
-                transaction_id=tx,
-                obligationbalance__balance__gt=0
-            ).select_related('transaction_id')
-            
-            for obl in tx_obligations:
-                # Use actual balance from ObligationBalance
-                try:
-                    obl_bal = ObligationBalance.objects.get(obligation_id=obl)
-                    amount = obl_bal.balance
-                    
-                    total_debt += amount
-                    
-                    obligations_list.append({
-                        'period': f"{obl.month:02d}/{obl.year}",
-                        'description': obl.obligation_description,
-                        'type': obl.obligation_type,
-                        'amount': amount,
-                        'rf_code': obl.rf_code,
-                        'due_date': datetime(obl.year, obl.month, 28) + timedelta(days=32)
-                    })
-                except ObligationBalance.DoesNotExist:
-                    continue
-        
+
+        # Obligations with a non-zero balance, one joined query (see core/ledger.py)
+        balances = obligations_ledger(role_employer, account_type_id=ACCOUNT_TYPE_CURRENT, positive_only=True)
+        obligations_list = ledger_rows(balances)
+        total_debt = ledger_totals(balances)['total']
+
         company_name = employer_org.name
     except (Organization.DoesNotExist, PartyRole.DoesNotExist, Account.DoesNotExist) as e:
         company_name = "METLEN ENERGY & METALS S.A."
@@ -731,38 +670,14 @@ def current_obligations(request):
 @role_required(['EMP'])
 def unsettled_overdue(request):
     try:
-        employer_org = Organization.objects.get(name='METLEN ENERGY & METALS S.A.')
-        party = employer_org.party_id
-        role_employer = PartyRole.objects.get(party_id=party, role_type_id=2)
-        
-        # Account 3: Unsettled Overdue (KEAO)
-        account = Account.objects.filter(party_role_id=role_employer, account_id=3).first()
-        
-        if not account:
-            raise Account.DoesNotExist("Unsettled Overdue account not found")
+        employer_org = get_employer_organization(request)
+        role_employer = request.party_context.party_role
+
+        # Unsettled Overdue (KEAO) obligations with an outstanding balance
+        balances = obligations_ledger(role_employer, account_type_id=ACCOUNT_TYPE_UNSETTLED, positive_only=True)
+        debts_list = ledger_rows(balances)
+        total_unsettled = ledger_totals(balances)['total']
 
-        transactions = AccountTransaction.objects.filter(account_id=account).order_by('-transaction_date')
-        debts_list = []
-        total_unsettled = 0
-        
-        for tx in transactions:
-            tx_obligations = TransactionObligation.objects.filter(transaction_id=tx).select_related('transaction_id')
-            for obl in tx_obligations:
-                try:
-                    obl_bal = ObligationBalance.objects.get(obligation_id=obl)
-                    amount = obl_bal.balance
-                    if amount > 0:
-                        total_unsettled += amount
-                        debts_list.append({
-                            'period': f"{obl.month:02d}/{obl.year}",
-                            'description': obl.obligation_description,
-                            'type': obl.obligation_type,
-                            'amount': amount,
-                            'reference': obl.rf_code or 'N/A'
-                        })
-                except ObligationBalance.DoesNotExist:
-                    continue
-                    
         company_name = employer_org.name
     except Exception as e:
         company_name = "METLEN ENERGY & METALS S.A."
@@ -782,35 +697,15 @@ def unsettled_overdue(request):
 def settled_overdue(request):
     debts_list = []
     total_settled = 0
+    employer_org = None
     try:
-        # Get current employer (seeded default)
-        employer_org = Organization.objects.filter(name='METLEN ENERGY & METALS S.A.').first()
-        employer_party = employer_org.party_id
-        role_employer = PartyRole.objects.get(party_id=employer_party, role_type_id=2)
-        
-        # Account 2: Settled Overdue (KEAO)
-        account = Account.objects.filter(party_role_id=role_employer, account_id=2).first()
-        
-        if account:
-            transactions = AccountTransaction.objects.filter(account_id=account).order_by('-transaction_date')
-            
-            for tx in transactions:
-                tx_obligations = TransactionObligation.objects.filter(transaction_id=tx)
-                for obl in tx_obligations:
-                    try:
-                        obl_bal = ObligationBalance.objects.get(obligation_id=obl)
-                        amount = obl_bal.balance
-                        if amount > 0:
-                            total_settled += amount
-                            debts_list.append({
-                                'period': f"{obl.month:02d}/{obl.year}",
-                                'description': obl.obligation_description,
-                                'type': obl.obligation_type,
-                                'amount': amount,
-                                'rf_code': obl.rf_code or 'N/A'
-                            })
-                    except ObligationBalance.DoesNotExist:
-                        pass
+        employer_org = get_employer_organization(request)
+        role_employer = request.party_context.party_role
+
+        # Settled Overdue (KEAO) obligations with an outstanding balance
+        balances = obligations_ledger(role_employer, account_type_id=ACCOUNT_TYPE_SETTLED, positive_only=True)
+        debts_list = ledger_rows(balances)
+        total_settled = ledger_totals(balances)['total']
 
     except Exception as e:
         print(f"Error in settled_overdue view: {e}")
@@ -818,7 +713,7 @@ def settled_overdue(request):
     context = {
         'total_settled': total_settled,
         'debts': debts_list,
-        'company_name': employer_org.name if 'employer_org' in locals() and employer_org else "Employer"
+        'company_name': employer_org.name if employer_org else "Employer"
     }
     return render(request, "core/settled_overdue.html", context)
 
@@ -890,85 +785,148 @@ def get_last_contribution(request):
         return JsonResponse({'error': 'AMA is required'}, status=400)
 
     try:
-        # 1. Find the Party Identifier Type for AMA
-        ama_type = PartyIdentifierType.objects.filter(identifier_type_code='AMA').first()
-        if not ama_type:
-            return JsonResponse({'error': 'AMA type not found'}, status=500)
-
-        # 2. Find the Party Identifier with this AMA
-        identifier = PartyIdentifier.objects.filter(
-            identifier_type_id=ama_type.identifier_type_id,
-            identifier_value=ama
-        ).first()
-
-        if not identifier:
-            return JsonResponse({'error': 'Employee not found'}, status=404)
-
-        party = identifier.party_id
-
-        # 3. Find the most recent Insurance Contribution for this Party
-        # We order by end_date descending to get the latest coverage
-        last_contribution = InsuranceContribution.objects.filter(party_id=party).order_by('-end_date').first()
-
-        if not last_contribution:
-            return JsonResponse({'error': 'No previous contributions found for this employee'}, status=404)
-
-        data = {
-            'coverage_package_id': last_contribution.coverage_package_id,
-            'earning_type_id': last_contribution.earning_type_id,
-            'insurance_days': last_contribution.insurance_days,
-            'gross_earnings': str(last_contribution.gross_earnings), # Decimal to string
-            'total_contribution': str(last_contribution.total_contribution),
-        }
-        
-        return JsonResponse(data)
+        # 1. AMA -> party (cached, see core/prefill.py)
+        party_pk = resolve_ama(ama)
+        if party_pk is None:
+            return JsonResponse({'error': EMPLOYEE_NOT_FOUND}, status=404)
+
+        # 2. Pointer to the party's most recent contribution (one primary-key read)
+        latest = get_latest_contribution(party_pk)
+        if latest is None:
+            return JsonResponse({'error': NO_CONTRIBUTIONS}, status=404)
+
+        return JsonResponse(latest.as_prefill())
 
     except Exception as e:
         print(f"Error in get_last_contribution: {e}")
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 
+@role_required(['EMP'])
+def get_last_contributions(request):
+    """
+    Batch get_last_contribution, streamed as JSON lines (one per employee).
+    AMAs come from ?ama= (repeated or comma separated) or, for long lists, a
+    POST body {"amas": [...]}; without AMAs, all active employees of the
+    logged in employer. AMAs of other parties are reported as not found.
+    """
+    if request.method == 'POST':
+        try:
+            amas = json.loads(request.body or b'{}').get('amas')
+        except (ValueError, AttributeError):
+            return JsonResponse({'error': 'Body must be a JSON object'}, status=400)
+        if amas is not None and not isinstance(amas, list):
+            return JsonResponse({'error': 'amas must be a list'}, status=400)
+    else:
+        amas = [ama for value in request.GET.getlist('ama') for ama in value.split(',')] or None
+    if amas is not None:
+        amas = [str(ama).strip() for ama in amas if str(ama).strip()]
+        if len(amas) > PREFILL_MAX_AMAS:
+            return JsonResponse({'error': f'At most {PREFILL_MAX_AMAS} AMAs per request'}, status=400)
+
+    rows = iter_last_contributions(request.party_context.party_role_pk, amas=amas)
+    return StreamingHttpResponse(iter_json_lines(rows), content_type='application/x-ndjson')
+
+
 @role_required(['EMP'])
 def payments_screen(request):
     """
     View for the Payment Screen dashboard.
     """
-    # Mock data for current obligations
-    debts = {
-        'current': 1250.45,
-        'overdue_keao_settled': 450.00,
-        'overdue_keao_unsettled': 153.50,
-        'total': 1853.95
+    # Current obligations, materialized in EmployerDebtSummary (see core/ledger.py)
+    employer_org = get_employer_organization(request)
+    debts = get_debt_summary(request.party_context.party)
+
+    # Payments are posted from confirmed inflows only: bank statement
+    # reconciliation (core/reconciliation.py) or `manage.py post_payments`
+    party_role = request.party_context.party_role_pk
+    account_types = {
+        ACCOUNT_TYPE_CURRENT: 'Current Obligations',
+        ACCOUNT_TYPE_SETTLED: 'Settled Overdue',
+        ACCOUNT_TYPE_UNSETTLED: 'Unsettled Overdue',
     }
-
-    # Mock data for transaction history
-    payment_history = [
-        {
-            'date': '2023-12-01',
-            'amount': 300.00,
-            'reference': 'RF912023120000001',
-            'status': 'Completed',
-            'type': 'Current Obligations'
-        },
+    history = [
         {
-            'date': '2023-11-15',
-            'amount': 75.13,
-            'reference': 'RF912023119999991',
-            'status': 'Completed',
-            'type': 'Settled Overdue'
-        },
-        {
-            'date': '2023-10-30',
-            'amount': 500.00,
-            'reference': 'RF912023100000002',
-            'status': 'Completed',
-            'type': 'Current Obligations'
-        },
+            'date': timezone.localtime(payment.creation_date).strftime('%Y-%m-%d'),
+            'amount': payment.amount,
+            'reference': payment.rf_code or payment.reference or '-',
+            'status': 'Completed' if payment.allocated_amount == payment.amount else 'Partially allocated',
+            'type': account_types.get(
+                payment.account_transaction_id.account_id.account_type_id.account_type_id,
+                payment.account_transaction_id.account_id.account_type_id.account_type_description,
+            ),
+        }
+        for payment in payment_history(party_role)
     ]
 
     context = {
         'debts': debts,
-        'payment_history': payment_history,
-        'company_name': "METLEN ENERGY & METALS S.A."  # Using primary organization for development
+        'payment_history': history,
+        'company_name': employer_org.name if employer_org else "METLEN ENERGY & METALS S.A."
     }
     return render(request, "core/payments.html", context)
+
+
+def _statement_status(statement):
+    return {
+        'pk': statement.pk,
+        'file_name': statement.file_name,
+        'format': statement.file_format,
+        'state': statement.state,
+        'progress': statement.progress,
+        'lines_total': statement.lines_total,
+        'lines_processed': statement.lines_processed,
+        'lines_matched': statement.lines_matched,
+        'lines_partial': statement.lines_partial,
+        'lines_unmatched': statement.lines_unmatched,
+        'amount_total': str(statement.amount_total),
+        'amount_posted': str(statement.amount_posted),
+        'error_message': statement.error_message,
+        'exceptions': [
+            {
+                'line': exception.line_number,
+                'reason': exception.reason,
+                'rf_code': exception.rf_code,
+                'amount': str(exception.amount) if exception.amount is not None else None,
+                'open_balance': str(exception.open_balance) if exception.open_balance is not None else None,
+                'posted': exception.payment_id is not None,
+            }
+            for exception in statement.exceptions.all()[:20]
+        ],
+    }
+
+
+@staff_member_required
+@require_POST
+def reconcile_statement(request):
+    """
+    Import a bank statement (multipart `statement`, CSV or camt.053) and
+    reconcile it by RF code (see core/reconciliation.py). JSON summary.
+    """
+    if 'statement' not in request.FILES:
+        return JsonResponse({'error': 'A statement file is required'}, status=400)
+    try:
+        statement = create_statement(request.FILES['statement'], request.user.username[:30])
+    except StatementFileError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if RECON_PROCESS_ON_UPLOAD:
+        try:
+            reconcile(statement)
+        except Exception:
+            # reconcile() recorded the FAILED state and the error; a resume picks up
+            # after the last committed batch
+            statement.refresh_from_db()
+            return JsonResponse(_statement_status(statement), status=500)
+    return JsonResponse(_statement_status(statement), status=201)
+
+
+@staff_member_required
+def bank_statement_status(request, pk):
+    """Progress and first exceptions of a bank statement (JSON, for polling)."""
+    return JsonResponse(_statement_status(get_object_or_404(BankStatement, pk=pk)))
+
+
+@staff_member_required
+def db_connections(request):
+    """Database connection (pool) metrics of the worker process serving the request (JSON, for monitoring)."""
+    return JsonResponse({'pid': os.getpid(), 'databases': connection_stats()})
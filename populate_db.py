@@ -1,5 +1,4 @@
 import os
-import csv
 import django
 import uuid
 from datetime import date, datetime
@@ -16,6 +15,8 @@ from core.models import (
     ObligationBalance, InsuranceContribution, InsuranceContributionBalance, 
     PartyRelationship, PartyRelationshipType
 )
+from core.journal import sync_balance_journal
+from core.loaders import ContributionLoader, parse_contribution_csv
 
 def populate():
     print("Starting comprehensive database population...")
@@ -258,115 +259,19 @@ def populate():
     # -------------------------------------------------------------------------
     csv_path = os.path.join(os.path.dirname(__file__), 'data', 'insurance_contributions.csv')
     
-    def seed_contributions(account_obj, party_obj, multiplier, id_offset):
+    def seed_contributions(account_obj, party_obj, multiplier):
         print(f"  - Seeding contributions for {party_obj.display_name} (Multiplier: {multiplier}x)...")
-        total_acc_balance = 0
+        # Batched upserts, see core/loaders.py (manage.py load_contributions)
+        loader = ContributionLoader(account_obj, party_obj, multiplier=multiplier)
         with open(csv_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for idx, row in enumerate(reader, start=1):
-                # Apply offset to IDs to ensure uniqueness across users
-                tx_id = idx + 10 + id_offset
-                obl_id = idx + 10 + id_offset
-                ic_id = idx + 10 + id_offset
-                
-                # Parse dates
-                start_parts = row['start_date'].split('/')
-                end_parts = row['end_date'].split('/')
-                start_date = date(int(start_parts[2]), int(start_parts[1]), int(start_parts[0]))
-                end_date = date(int(end_parts[2]), int(end_parts[1]), int(end_parts[0]))
-                
-                month = start_date.month
-                year = start_date.year
-                
-                # Parse numeric values and apply multiplier
-                gross_earnings = float(row['gross_earnings']) * multiplier
-                total_contribution = float(row['total_contribution']) * multiplier
-                days = int(row['days']) if row['days'] else 0
-                months = int(row['months']) if row['months'] else 0
-                earnings_type = int(row['earnings_type'])
-                branch_code = int(row['branch_code'])
-                
-                # Determine if paid (before Dec 2025)
-                # For demo, keeping the same paid logic
-                is_paid = start_date < date(2025, 11, 1)
-                balance = 0.00 if is_paid else total_contribution
-                
-                # Transaction
-                tx, _ = AccountTransaction.objects.update_or_create(
-                    account_transaction_id=tx_id,
-                    defaults={
-                        'account_id': account_obj, 
-                        'transaction_description': f'APD Submission {month:02d}/{year}', 
-                        'transaction_type': 'APD', 
-                        'debit_credit_flag': 'D', 
-                        'created_by': 'sys'
-                    }
-                )
-                TransactionBalance.objects.update_or_create(
-                    transaction_balance_id=tx_id,
-                    defaults={'transaction_id': tx, 'amount': total_contribution, 'balance': balance, 'created_by': 'sys'}
-                )
-        
-                # Obligation
-                # Generate unique RF code per user/contribution
-                rf_suffix = f"{id_offset + idx:05d}"
-                obl, _ = TransactionObligation.objects.update_or_create(
-                    obligation_id=obl_id,
-                    defaults={
-                        'transaction_id': tx, 
-                        'obligation_description': f'Contribution {month:02d}/{year}', 
-                        'obligation_type': 'CONTRIB', 
-                        'month': month, 
-                        'reference_month': month, 
-                        'year': year, 
-                        'rf_code': f'RF91{year}{month:02d}00{rf_suffix}', 
-                        'created_by': 'sys'
-                    }
-                )
-                ObligationBalance.objects.update_or_create(
-                    obligation_balance_id=obl_id,
-                    defaults={'obligation_id': obl, 'amount': total_contribution, 'balance': balance, 'created_by': 'sys'}
-                )
-        
-                # Insurance Contribution
-                ic, _ = InsuranceContribution.objects.update_or_create(
-                    insurance_contribution_id=ic_id,
-                    defaults={
-                        'account_transaction_id': tx, 
-                        'obligation_id': obl, 
-                        'party_id': party_obj, 
-                        'coverage_package_id': branch_code, 
-                        'insurance_days': days, 
-                        'start_date': start_date, 
-                        'end_date': end_date,
-                        'earning_type_id': earnings_type,
-                        'gross_earnings': gross_earnings,
-                        'total_contribution': total_contribution,
-                        'employer_id': 2001,
-                        'insurance_id': 1001,
-                        'created_by': 'sys'
-                    }
-                )
-                InsuranceContributionBalance.objects.update_or_create(
-                    insurance_contribution_balance_id=ic_id,
-                    defaults={'insurance_contribution_id': ic, 'amount': total_contribution, 'balance': balance, 'created_by': 'sys'}
-                )
-                
-                total_acc_balance += balance
-        
-        # Update account balance
-        account_obj.account_balance = total_acc_balance
-        account_obj.save()
-        AccountBalance.objects.update_or_create(
-            account_balance_id=account_obj.account_id,
-            defaults={'account_id': account_obj, 'balance': total_acc_balance, 'created_by': 'sys'}
-        )
+            loader.load(parse_contribution_csv(f))
+        loader.finalize()
 
-    # Seed for Insured 1 (Account 1, Offset 0, Multiplier 1.0)
-    seed_contributions(acc_current, party_insured, 1.0, 0)
+    # Seed for Insured 1 (Account 1, Multiplier 1.0)
+    seed_contributions(acc_current, party_insured, 1.0)
     
-    # Seed for Insured 2 (Account 4, Offset 1000, Multiplier 2.0)
-    seed_contributions(acc_insured_2, party_insured_2, 2.0, 1000)
+    # Seed for Insured 2 (Account 4, Multiplier 2.0)
+    seed_contributions(acc_insured_2, party_insured_2, 2.0)
     
 
     # Seed representative records for KEAO (Accounts 2 and 3)
@@ -431,6 +336,9 @@ def populate():
     obl_unset, _ = TransactionObligation.objects.get_or_create(obligation_id=31, defaults={'transaction_id': tx_unset, 'obligation_description': 'KEAO Natural Charges', 'obligation_type': 'KEAO_DEBT', 'month': 6, 'reference_month': 6, 'year': 2023, 'created_by': 'sys'})
     ObligationBalance.objects.update_or_create(obligation_balance_id=31, defaults={'obligation_id': obl_unset, 'amount': 153.50, 'balance': 153.50, 'created_by': 'sys'})
 
+    # Journal the seeded account balances (core/journal.py)
+    sync_balance_journal(Account.objects.values_list('pk', flat=True), source='LOAD')
+
     print("\nDatabase successfully populated with comprehensive scenario!")
     print("Credentials:")
     print("  - Insured: insured_user / password123")
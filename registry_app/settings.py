@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -96,6 +97,58 @@ DATABASES = {
     }
 }
 
+# Connection reuse (see core/database.py for the pool metrics)
+# With psycopg_pool installed (pip install "psycopg[pool]") every worker
+# process keeps a pool of connections; without it connections persist for
+# DATABASE_CONN_MAX_AGE seconds. Either way they are health checked
+# (CONN_HEALTH_CHECKS) before being reused. Size the pool for the threads of
+# a worker: the async dashboard views use up to one connection per lookup
+# group (core/dashboards.py).
+#
+# Behind a transaction-mode pooler (PgBouncer pool_mode=transaction) set
+# DATABASE_TRANSACTION_POOLER: consecutive transactions may run on different
+# server connections, so server-side cursors and prepared statements are
+# turned off (streaming exports then page through their rows, see
+# core/database.py).
+
+DATABASE_POOL = {
+    "min_size": 2,
+    "max_size": 10,
+    "timeout": 10,          # seconds to wait for a free connection
+    "max_idle": 5 * 60,     # close connections idle this long (above min_size)
+    "max_lifetime": 60 * 60,
+}
+DATABASE_CONN_MAX_AGE = 60
+DATABASE_TRANSACTION_POOLER = False
+
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+if find_spec("psycopg_pool") is not None:
+    DATABASES["default"]["OPTIONS"] = {"pool": DATABASE_POOL}
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = DATABASE_CONN_MAX_AGE
+
+if DATABASE_TRANSACTION_POOLER:
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+    DATABASES["default"].setdefault("OPTIONS", {})["prepare_threshold"] = None
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Used for the per-user role cache (core/roles.py), the generations of the
+# AMA lookups (core/prefill.py) and the employer directory (core/employers.py),
+# and the dashboard identity fragments (core/fragments.py). The local-memory
+# backend is per process: when running several workers point this at a shared
+# backend (Redis/Memcached) so signal-driven invalidation reaches every worker.
+# Fragments are not cached at all in a local-memory backend.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "registry-app",
+    }
+}
+
+PARTY_ROLE_CACHE_TIMEOUT = 60 * 60  # seconds
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
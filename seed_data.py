@@ -10,6 +10,8 @@ from django.contrib.auth.models import User
 from core.models import Client, Party, PartyRole, PartyRoleType, PartyIdentifier, PartyIdentifierType, Person, Organization, Address, Account, AccountType, AccountTransaction, TransactionObligation, InsuranceContribution, ObligationBalance, PartyRelationship, PartyRelationshipType
 from datetime import date, datetime
 
+from core.journal import sync_balance_journal
+
 def seed():
     # 1. Ensure we have a User
     user, created = User.objects.get_or_create(username='seed_user', email='seed@example.com')
@@ -401,6 +403,9 @@ def seed():
         }
     )
 
+    # Journal the seeded account balances (core/journal.py)
+    sync_balance_journal([account_employer.pk], source='LOAD')
+
     print("Database seeded successfully with Party Relationship data!")
 
 if __name__ == '__main__':